@@ -1,18 +1,88 @@
 import json
+import os
 from datetime import datetime, UTC
 from pathlib import Path
+from typing import Any, Dict, List
 from .config import LOG_PATH
+from .models import Alert
 
 
-def log_alert(kind: str, message: str, payload: dict | None = None, severity: str = "info") -> None:
-    entry = {
+def _entry(kind: str, message: str, payload: dict | None, severity: str) -> Dict[str, Any]:
+    return {
         "at": datetime.now(UTC).isoformat() + "Z",
         "type": kind,
         "severity": severity,
         "message": message,
         "payload": payload or {},
     }
+
+
+def _append_lines(path: Path, entries: List[Dict[str, Any]]) -> None:
+    """Append entries as JSONL in a single O_APPEND write, then fsync."""
+    data = "".join(json.dumps(e) + "\n" for e in entries).encode("utf-8")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def log_alert(kind: str, message: str, payload: dict | None = None, severity: str = "info") -> None:
+    entry = _entry(kind, message, payload, severity)
     p = Path(LOG_PATH)
     p.parent.mkdir(parents=True, exist_ok=True)
     with p.open("a", encoding="utf-8") as f:
         f.write(json.dumps(entry) + "\n")
+
+
+class AlertSink:
+    """Collects alerts for one rules run and writes them out together.
+
+    ``log`` buffers a JSONL entry (same shape as log_alert) and ``record`` an
+    ``alerts`` row. ``flush`` commits the rows in one transaction, then appends
+    every line in one write + fsync; if the commit fails nothing is written and
+    the buffer is kept. Used as a context manager it flushes on exit, also when
+    the run raises, so alerts raised before the failure are not lost.
+    """
+
+    def __init__(self, db=None, log_path: str | Path | None = None):
+        self.db = db
+        self.path = Path(log_path or LOG_PATH)
+        self.entries: List[Dict[str, Any]] = []
+        self.rows: List[Dict[str, Any]] = []
+
+    def log(self, kind: str, message: str, payload: dict | None = None, severity: str = "info") -> None:
+        self.entries.append(_entry(kind, message, payload, severity))
+
+    def record(self, portfolio_id: int, asset_id: int, type: str, message: str, severity: str = "info") -> None:
+        self.rows.append(
+            {"portfolio_id": portfolio_id, "asset_id": asset_id, "type": type, "message": message, "severity": severity}
+        )
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def flush(self) -> int:
+        """Write buffered rows and lines. Returns the number of JSONL entries written."""
+        if self.rows and self.db is not None:
+            self.db.add_all(Alert(**row) for row in self.rows)
+            self.db.commit()
+        self.rows = []
+        written = len(self.entries)
+        if self.entries:
+            _append_lines(self.path, self.entries)
+        self.entries = []
+        return written
+
+    def __enter__(self) -> "AlertSink":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is not None and self.db is not None:
+            # Drop whatever half-done work the failure left in the session
+            self.db.rollback()
+        self.flush()
@@ -0,0 +1,197 @@
+from __future__ import annotations
+import math
+import os
+import time
+from datetime import datetime, timedelta, UTC
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as pads
+import pyarrow.parquet as pq
+from sqlalchemy import bindparam, text
+
+from . import db as _db
+from .buckets import bucket_start
+from .config import ARCHIVE_DIR, ARCHIVE_AFTER_DAYS
+
+# One Parquet file per calendar month of cold prices rows:
+#   <ARCHIVE_DIR>/prices/YYYY-MM.parquet  (asset_id, ccy, price, at), sorted by asset_id, ccy, at
+_SCHEMA = pa.schema([
+    ("asset_id", pa.int64()),
+    ("ccy", pa.string()),
+    ("price", pa.float64()),
+    ("at", pa.timestamp("us")),
+])
+_KEYS = ["asset_id", "ccy", "at"]
+
+
+def _naive(dt: datetime) -> datetime:
+    return dt.astimezone(UTC).replace(tzinfo=None) if dt.tzinfo else dt
+
+
+def _ts(dt: datetime) -> str:
+    # Same text format SQLAlchemy uses for DateTime columns on SQLite
+    return dt.strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+def _prices_dir(archive_dir: str | Path | None) -> Path:
+    return Path(archive_dir or ARCHIVE_DIR) / "prices"
+
+
+def _month_path(base: Path, month: int) -> Path:
+    return base / f"{bucket_start('month', month):%Y-%m}.parquet"
+
+
+def _parse_at(values: Iterable[str]) -> np.ndarray:
+    return np.array(list(values), dtype="datetime64[us]")
+
+
+def _table(rows: List[Tuple[int, str, float, str]]) -> pa.Table:
+    return pa.table(
+        {
+            "asset_id": np.array([r[0] for r in rows], dtype=np.int64),
+            "ccy": [r[1] for r in rows],
+            "price": np.array([r[2] for r in rows], dtype=np.float64),
+            "at": _parse_at(r[3] for r in rows),
+        },
+        schema=_SCHEMA,
+    )
+
+
+def _merge_month(path: Path, new: pa.Table) -> int:
+    """Write `new` into the month file, replacing rows with the same key. The file
+    is rewritten via a temp file + rename so readers never see a partial write."""
+    if path.exists():
+        old = pq.read_table(path, schema=_SCHEMA)
+        # Keep archived rows whose key is not being rewritten (anti-join on the key)
+        kept = old.join(new.select(_KEYS), keys=_KEYS, join_type="left anti")
+        new = pa.concat_tables([kept.select(_SCHEMA.names).cast(_SCHEMA), new])
+    new = new.sort_by([(k, "ascending") for k in _KEYS])
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".parquet.tmp")
+    pq.write_table(new, tmp, compression="zstd")
+    os.replace(tmp, path)
+    return new.num_rows
+
+
+def archive_cold(now: datetime | None = None, bind=None, archive_dir: str | Path | None = None,
+                 after_days: float | None = None) -> Dict[str, Any]:
+    """Move prices rows from whole months older than ARCHIVE_AFTER_DAYS into
+    per-month Parquet files, then delete them from SQLite.
+
+    Only rows already folded into the OHLC rollups (id <= compaction_state.rollup_id)
+    are moved, so run compaction first. Returns rows moved, month files written,
+    the cutoff and seconds.
+    """
+    t0 = time.perf_counter()
+    now = _naive(now or datetime.now(UTC))
+    days = ARCHIVE_AFTER_DAYS if after_days is None else after_days
+    edge = now - timedelta(days=days)
+    cutoff = datetime(edge.year, edge.month, 1)
+    base = _prices_dir(archive_dir)
+    bind = bind or _db.engine
+
+    report: Dict[str, Any] = {"rows": 0, "months": [], "cutoff": cutoff.isoformat()}
+    # Read, write the Parquet files, then delete in a short transaction of its own so
+    # the SQLite write lock is not held across the file I/O
+    with bind.connect() as conn:
+        rolled = conn.exec_driver_sql(
+            "SELECT COALESCE(rollup_id, 0) FROM compaction_state WHERE table_name = 'prices'"
+        ).scalar() or 0
+        # Never archive the newest row: SQLite would hand its id out again, below the
+        # compaction/rollup watermarks
+        upto = min(rolled, conn.exec_driver_sql("SELECT COALESCE(MAX(id), 0) - 1 FROM prices").scalar())
+        params = (_ts(cutoff), upto)
+        rows = conn.exec_driver_sql(
+            "SELECT month_bucket, asset_id, ccy, price, at FROM prices "
+            "WHERE at < ? AND id <= ? ORDER BY month_bucket",
+            params,
+        ).fetchall()
+    if not rows:
+        report["seconds"] = round(time.perf_counter() - t0, 4)
+        return report
+    by_month: Dict[int, List[Tuple[int, str, float, str]]] = {}
+    for month, asset_id, ccy, price, at in rows:
+        by_month.setdefault(month, []).append((asset_id, ccy, price, at))
+    for month, chunk in sorted(by_month.items()):
+        _merge_month(_month_path(base, month), _table(chunk))
+        report["months"].append(f"{bucket_start('month', month):%Y-%m}")
+    # Files are durable before the rows go; a failure here leaves both copies, which
+    # the reader resolves in favour of SQLite. Rows changed since the read (edited or
+    # compacted away) leave the whole range in place: the next pass archives it again.
+    digest = (len(rows), sum(r[3] for r in rows))
+    with bind.begin() as conn:
+        now_digest = conn.exec_driver_sql(
+            "SELECT COUNT(*), COALESCE(SUM(price), 0) FROM prices WHERE at < ? AND id <= ?", params
+        ).one()
+        if now_digest[0] == digest[0] and math.isclose(now_digest[1], digest[1], rel_tol=1e-12):
+            conn.exec_driver_sql("DELETE FROM prices WHERE at < ? AND id <= ?", params)
+            report["rows"] = len(rows)
+    report["seconds"] = round(time.perf_counter() - t0, 4)
+    return report
+
+
+def _archive_files(base: Path, start: datetime, end: datetime) -> List[str]:
+    if not base.exists():
+        return []
+    first, last = f"{start:%Y-%m}", f"{end:%Y-%m}"
+    return sorted(str(p) for p in base.glob("*.parquet") if first <= p.stem <= last)
+
+
+def load_price_history(asset_ids: Iterable[int], start: datetime, end: datetime, ccy: str = "USD",
+                       bind=None, archive_dir: str | Path | None = None) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+    """Price series for [start, end) per asset as (at: datetime64[us] naive UTC,
+    price: float64) arrays sorted by time, read from the Parquet archive and the
+    live prices table together. Where both hold the same timestamp the SQLite
+    row wins. Assets without data map to empty arrays.
+    """
+    ids = sorted({int(a) for a in asset_ids})
+    if not ids:
+        return {}
+    start, end = _naive(start), _naive(end)
+    parts: Dict[int, List[Tuple[np.ndarray, np.ndarray]]] = {a: [] for a in ids}
+
+    files = _archive_files(_prices_dir(archive_dir), start, end)
+    if files:
+        lo, hi = pa.scalar(start, pa.timestamp("us")), pa.scalar(end, pa.timestamp("us"))
+        flt = (
+            pads.field("asset_id").isin(ids) & (pads.field("ccy") == ccy)
+            & (pads.field("at") >= lo) & (pads.field("at") < hi)
+        )
+        cold = pads.dataset(files, schema=_SCHEMA, format="parquet").to_table(filter=flt)
+        a_ids = cold.column("asset_id").to_numpy()
+        a_at = cold.column("at").to_numpy()
+        a_px = cold.column("price").to_numpy()
+        for a in np.unique(a_ids):
+            m = a_ids == a
+            parts[int(a)].append((a_at[m], a_px[m]))
+
+    stmt = text(
+        "SELECT asset_id, at, price FROM prices "
+        "WHERE ccy = :ccy AND asset_id IN :ids AND at >= :lo AND at < :hi ORDER BY asset_id, at"
+    ).bindparams(bindparam("ids", expanding=True))
+    with (bind or _db.engine).connect() as conn:
+        hot = conn.execute(stmt, {"ccy": ccy, "ids": ids, "lo": _ts(start), "hi": _ts(end)}).fetchall()
+    if hot:
+        h_ids = np.array([r[0] for r in hot], dtype=np.int64)
+        h_at = _parse_at(r[1] for r in hot)
+        h_px = np.array([r[2] for r in hot], dtype=np.float64)
+        for a in np.unique(h_ids):
+            m = h_ids == a
+            parts[int(a)].append((h_at[m], h_px[m]))
+
+    out: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+    for a in ids:
+        if not parts[a]:
+            out[a] = (np.empty(0, dtype="datetime64[us]"), np.empty(0, dtype=np.float64))
+            continue
+        at = np.concatenate([p[0] for p in parts[a]]).astype("datetime64[us]")
+        px = np.concatenate([p[1] for p in parts[a]]).astype(np.float64)
+        # Stable sort keeps archive-before-SQLite order within equal timestamps; keep the last
+        order = np.argsort(at, kind="stable")
+        at, px = at[order], px[order]
+        keep = np.append(at[1:] != at[:-1], True) if len(at) else np.empty(0, dtype=bool)
+        out[a] = (at[keep], px[keep])
+    return out
@@ -1,12 +1,18 @@
 from __future__ import annotations
-from datetime import datetime, timezone
-from typing import Dict, List, Tuple
+import asyncio
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Tuple
 
+from sqlalchemy import func
+
+from .config import BACKFILL_FRESH_MINUTES
 from .db import SessionLocal
-from .models import Asset, Price, FxRate
+from .models import Asset, Price, FxRate, BackfillJob, BackfillTask
 from .price_fetcher import ids_from_positions, read_mapping_ids
-from .clients import CoingeckoClient
+from .clients import CoingeckoClient, AsyncCoingeckoClient
 from .compaction import compact_all
+from .bulk import insert_prices, insert_fx
 
 
 def _ms_to_dt(ms: int) -> datetime:
@@ -34,61 +40,318 @@ def _upsert_assets_by_ids(ids: List[str]) -> Dict[str, int]:
     return m
 
 
-def backfill_prices(days: str = "365", vs_list: List[str] | Tuple[str, ...] = ("USD", "GBP", "BTC")) -> None:
+@dataclass
+class IncrementalPlan:
+    """What an incremental backfill still needs. ``asset_since`` / ``fx_since`` map a
+    cg_id or FX base to the newest stored point (fetch strictly after it), or None for
+    the full window; series that are already fresh are left out and listed in ``skipped``.
+    """
+    now: datetime
+    asset_since: Dict[str, datetime | None] = field(default_factory=dict)
+    fx_since: Dict[str, datetime | None] = field(default_factory=dict)
+    skipped: List[str] = field(default_factory=list)
+
+
+def latest_price_times(db, asset_ids: List[int], ccy: str = "USD") -> Dict[int, datetime]:
+    """Newest stored price time per asset, in one grouped query."""
+    if not asset_ids:
+        return {}
+    rows = (
+        db.query(Price.asset_id, func.max(Price.at))
+        .filter(Price.asset_id.in_(asset_ids), Price.ccy == ccy)
+        .group_by(Price.asset_id)
+        .all()
+    )
+    return {aid: at for aid, at in rows if at is not None}
+
+
+def latest_fx_times(db, quote: str = "USD") -> Dict[str, datetime]:
+    """Newest stored FX time per base currency against ``quote``."""
+    rows = (
+        db.query(FxRate.base_ccy, func.max(FxRate.at))
+        .filter(FxRate.quote_ccy == quote)
+        .group_by(FxRate.base_ccy)
+        .all()
+    )
+    return {base: at for base, at in rows if at is not None}
+
+
+def plan_incremental(ids: List[str], id_map: Dict[str, int], days: str, now: datetime | None = None) -> IncrementalPlan:
+    now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+    window_start = now - timedelta(days=float(days))
+    fresh_after = now - timedelta(minutes=BACKFILL_FRESH_MINUTES)
+    plan = IncrementalPlan(now=now)
+
+    def since(latest: datetime | None) -> datetime | None:
+        if latest is None or latest < window_start:
+            return None
+        return latest
+
+    with SessionLocal() as db:
+        price_times = latest_price_times(db, [id_map[i] for i in ids if id_map.get(i)])
+        fx_times = latest_fx_times(db)
+    for cg_id in ids:
+        aid = id_map.get(cg_id)
+        if not aid:
+            continue
+        latest = price_times.get(aid)
+        if latest is not None and latest >= fresh_after:
+            plan.skipped.append(cg_id)
+            continue
+        plan.asset_since[cg_id] = since(latest)
+    for base in ("GBP", "BTC"):
+        latest = fx_times.get(base)
+        if latest is not None and latest >= fresh_after:
+            plan.skipped.append(f"{base}USD")
+            continue
+        plan.fx_since[base] = since(latest)
+    return plan
+
+
+def _to_ts(dt: datetime) -> int:
+    return int(dt.replace(tzinfo=timezone.utc).timestamp())
+
+
+def _chart(client, cg_id: str, vs: str, days: str, since: datetime | None, now: datetime | None):
+    """market_chart for the full window, or market_chart_range from ``since`` to ``now``.
+    Works for both the sync and async clients (returns the coroutine for the latter).
+    """
+    if since is None or now is None:
+        return client.market_chart(cg_id, vs_currency=vs, days=days)
+    return client.market_chart_range(cg_id, vs, _to_ts(since), _to_ts(now))
+
+
+def _series(chart: Dict, after: datetime | None = None) -> List[Tuple[int, float]]:
+    out = [(int(t), float(p)) for t, p in (chart or {}).get("prices", [])]
+    if after is not None:
+        after_ms = _to_ts(after) * 1000 + after.microsecond // 1000
+        out = [(t, p) for t, p in out if t > after_ms]
+    return out
+
+
+def _store_fx_series(db, btc_usd_series, usdc_usd_series, usdc_gbp_series) -> int:
+    # FX: BTCUSD
+    rows = [("BTC", "USD", btc_usd, _ms_to_dt(t_ms)) for t_ms, btc_usd in btc_usd_series]
+
+    # FX: GBPUSD via USDC (USD/GBP)
+    j = 0
+    for t_ms, usdc_usd in usdc_usd_series:
+        # advance pointer in GBP series to closest
+        while j + 1 < len(usdc_gbp_series) and abs(usdc_gbp_series[j + 1][0] - t_ms) <= abs(usdc_gbp_series[j][0] - t_ms):
+            j += 1
+        usdc_gbp = usdc_gbp_series[j][1] if usdc_gbp_series else 0.0
+        if usdc_usd and usdc_gbp:
+            rows.append(("GBP", "USD", usdc_usd / usdc_gbp, _ms_to_dt(t_ms)))
+    return insert_fx(db, rows)
+
+
+def _store_price_series(db, asset_id: int, series_usd: List[Tuple[int, float]]) -> int:
+    return insert_prices(db, ((asset_id, "USD", price, _ms_to_dt(t_ms)) for t_ms, price in series_usd))
+
+
+def _normalise_days(days: str) -> str:
+    # Coingecko free endpoints limit reliable ranges; constrain to 365 days max
+    if str(days).lower() == "max":
+        return "365"
+    return days
+
+
+def _full_plan(ids: List[str], id_map: Dict[str, int]) -> IncrementalPlan:
+    return IncrementalPlan(
+        now=None,
+        asset_since={cg_id: None for cg_id in ids if id_map.get(cg_id)},
+        fx_since={"GBP": None, "BTC": None},
+    )
+
+
+# Source charts per FX base: GBPUSD is derived from USDC in USD and GBP
+_FX_SOURCES = {"BTC": [("bitcoin", "usd")], "GBP": [("usd-coin", "usd"), ("usd-coin", "gbp")]}
+
+
+def _task_requests(key: str) -> List[Tuple[str, str]]:
+    """(cg_id, vs) charts needed by a journal task key."""
+    kind, _, ref = key.partition(":")
+    if kind == "fx":
+        return _FX_SOURCES[ref]
+    return [(ref, "usd")]
+
+
+def _open_job(days: str, incremental: bool, resume: bool, ids: List[str], id_map: Dict[str, int]) -> Tuple[int, str, List[str]]:
+    """Return (job_id, days, skipped). With ``resume`` the newest unfinished job is
+    reopened (its done tasks stay done, failed ones are retried) and its journalled
+    ``days`` wins over the caller's; otherwise a new job is journalled with one task
+    per asset / FX base still to fetch.
+    """
+    with SessionLocal() as db:
+        if resume:
+            job = (
+                db.query(BackfillJob)
+                .filter(BackfillJob.status != "done")
+                .order_by(BackfillJob.id.desc())
+                .first()
+            )
+            if job:
+                job.status = "running"
+                job.finished_at = None
+                db.commit()
+                return job.id, job.days, []
+        plan = plan_incremental(ids, id_map, days) if incremental else _full_plan(ids, id_map)
+        job = BackfillJob(days=str(days), incremental=incremental, status="running")
+        db.add(job)
+        db.flush()
+        keys = [(f"fx:{base}", since) for base, since in plan.fx_since.items()]
+        keys += [(f"asset:{cg_id}", since) for cg_id, since in plan.asset_since.items()]
+        for key, since in keys:
+            db.add(BackfillTask(job_id=job.id, key=key, range_from=since, range_to=plan.now))
+        db.commit()
+        return job.id, job.days, plan.skipped
+
+
+def _pending_tasks(db, job_id: int) -> List[BackfillTask]:
+    return (
+        db.query(BackfillTask)
+        .filter(BackfillTask.job_id == job_id, BackfillTask.status != "done")
+        .order_by(BackfillTask.key)
+        .all()
+    )
+
+
+def _fetch_task(client, task: BackfillTask, days: str, now: datetime) -> List:
+    """Chart calls for one task; with the async client these are coroutines."""
+    end = task.range_to or now
+    return [_chart(client, cg_id, vs, days, task.range_from, end if task.range_from else None) for cg_id, vs in _task_requests(task.key)]
+
+
+def _store_task(db, task: BackfillTask, charts: List[Dict], id_map: Dict[str, int]) -> int:
+    series = [_series(c, task.range_from) for c in charts]
+    kind, _, ref = task.key.partition(":")
+    if kind == "fx":
+        if ref == "BTC":
+            return _store_fx_series(db, series[0], [], [])
+        return _store_fx_series(db, [], series[0], series[1])
+    asset_id = id_map.get(ref)
+    if not asset_id:
+        raise LookupError(f"no asset for {ref}")
+    return _store_price_series(db, asset_id, series[0])
+
+
+def _checkpoint(db, task: BackfillTask, rows: int | None = None, error: BaseException | None = None) -> None:
+    """Record a task outcome. On success the task row commits together with its data."""
+    task.attempts = (task.attempts or 0) + 1
+    task.updated_at = datetime.now(timezone.utc)
+    if error is None:
+        task.status = "done"
+        task.rows = rows or 0
+        task.error = None
+    else:
+        task.status = "failed"
+        task.error = f"{type(error).__name__}: {error}"[:500]
+    db.commit()
+
+
+def _finish_job(db, job_id: int, skipped: List[str]) -> Dict[str, Any]:
+    tasks = db.query(BackfillTask).filter(BackfillTask.job_id == job_id).all()
+    failed = sorted(t.key for t in tasks if t.status != "done")
+    job = db.get(BackfillJob, job_id)
+    job.status = "failed" if failed else "done"
+    job.finished_at = datetime.now(timezone.utc)
+    db.commit()
+    return {
+        "job_id": job_id,
+        "status": job.status,
+        "tasks": len(tasks),
+        "done": len(tasks) - len(failed),
+        "failed": failed,
+        "skipped": skipped,
+        "rows": sum(t.rows or 0 for t in tasks),
+    }
+
+
+def backfill_prices(
+    days: str = "365",
+    vs_list: List[str] | Tuple[str, ...] = ("USD", "GBP", "BTC"),
+    incremental: bool = False,
+    resume: bool = False,
+) -> Dict[str, Any] | None:
     """Backfill USD prices and FX series (GBPUSD, BTCUSD) for portfolio assets.
     - days: Coingecko range, e.g. '30', '365'
     - vs_list: kept for API compatibility; only USD prices are stored, FX derived for GBP and BTC.
+    - incremental: fetch only points newer than each series' latest stored row
+      (via market_chart/range) and skip series that are already fresh.
+    - resume: continue the newest unfinished job from the backfill journal,
+      retrying only tasks that are not done.
+    Progress is journalled per asset / FX base in backfill_tasks; returns a summary.
     """
-    # Coingecko free endpoints limit reliable ranges; constrain to 365 days max
-    if str(days).lower() == "max":
-        days = "365"
+    days = _normalise_days(days)
     ids = ids_from_positions() or read_mapping_ids()
     if not ids:
-        return
+        return None
 
     client = CoingeckoClient()
 
     # Map cg_id -> asset_id
     id_map = _upsert_assets_by_ids(ids)
+    job_id, days, skipped = _open_job(days, incremental, resume, ids, id_map)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+
+    with SessionLocal() as db:
+        # FX first so a partial run still leaves usable conversion rates
+        tasks = sorted(_pending_tasks(db, job_id), key=lambda t: not t.key.startswith("fx:"))
+        for task in tasks:
+            try:
+                rows = _store_task(db, task, _fetch_task(client, task, days, now), id_map)
+                _checkpoint(db, task, rows=rows)
+            except Exception as e:
+                db.rollback()
+                _checkpoint(db, task, error=e)
+        summary = _finish_job(db, job_id, skipped)
+
+    # Compact after writes
+    if summary["rows"]:
+        compact_all()
+    return summary
 
-    # Prepare FX series: BTCUSD and GBPUSD (via USDC)
-    btc_chart_usd = client.market_chart("bitcoin", vs_currency="usd", days=days)
-    btc_usd_series = [(int(t), float(p)) for t, p in btc_chart_usd.get("prices", [])]
 
-    usdc_usd_chart = client.market_chart("usd-coin", vs_currency="usd", days=days)
-    usdc_gbp_chart = client.market_chart("usd-coin", vs_currency="gbp", days=days)
-    usdc_usd_series = [(int(t), float(p)) for t, p in usdc_usd_chart.get("prices", [])]
-    usdc_gbp_series = [(int(t), float(p)) for t, p in usdc_gbp_chart.get("prices", [])]
+async def backfill_prices_async(
+    days: str = "365",
+    vs_list: List[str] | Tuple[str, ...] = ("USD", "GBP", "BTC"),
+    concurrency: int | None = None,
+    incremental: bool = False,
+    resume: bool = False,
+) -> Dict[str, Any] | None:
+    """Async variant of backfill_prices: chart calls for all pending tasks run
+    concurrently (bounded by ``concurrency``), then each task is written and
+    checkpointed in the journal.
+    """
+    days = _normalise_days(days)
+    ids = ids_from_positions() or read_mapping_ids()
+    if not ids:
+        return None
+
+    client = AsyncCoingeckoClient(concurrency=concurrency)
+    id_map = _upsert_assets_by_ids(ids)
+    job_id, days, skipped = _open_job(days, incremental, resume, ids, id_map)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
 
     with SessionLocal() as db:
-        # Insert FX: BTCUSD
-        for t_ms, btc_usd in btc_usd_series:
-            db.add(FxRate(base_ccy="BTC", quote_ccy="USD", rate=btc_usd, at=_ms_to_dt(t_ms)))
-
-        # Insert FX: GBPUSD via USDC (USD/GBP)
-        j = 0
-        for t_ms, usdc_usd in usdc_usd_series:
-            # advance pointer in GBP series to closest
-            while j + 1 < len(usdc_gbp_series) and abs(usdc_gbp_series[j + 1][0] - t_ms) <= abs(usdc_gbp_series[j][0] - t_ms):
-                j += 1
-            usdc_gbp = usdc_gbp_series[j][1] if usdc_gbp_series else 0.0
-            if usdc_usd and usdc_gbp:
-                db.add(FxRate(base_ccy="GBP", quote_ccy="USD", rate=(usdc_usd / usdc_gbp), at=_ms_to_dt(t_ms)))
-
-        # Insert USD prices for each asset
-        for cg_id in ids:
+        tasks = sorted(_pending_tasks(db, job_id), key=lambda t: not t.key.startswith("fx:"))
+        calls = [_fetch_task(client, task, days, now) for task in tasks]
+        flat = await asyncio.gather(*(c for task_calls in calls for c in task_calls), return_exceptions=True)
+        pos = 0
+        for task, task_calls in zip(tasks, calls):
+            charts = flat[pos:pos + len(task_calls)]
+            pos += len(task_calls)
             try:
-                asset_id = id_map.get(cg_id)
-                if not asset_id:
-                    continue
-                chart_usd = client.market_chart(cg_id, vs_currency="usd", days=days)
-                series_usd = [(int(t), float(p)) for t, p in chart_usd.get("prices", [])]
-                for t_ms, price in series_usd:
-                    db.add(Price(asset_id=asset_id, ccy="USD", price=price, at=_ms_to_dt(t_ms)))
-                db.commit()
-            except Exception:
+                for chart in charts:
+                    if isinstance(chart, BaseException):
+                        raise chart
+                rows = _store_task(db, task, charts, id_map)
+                _checkpoint(db, task, rows=rows)
+            except Exception as e:
                 db.rollback()
-                continue
+                _checkpoint(db, task, error=e)
+        summary = _finish_job(db, job_id, skipped)
 
-    # Compact after writes
-    compact_all()
+    if summary["rows"]:
+        compact_all()
+    return summary
@@ -0,0 +1,54 @@
+from __future__ import annotations
+import calendar
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Tuple
+
+# Integer bucket keys stored on prices / fx_rates rows (UTC):
+#   hour_bucket  = epoch seconds // 3600
+#   day_bucket   = epoch seconds // 86400
+#   month_bucket = year * 12 + (month - 1)
+TIERS = ("hour", "day", "month")
+COLUMNS: Dict[str, str] = {tier: f"{tier}_bucket" for tier in TIERS}
+
+# Same keys computed in SQL from the stored `at` text (used by the migration)
+SQL_EXPR: Dict[str, str] = {
+    "hour": "CAST(strftime('%s', at) AS INTEGER) / 3600",
+    "day": "CAST(strftime('%s', at) AS INTEGER) / 86400",
+    "month": "CAST(strftime('%Y', at) AS INTEGER) * 12 + CAST(strftime('%m', at) AS INTEGER) - 1",
+}
+
+
+def _epoch(at: datetime) -> int:
+    # Naive datetimes are UTC throughout the DB
+    return calendar.timegm(at.utctimetuple())
+
+
+def hour_bucket(at: datetime) -> int:
+    return _epoch(at) // 3600
+
+
+def day_bucket(at: datetime) -> int:
+    return _epoch(at) // 86400
+
+
+def month_bucket(at: datetime) -> int:
+    if at.tzinfo is not None:
+        at = at.astimezone(timezone.utc)
+    return at.year * 12 + at.month - 1
+
+
+def bucket_keys(at: datetime) -> Tuple[int, int, int]:
+    return hour_bucket(at), day_bucket(at), month_bucket(at)
+
+
+def bucket_key(tier: str, at: datetime) -> int:
+    return {"hour": hour_bucket, "day": day_bucket, "month": month_bucket}[tier](at)
+
+
+def bucket_start(tier: str, key: int) -> datetime:
+    """Naive UTC start of a bucket."""
+    if tier == "hour":
+        return datetime(1970, 1, 1) + timedelta(hours=key)
+    if tier == "day":
+        return datetime(1970, 1, 1) + timedelta(days=key)
+    return datetime(key // 12, key % 12 + 1, 1)
@@ -0,0 +1,81 @@
+from __future__ import annotations
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple
+
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from .buckets import bucket_keys
+from .config import BULK_BATCH_SIZE
+from .coverage import Seen, mark_coverage, note
+from .models import Price, FxRate, LATEST_PRICE_UPSERT, LATEST_FX_UPSERT
+
+# (asset_id, ccy, price, at)
+PriceRow = Tuple[int, str, float, datetime]
+# (base_ccy, quote_ccy, rate, at)
+FxRow = Tuple[str, str, float, datetime]
+
+_PRICE_INSERT = sqlite_insert(Price.__table__).on_conflict_do_nothing(index_elements=["asset_id", "ccy", "at"])
+_FX_INSERT = sqlite_insert(FxRate.__table__).on_conflict_do_nothing(index_elements=["base_ccy", "quote_ccy", "at"])
+
+
+def _batches(rows: Iterable[dict], size: int) -> Iterator[List[dict]]:
+    batch: List[dict] = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _track_latest(rows: Iterable[dict], keys: Tuple[str, str], value: str, latest: Dict[tuple, dict],
+                  seen: Seen) -> Iterator[dict]:
+    """Pass rows through (adding their bucket keys) while remembering the newest row
+    per key and the hour / day buckets each key touched."""
+    for row in rows:
+        k = (row[keys[0]], row[keys[1]])
+        cur = latest.get(k)
+        if cur is None or row["at"] > cur["at"]:
+            latest[k] = {keys[0]: k[0], keys[1]: k[1], value: row[value], "at": row["at"]}
+        row["hour_bucket"], row["day_bucket"], row["month_bucket"] = bucket_keys(row["at"])
+        note(seen, k, row["hour_bucket"], row["day_bucket"])
+        yield row
+
+
+def _execute(db, stmt, rows: Iterable[dict], batch_size: int | None) -> int:
+    inserted = 0
+    for batch in _batches(rows, max(1, batch_size or BULK_BATCH_SIZE)):
+        result = db.execute(stmt, batch)
+        inserted += max(0, result.rowcount or 0)
+    return inserted
+
+
+def insert_prices(db, rows: Iterable[PriceRow | Sequence], batch_size: int | None = None) -> int:
+    """Insert (asset_id, ccy, price, at) rows with executemany, skipping any that
+    already exist for the same (asset_id, ccy, at), and advance latest_prices and
+    price_coverage in the same transaction. ``db`` is a Session or Connection; the caller commits.
+    Returns the number of rows inserted.
+    """
+    latest: Dict[tuple, dict] = {}
+    seen: Seen = {}
+    dicts = ({"asset_id": int(a), "ccy": c, "price": float(p), "at": at} for a, c, p, at in rows)
+    inserted = _execute(db, _PRICE_INSERT, _track_latest(dicts, ("asset_id", "ccy"), "price", latest, seen), batch_size)
+    if latest:
+        db.execute(LATEST_PRICE_UPSERT, list(latest.values()))
+    mark_coverage(db, "prices", seen)
+    return inserted
+
+
+def insert_fx(db, rows: Iterable[FxRow | Sequence], batch_size: int | None = None) -> int:
+    """Insert (base_ccy, quote_ccy, rate, at) rows, skipping existing pair/time keys,
+    and advance latest_fx and fx_coverage. The caller commits. Returns the number of rows inserted.
+    """
+    latest: Dict[tuple, dict] = {}
+    seen: Seen = {}
+    dicts = ({"base_ccy": b, "quote_ccy": q, "rate": float(r), "at": at} for b, q, r, at in rows)
+    inserted = _execute(db, _FX_INSERT, _track_latest(dicts, ("base_ccy", "quote_ccy"), "rate", latest, seen), batch_size)
+    if latest:
+        db.execute(LATEST_FX_UPSERT, list(latest.values()))
+    mark_coverage(db, "fx_rates", seen)
+    return inserted
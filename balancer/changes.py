@@ -0,0 +1,139 @@
+from __future__ import annotations
+import time
+from datetime import datetime, timedelta, UTC
+from typing import Any, Dict, List
+
+import numpy as np
+
+from . import db as _db
+from .models import PriceChange
+
+# Percentage price changes per asset and currency, precomputed after each price
+# fetch so the UI's /api/changes route reads one table instead of querying
+# every held asset per window. Semantics match the route: "now" is the newest
+# latest_prices timestamp; each window's reference is the newest USD price at
+# or before now - window; non-USD values divide by the <ccy>USD rate at or
+# before the same instant ("max" uses the first USD price on record).
+#
+# One statement reads every asset's latest, per-window and first USD price via
+# correlated subqueries answered from the (asset_id, ccy, at) index; the FX
+# series (small after compaction) are searched in memory. Months moved to the
+# Parquet archive (balancer.archive) were folded into prices_monthly first, and
+# a monthly open keeps its earliest price, so the first price is the earlier of
+# the oldest monthly open and the oldest raw row.
+
+WINDOWS: Dict[str, timedelta] = {
+    "h1": timedelta(hours=1),
+    "d1": timedelta(days=1),
+    "d7": timedelta(days=7),
+    "d30": timedelta(days=30),
+    "d60": timedelta(days=60),
+    "d90": timedelta(days=90),
+    "d365": timedelta(days=365),
+}
+# Column holding the change since the first stored price ("max" in the UI)
+SINCE_FIRST = "since_first"
+
+
+def _ts(dt: datetime) -> str:
+    # Same text format SQLAlchemy uses for DateTime columns on SQLite
+    return dt.strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+def _t64(values) -> np.ndarray:
+    return np.array([str(v).replace(" ", "T") if v is not None else "NaT" for v in values], dtype="datetime64[us]")
+
+
+def _pct(latest: np.ndarray, ref: np.ndarray) -> np.ndarray:
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out = (latest - ref) / ref * 100.0
+    return np.where((ref > 0) & np.isfinite(ref) & np.isfinite(latest), out, np.nan)
+
+
+def _fx_at(times: np.ndarray, rates: np.ndarray, at: np.ndarray) -> np.ndarray:
+    """Rate at or before each of ``at`` (NaN before the first rate or for NaT)."""
+    i = np.searchsorted(times, at, side="right") - 1
+    out = rates[np.clip(i, 0, max(len(rates) - 1, 0))] if len(rates) else np.full(len(at), np.nan)
+    return np.where((i >= 0) & ~np.isnat(at), out, np.nan)
+
+
+def compute_changes(bind=None) -> Dict[str, Any]:
+    """Rebuild price_changes for every asset with a USD price, in USD and every
+    currency with a <ccy>/USD rate. Returns rows written, currencies and seconds."""
+    t0 = time.perf_counter()
+    bind = bind or _db.engine
+    with bind.begin() as conn:
+        now_s = conn.exec_driver_sql("SELECT MAX(at) FROM latest_prices").scalar()
+        if now_s is None:
+            conn.exec_driver_sql("DELETE FROM price_changes")
+            return {"rows": 0, "currencies": [], "seconds": round(time.perf_counter() - t0, 4)}
+        now = datetime.fromisoformat(str(now_s))
+        refs = {name: _ts(now - w) for name, w in WINDOWS.items()}
+        window_cols = ", ".join(
+            f"(SELECT price FROM prices p WHERE p.asset_id = l.asset_id AND p.ccy = 'USD' AND p.at <= :{name} "
+            f"ORDER BY p.at DESC LIMIT 1)"
+            for name in WINDOWS
+        )
+        rows = conn.exec_driver_sql(
+            "SELECT l.asset_id, l.price, l.at, " + window_cols + ", "
+            "(SELECT price FROM prices p WHERE p.asset_id = l.asset_id AND p.ccy = 'USD' ORDER BY p.at LIMIT 1), "
+            "(SELECT at FROM prices p WHERE p.asset_id = l.asset_id AND p.ccy = 'USD' ORDER BY p.at LIMIT 1), "
+            "(SELECT open FROM prices_monthly m WHERE m.asset_id = l.asset_id AND m.ccy = 'USD' ORDER BY m.bucket LIMIT 1), "
+            "(SELECT open_at FROM prices_monthly m WHERE m.asset_id = l.asset_id AND m.ccy = 'USD' ORDER BY m.bucket LIMIT 1) "
+            "FROM latest_prices l WHERE l.ccy = 'USD' ORDER BY l.asset_id",
+            refs,
+        ).all()
+        rows = [tuple(r) for r in rows]
+        # Monthly opens stand in for the early FX rows compaction has pruned
+        fx_rows = conn.exec_driver_sql(
+            "SELECT base_ccy, at, rate FROM fx_rates WHERE quote_ccy = 'USD' AND rate > 0 "
+            "UNION ALL SELECT base_ccy, open_at, open FROM fx_monthly WHERE quote_ccy = 'USD' AND open > 0 "
+            "ORDER BY 1, 2"
+        ).all()
+
+        n = len(rows)
+        asset_ids = [int(r[0]) for r in rows]
+        latest_at = _t64([r[2] for r in rows])
+        usd = np.array([[np.nan if v is None else float(v) for v in r[1:2] + r[3:-3] + r[-2:-1]] for r in rows],
+                       dtype=np.float64).reshape(n, len(WINDOWS) + 3)
+        # Columns: latest, one per window, oldest raw row, oldest monthly open
+        latest_usd, window_usd = usd[:, 0], usd[:, 1:-2]
+        raw_at, rolled_at = _t64([r[-3] for r in rows]), _t64([r[-1] for r in rows])
+        # NaT never compares true, so either source alone is used when the other is missing
+        use_rolled = ~np.isnat(rolled_at) & (np.isnat(raw_at) | (rolled_at < raw_at))
+        first_usd = np.where(use_rolled, usd[:, -1], usd[:, -2])
+        first_at = np.where(use_rolled, rolled_at, raw_at)
+        window_t = _t64([refs[name] for name in WINDOWS])
+
+        series: Dict[str, List[tuple]] = {}
+        for base, at, rate in fx_rows:
+            series.setdefault(base, []).append((at, float(rate)))
+        out: List[Dict[str, Any]] = []
+        computed_at = datetime.now(UTC)
+        for ccy in ["USD"] + sorted(c for c in series if c != "USD"):
+            if ccy == "USD":
+                latest, ref, first = latest_usd, window_usd, first_usd
+            else:
+                ts = _t64([a for a, _ in series[ccy]])
+                rates = np.array([r for _, r in series[ccy]], dtype=np.float64)
+                latest = latest_usd / _fx_at(ts, rates, latest_at)
+                ref = window_usd / _fx_at(ts, rates, window_t)[None, :]
+                first = first_usd / _fx_at(ts, rates, first_at)
+            pct = _pct(latest[:, None], ref)
+            since_first = _pct(latest, first)
+            for i in range(n):
+                if not np.isfinite(latest[i]):
+                    continue
+                row: Dict[str, Any] = {"asset_id": asset_ids[i], "ccy": ccy, "latest": float(latest[i]),
+                                       "at": datetime.fromisoformat(str(rows[i][2])), "computed_at": computed_at}
+                for j, name in enumerate(WINDOWS):
+                    row[name] = None if np.isnan(pct[i, j]) else float(pct[i, j])
+                row[SINCE_FIRST] = None if np.isnan(since_first[i]) else float(since_first[i])
+                out.append(row)
+
+        # Replaced wholesale in this transaction so readers never see a partial set
+        conn.exec_driver_sql("DELETE FROM price_changes")
+        if out:
+            conn.execute(PriceChange.__table__.insert(), out)
+    return {"rows": len(out), "currencies": sorted({r["ccy"] for r in out}),
+            "seconds": round(time.perf_counter() - t0, 4)}
@@ -1,31 +1,51 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple
 from urllib.parse import urljoin
 from .http_client import HttpClient
+from .rate_limit import coingecko_limiter, retry_after_seconds
 from .config import (
     COINGECKO_BASE_URL,
     FRED_BASE_URL,
     FNG_BASE_URL,
     COINGECKO_API_KEY,
+    COINGECKO_CONCURRENCY,
+    COINGECKO_PER_PAGE,
+    HTTP_CACHE_TTL_GLOBAL,
+    HTTP_CACHE_TTL_SEARCH,
+    HTTP_CACHE_TTL_FRED,
+    HTTP_CACHE_TTL_FNG,
 )
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import time
 from requests import HTTPError
 
+# Coingecko rejects per_page above 250 on coins/markets
+MAX_PER_PAGE = 250
+
 
 class CoingeckoClient:
     def __init__(self, http: HttpClient | None = None):
-        self.http = http or HttpClient()
+        self.http = http or HttpClient(limiter=coingecko_limiter())
         self.base = COINGECKO_BASE_URL.rstrip("/") + "/"
         self.fallback_base = "https://www.coingecko.com/api/v3/"
 
-    def markets(self, ids: List[str], vs_currency: str) -> List[Dict[str, Any]]:
-        if not ids:
-            return []
-        url = urljoin(self.base, "coins/markets")
-        headers = None
-        params = {
-            "ids": ",".join(ids),
-            "vs_currency": vs_currency.lower(),
-        }
+    def _backoff(self, err: HTTPError, attempts: int) -> None:
+        """Wait out a 429: honour Retry-After, else back off linearly.
+        With a shared limiter the pause applies to every process using the quota.
+        """
+        delay = retry_after_seconds(err.response) or 1.5 * attempts
+        limiter = getattr(self.http, "limiter", None)
+        if limiter:
+            limiter.penalize(delay)
+        else:
+            time.sleep(delay)
+
+    def _get_keyed(self, path: str, params: Dict[str, Any], headers: Dict[str, str] | None = None):
+        """GET an endpoint that accepts the demo API key, with the key-drop,
+        fallback-base and 429 retry sequence. Returns the parsed JSON.
+        """
+        url = urljoin(self.base, path)
+        params = dict(params)
         add_key = bool(COINGECKO_API_KEY)
         if add_key:
             params["x_cg_demo_api_key"] = COINGECKO_API_KEY
@@ -35,7 +55,7 @@ class CoingeckoClient:
         while True:
             try:
                 resp = self.http.get(url, params=params, headers=headers)
-                return resp.json() or []
+                return resp.json()
             except HTTPError as e:
                 status = getattr(e.response, "status_code", None)
                 if status == 401 and add_key and not tried_no_key:
@@ -46,58 +66,145 @@ class CoingeckoClient:
                 if status == 401 and not used_fallback:
                     # Retry once via fallback base URL without API key
                     params.pop("x_cg_demo_api_key", None)
-                    url = urljoin(self.fallback_base, "coins/markets")
+                    url = urljoin(self.fallback_base, path)
                     used_fallback = True
                     continue
                 if status == 429 and attempts < 3:
                     attempts += 1
-                    time.sleep(1.5 * attempts)
+                    self._backoff(e, attempts)
                     continue
                 raise
 
+    def _map_chunks(self, fn, chunks: List[List[str]]) -> List[Any]:
+        """Run ``fn`` over id chunks, concurrently when there is more than one.
+        Pacing is left to the shared rate limiter; results keep chunk order.
+        """
+        if len(chunks) <= 1:
+            return [fn(c) for c in chunks]
+        with ThreadPoolExecutor(max_workers=min(len(chunks), max(1, COINGECKO_CONCURRENCY))) as pool:
+            return list(pool.map(fn, chunks))
+
+    def _markets_chunk(self, ids: List[str], vs_currency: str, per_page: int) -> List[Dict[str, Any]]:
+        rows: List[Dict[str, Any]] = []
+        page = 1
+        while True:
+            params = {
+                "ids": ",".join(ids),
+                "vs_currency": vs_currency.lower(),
+                "per_page": per_page,
+                "page": page,
+            }
+            batch = self._get_keyed("coins/markets", params) or []
+            rows.extend(batch)
+            # Stop on a short page, or once every requested id is accounted for
+            if len(batch) < per_page or len(rows) >= len(ids):
+                return rows
+            page += 1
+
+    @staticmethod
+    def _markets_split(ids: List[str], per_page: int | None) -> Tuple[int, List[List[str]]]:
+        per_page = max(1, min(per_page or COINGECKO_PER_PAGE, MAX_PER_PAGE))
+        return per_page, [ids[i:i + per_page] for i in range(0, len(ids), per_page)]
+
+    @staticmethod
+    def _markets_merge(results: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        seen = set()
+        merged: List[Dict[str, Any]] = []
+        for rows in results:
+            for row in rows:
+                key = row.get("id")
+                if key in seen:
+                    continue
+                seen.add(key)
+                merged.append(row)
+        return merged
+
+    def markets(self, ids: List[str], vs_currency: str, per_page: int | None = None) -> List[Dict[str, Any]]:
+        """Markets rows for ``ids``. Ids are split into chunks of ``per_page``
+        (COINGECKO_PER_PAGE, max 250) to bound URL length, each chunk follows
+        pagination, and the chunks are fetched concurrently and merged.
+        """
+        if not ids:
+            return []
+        per_page, chunks = self._markets_split(ids, per_page)
+        return self._markets_merge(self._map_chunks(lambda chunk: self._markets_chunk(chunk, vs_currency, per_page), chunks))
+
+    def simple_price(self, ids: List[str], vs_currencies: List[str] | Tuple[str, ...]) -> Dict[str, Dict[str, float]]:
+        """Quote many ids in several currencies with one request.
+        Returns {cg_id: {"usd": 1.0, "gbp": 0.79, ...}}.
+        """
+        if not ids:
+            return {}
+        vs = ",".join(c.lower() for c in vs_currencies)
+        size = max(1, min(COINGECKO_PER_PAGE, MAX_PER_PAGE))
+        chunks = [ids[i:i + size] for i in range(0, len(ids), size)]
+        out: Dict[str, Dict[str, float]] = {}
+        for quotes in self._map_chunks(lambda chunk: self._get_keyed("simple/price", {"ids": ",".join(chunk), "vs_currencies": vs}), chunks):
+            out.update(quotes or {})
+        return out
+
     def search(self, query: str) -> Dict[str, Any]:
         url = urljoin(self.base, "search")
         params = {"query": query}
-        resp = self.http.get(url, params=params)
+        resp = self.http.get(url, params=params, ttl=HTTP_CACHE_TTL_SEARCH)
         return resp.json() or {"coins": []}
 
     def global_metrics(self) -> Dict[str, Any]:
         url = urljoin(self.base, "global")
-        resp = self.http.get(url)
+        resp = self.http.get(url, ttl=HTTP_CACHE_TTL_GLOBAL)
         return resp.json() or {}
 
     def market_chart(self, cg_id: str, vs_currency: str, days: str = "max") -> Dict[str, Any]:
         """Fetch historical market chart for a coin.
         Returns dict with lists: prices, market_caps, total_volumes where each is [[ms, value], ...]
         """
-        url = urljoin(self.base, f"coins/{cg_id}/market_chart")
         params: Dict[str, Any] = {"vs_currency": vs_currency.lower(), "days": days}
-        add_key = bool(COINGECKO_API_KEY)
-        if add_key:
-            params["x_cg_demo_api_key"] = COINGECKO_API_KEY
-        attempts = 0
-        tried_no_key = False
-        used_fallback = False
-        while True:
-            try:
-                resp = self.http.get(url, params=params)
-                return resp.json() or {"prices": []}
-            except HTTPError as e:
-                status = getattr(e.response, "status_code", None)
-                if status == 401 and add_key and not tried_no_key:
-                    params.pop("x_cg_demo_api_key", None)
-                    tried_no_key = True
-                    continue
-                if status == 401 and not used_fallback:
-                    params.pop("x_cg_demo_api_key", None)
-                    url = urljoin(self.fallback_base, f"coins/{cg_id}/market_chart")
-                    used_fallback = True
-                    continue
-                if status == 429 and attempts < 3:
-                    attempts += 1
-                    time.sleep(1.5 * attempts)
-                    continue
-                raise
+        return self._get_keyed(f"coins/{cg_id}/market_chart", params) or {"prices": []}
+
+    def market_chart_range(self, cg_id: str, vs_currency: str, from_ts: int, to_ts: int) -> Dict[str, Any]:
+        """Like market_chart but for an explicit [from_ts, to_ts] window (unix seconds)."""
+        params: Dict[str, Any] = {"vs_currency": vs_currency.lower(), "from": int(from_ts), "to": int(to_ts)}
+        return self._get_keyed(f"coins/{cg_id}/market_chart/range", params) or {"prices": []}
+
+
+class AsyncCoingeckoClient:
+    """Asyncio variant of CoingeckoClient with a cap on requests in flight.
+
+    Each call runs the blocking client in a worker thread, so the 401 key-drop,
+    fallback base URL and 429 retry handling are exactly those of CoingeckoClient.
+    """
+
+    def __init__(self, client: CoingeckoClient | None = None, concurrency: int | None = None):
+        self.client = client or CoingeckoClient()
+        self.concurrency = max(1, concurrency or COINGECKO_CONCURRENCY)
+        self._sem = asyncio.Semaphore(self.concurrency)
+
+    async def _call(self, fn, *args, **kwargs):
+        async with self._sem:
+            return await asyncio.to_thread(fn, *args, **kwargs)
+
+    async def markets(self, ids: List[str], vs_currency: str, per_page: int | None = None) -> List[Dict[str, Any]]:
+        # One slot per id chunk: the blocking markets() would fan its chunks out on a
+        # thread pool of its own, past this client's cap on requests in flight
+        if not ids:
+            return []
+        per_page, chunks = self.client._markets_split(ids, per_page)
+        results = await asyncio.gather(*(
+            self._call(self.client._markets_chunk, chunk, vs_currency, per_page) for chunk in chunks
+        ))
+        return self.client._markets_merge(list(results))
+
+    async def search(self, query: str) -> Dict[str, Any]:
+        return await self._call(self.client.search, query)
+
+    async def global_metrics(self) -> Dict[str, Any]:
+        return await self._call(self.client.global_metrics)
+
+    async def market_chart(self, cg_id: str, vs_currency: str, days: str = "max") -> Dict[str, Any]:
+        return await self._call(self.client.market_chart, cg_id, vs_currency, days=days)
+
+    async def market_chart_range(self, cg_id: str, vs_currency: str, from_ts: int, to_ts: int) -> Dict[str, Any]:
+        return await self._call(self.client.market_chart_range, cg_id, vs_currency, from_ts, to_ts)
 
 
 class FredClient:
@@ -109,7 +216,7 @@ class FredClient:
     def series_observations(self, series_id: str) -> Dict[str, Any]:
         url = urljoin(self.base, "series/observations")
         params = {"series_id": series_id, "api_key": self.api_key, "file_type": "json"}
-        resp = self.http.get(url, params=params)
+        resp = self.http.get(url, params=params, ttl=HTTP_CACHE_TTL_FRED)
         return resp.json() or {}
 
 
@@ -120,5 +227,5 @@ class FearGreedClient:
 
     def latest(self) -> Dict[str, Any]:
         url = urljoin(self.base, "fng/")
-        resp = self.http.get(url)
+        resp = self.http.get(url, ttl=HTTP_CACHE_TTL_FNG)
         return resp.json() or {}
@@ -1,107 +1,175 @@
 from __future__ import annotations
+import time
 from datetime import datetime, timedelta, UTC
-from .db import engine
+from typing import Any, Dict, Iterable, List, Set, Tuple
 
+from . import db as _db
+from .models import CompactionState
+from .buckets import COLUMNS
+from .rollups import prune_rollups, rollup_rows
 
-def _ensure_indexes() -> None:
-    with engine.begin() as conn:
-        conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS idx_prices_asset_ccy_at ON prices(asset_id, ccy, at)")
-        conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS idx_fx_ccy_at ON fx_rates(base_ccy, quote_ccy, at)")
+# Retention tiers: hourly for 24h, daily for 365d, monthly for older.
+# Raw rows are folded into the OHLC rollup tables (rollups.py) before pruning,
+# and the hourly / daily rollups are pruned the same way (ROLLUP_HOURLY_DAYS /
+# ROLLUP_DAILY_DAYS), so only the monthly tier grows with history.
+_TABLES: Dict[str, Tuple[str, str]] = {
+    "prices": ("asset_id", "ccy"),
+    "fx_rates": ("base_ccy", "quote_ccy"),
+}
+# String bounds for open-ended tiers (timestamps are stored as ISO text)
+_MIN_TS = ""
+_MAX_TS = "9999-12-31 23:59:59.999999"
 
 
-def _delete_not_in(conn, table: str, where: str, group_expr: str) -> None:
-    # Keep the latest row per group_expr; delete the rest within 'where' scope
-    # Emulate QUALIFY using grouped MAX(at)
+def _naive(dt: datetime) -> datetime:
+    return dt.astimezone(UTC).replace(tzinfo=None) if dt.tzinfo else dt
+
+
+def _ts(dt: datetime | None, default: str) -> str:
+    # Same text format SQLAlchemy uses for DateTime columns on SQLite
+    return dt.strftime("%Y-%m-%d %H:%M:%S.%f") if dt is not None else default
+
+
+def _tier_ranges(now: datetime) -> Dict[str, Tuple[datetime | None, datetime | None]]:
+    since_24h = now - timedelta(hours=24)
+    since_1y = now - timedelta(days=365)
+    return {"hour": (since_24h, None), "day": (since_1y, since_24h), "month": (None, since_1y)}
+
+
+def _delete_superseded(conn, table: str, keys: Tuple[str, str], lo: str, hi: str, col: str) -> int:
+    # Keep the latest row per key and bucket within [lo, hi); delete the rest.
+    # The correlated MAX(at) is answered from the (key, bucket, at) index.
+    k1, k2 = keys
     sql = f"""
     DELETE FROM {table}
-    WHERE {where}
-      AND (asset_id, ccy, at) NOT IN (
-        SELECT asset_id, ccy, MAX(at) AS at
-        FROM {table}
-        WHERE {where}
-        GROUP BY {group_expr}
+    WHERE at >= ? AND at < ?
+      AND at < (
+        SELECT MAX(t2.at) FROM {table} AS t2
+        WHERE t2.{k1} = {table}.{k1} AND t2.{k2} = {table}.{k2} AND t2.{col} = {table}.{col}
+          AND t2.at >= ? AND t2.at < ?
       )
     """
-    conn.exec_driver_sql(sql)
-
-
-def compact_prices(now: datetime | None = None) -> None:
-    """Retain: hourly for 24h, daily for 365d, monthly for older."""
-    _ensure_indexes()
-    now = now or datetime.now(UTC)
-    with engine.begin() as conn:
-        # Hourly window: last 24 hours
-        since_24h = now - timedelta(hours=24)
-        where_hour = f"at >= '{since_24h.isoformat(sep=' ')}'"
-        grp_hour = "asset_id, ccy, strftime('%Y-%m-%d %H:00:00', at)"
-        _delete_not_in(conn, "prices", where_hour, grp_hour)
-
-        # Daily window: last 365 days EXCLUDING last 24h
-        since_1y = now - timedelta(days=365)
-        where_day = (
-            f"at >= '{since_1y.isoformat(sep=' ')}' AND at < '{since_24h.isoformat(sep=' ')}'"
-        )
-        grp_day = "asset_id, ccy, date(at)"
-        _delete_not_in(conn, "prices", where_day, grp_day)
-
-        # Monthly window: older than 365d
-        where_month = f"at < '{since_1y.isoformat(sep=' ')}'"
-        grp_month = "asset_id, ccy, strftime('%Y-%m-01', at)"
-        _delete_not_in(conn, "prices", where_month, grp_month)
-
-
-def compact_fx(now: datetime | None = None) -> None:
-    _ensure_indexes()
-    now = now or datetime.now(UTC)
-    with engine.begin() as conn:
-        since_24h = now - timedelta(hours=24)
-        since_1y = now - timedelta(days=365)
-        # Hourly 24h
-        where_hour = f"at >= '{since_24h.isoformat(sep=' ')}'"
-        conn.exec_driver_sql(
-            f"""
-            DELETE FROM fx_rates
-            WHERE {where_hour}
-              AND (base_ccy, quote_ccy, at) NOT IN (
-                SELECT base_ccy, quote_ccy, MAX(at) AS at
-                FROM fx_rates
-                WHERE {where_hour}
-                GROUP BY base_ccy, quote_ccy, strftime('%Y-%m-%d %H:00:00', at)
-              )
-            """
-        )
-        # Daily 1y EXCLUDING last 24h
-        where_day = (
-            f"at >= '{since_1y.isoformat(sep=' ')}' AND at < '{since_24h.isoformat(sep=' ')}'"
-        )
-        conn.exec_driver_sql(
-            f"""
-            DELETE FROM fx_rates
-            WHERE {where_day}
-              AND (base_ccy, quote_ccy, at) NOT IN (
-                SELECT base_ccy, quote_ccy, MAX(at) AS at
-                FROM fx_rates
-                WHERE {where_day}
-                GROUP BY base_ccy, quote_ccy, date(at)
-              )
-            """
-        )
-        # Monthly older
-        where_month = f"at < '{since_1y.isoformat(sep=' ')}'"
-        conn.exec_driver_sql(
-            f"""
-            DELETE FROM fx_rates
-            WHERE {where_month}
-              AND (base_ccy, quote_ccy, at) NOT IN (
-                SELECT base_ccy, quote_ccy, MAX(at) AS at
-                FROM fx_rates
-                WHERE {where_month}
-                GROUP BY base_ccy, quote_ccy, strftime('%Y-%m-01', at)
-              )
-            """
-        )
-
-
-def compact_all(now: datetime | None = None) -> None:
-    compact_prices(now)
-    compact_fx(now)
+    return conn.exec_driver_sql(sql, (lo, hi, lo, hi)).rowcount or 0
+
+
+def _dirty_buckets(conn, table: str, keys: Tuple[str, str], col: str, where: str, params: tuple) -> Set[Tuple[Any, Any, int]]:
+    k1, k2 = keys
+    rows = conn.exec_driver_sql(f"SELECT DISTINCT {k1}, {k2}, {col} FROM {table} WHERE {where}", params).fetchall()
+    return {(a, b, bucket) for a, b, bucket in rows if bucket is not None}
+
+
+def _delete_buckets(conn, table: str, keys: Tuple[str, str], col: str, buckets: Iterable[Tuple[Any, Any, int]], lo: str, hi: str) -> int:
+    """Keep only the latest row in each (key, bucket) clipped to the tier range [lo, hi)."""
+    k1, k2 = keys
+    params: List[tuple] = [(a, b, bucket, lo, hi, a, b, bucket, lo, hi) for a, b, bucket in buckets]
+    if not params:
+        return 0
+    sql = f"""
+    DELETE FROM {table}
+    WHERE {k1} = ? AND {k2} = ? AND {col} = ? AND at >= ? AND at < ?
+      AND at < (
+        SELECT MAX(at) FROM {table}
+        WHERE {k1} = ? AND {k2} = ? AND {col} = ? AND at >= ? AND at < ?
+      )
+    """
+    return conn.exec_driver_sql(sql, params).rowcount or 0
+
+
+def _compact_table(conn, table: str, now: datetime, full: bool) -> Dict[str, Any]:
+    keys = _TABLES[table]
+    ranges = _tier_ranges(now)
+    hour_since, day_since = ranges["hour"][0], ranges["day"][0]
+    state = conn.execute(
+        CompactionState.__table__.select().where(CompactionState.table_name == table)
+    ).mappings().first()
+    # Rows inserted while we run get ids above this and are picked up next time
+    upto_id = conn.exec_driver_sql(f"SELECT COALESCE(MAX(id), 0) FROM {table}").scalar()
+
+    prev_hour = _naive(state["hour_since"]) if state and state["hour_since"] else None
+    prev_day = _naive(state["day_since"]) if state and state["day_since"] else None
+    incremental = (
+        not full and state is not None and prev_hour is not None and prev_day is not None
+        and prev_hour <= hour_since and prev_day <= day_since
+    )
+
+    report: Dict[str, Any] = {"mode": "incremental" if incremental else "full"}
+    # NULL on states written before rollups existed: fold in every surviving row once
+    rolled = (state["rollup_id"] if state else None) or 0
+    t0 = time.perf_counter()
+    report["rollup"] = rollup_rows(conn, table, rolled, upto_id)
+    report["rollup"]["pruned"] = pruned = prune_rollups(conn, table, now)
+    report["rollup"]["seconds"] = round(time.perf_counter() - t0, 4)
+    for tier in ("hour", "day", "month"):
+        t0 = time.perf_counter()
+        lo, hi = (_ts(ranges[tier][0], _MIN_TS), _ts(ranges[tier][1], _MAX_TS))
+        col = COLUMNS[tier]
+        if not incremental:
+            deleted = _delete_superseded(conn, table, keys, lo, hi, col)
+            buckets = None
+        else:
+            # Buckets that received rows since the last pass
+            dirty = _dirty_buckets(
+                conn, table, keys, col,
+                "id > ? AND id <= ? AND at >= ? AND at < ?", (state["last_id"], upto_id, lo, hi),
+            )
+            # Buckets that rows aged into since the last pass (24h -> daily, 365d -> monthly)
+            prev_edge = {"day": prev_hour, "month": prev_day}.get(tier)
+            if prev_edge is not None:
+                dirty |= _dirty_buckets(conn, table, keys, col, "at >= ? AND at < ?", (_ts(prev_edge, _MIN_TS), hi))
+            deleted = _delete_buckets(conn, table, keys, col, dirty, lo, hi)
+            buckets = len(dirty)
+        report[tier] = {"deleted": deleted, "seconds": round(time.perf_counter() - t0, 4)}
+        if buckets is not None:
+            report[tier]["buckets"] = buckets
+
+    # Measured after deletes: if the newest row was compacted away SQLite may reuse
+    # its id, so never let the watermark run ahead of the surviving rows
+    remaining_max = conn.exec_driver_sql(f"SELECT COALESCE(MAX(id), 0) FROM {table}").scalar()
+    values = {
+        "last_id": min(upto_id, remaining_max),
+        "rollup_id": min(upto_id, remaining_max),
+        "hour_since": hour_since,
+        "day_since": day_since,
+        "hour_rollup_since": pruned["hour"]["since"],
+        "day_rollup_since": pruned["day"]["since"],
+        "updated_at": datetime.now(UTC),
+    }
+    tbl = CompactionState.__table__
+    if state is None:
+        conn.execute(tbl.insert().values(table_name=table, **values))
+    else:
+        conn.execute(tbl.update().where(tbl.c.table_name == table).values(**values))
+    report["watermark"] = values["last_id"]
+    return report
+
+
+def _compact(table: str, now: datetime | None, full: bool, bind) -> Dict[str, Any]:
+    now = _naive(now or datetime.now(UTC))
+    bind = bind or _db.engine
+    with bind.begin() as conn:
+        return _compact_table(conn, table, now, full)
+
+
+def compact_prices(now: datetime | None = None, full: bool = False, bind=None) -> Dict[str, Any]:
+    """Retain: hourly for 24h, daily for 365d, monthly for older.
+
+    Only buckets that received rows since the last pass (per the persisted id
+    watermark), plus buckets rows have aged into at the 24h / 365d boundaries,
+    are recompacted. The first pass, or ``full=True``, scans every tier.
+    New rows are merged into prices_hourly/daily/monthly first, so highs and
+    lows survive pruning; hourly / daily rollup buckets past their own
+    retention are then dropped. Returns rows deleted and seconds per tier, plus
+    buckets written and pruned per rollup tier.
+    """
+    return _compact("prices", now, full, bind)
+
+
+def compact_fx(now: datetime | None = None, full: bool = False, bind=None) -> Dict[str, Any]:
+    return _compact("fx_rates", now, full, bind)
+
+
+def compact_all(now: datetime | None = None, full: bool = False, bind=None) -> Dict[str, Any]:
+    return {
+        "prices": compact_prices(now, full, bind),
+        "fx_rates": compact_fx(now, full, bind),
+    }
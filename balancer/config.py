@@ -15,15 +15,43 @@ LOG_PATH = os.getenv("LOG_PATH", str(BASE_DIR / "alerts.jsonl"))
 INITIAL_TOKENLIST = os.getenv("INITIAL_TOKENLIST", str(BASE_DIR / "docs/initial-data/tokenlist.txt"))
 CG_MAPPING_FILE = os.getenv("CG_MAPPING_FILE", str(BASE_DIR / "docs/initial-data/cg-mapping.json"))
 COOLOFF_DAYS = float(os.getenv("COOLOFF_DAYS", "1"))
+# run_rules skips assets whose price, cost and portfolio total moved less than this
+# (relative) since they were last evaluated and that sit clear of every threshold; 0 disables
+RULES_SKIP_EPSILON = float(os.getenv("RULES_SKIP_EPSILON", "0.005"))
+
+# SQLite pragma profile applied on every connection (shared with the web UI's readers)
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL").upper()
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").upper()
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+# Negative values are KiB (SQLite convention): -65536 = 64MB page cache
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))
+SQLITE_TEMP_STORE = os.getenv("SQLITE_TEMP_STORE", "MEMORY").upper()
+# wal_checkpoint mode used by db maintenance (PASSIVE never blocks readers)
+SQLITE_CHECKPOINT_MODE = os.getenv("SQLITE_CHECKPOINT_MODE", "PASSIVE").upper()
 
 # HTTP and API configuration
 HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "20"))
 HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
 
+# On-disk response cache for slow-moving endpoints (TTL seconds per endpoint)
+HTTP_CACHE_ENABLED = os.getenv("HTTP_CACHE_ENABLED", "true").strip().lower() == "true"
+HTTP_CACHE_PATH = os.getenv("HTTP_CACHE_PATH", str(BASE_DIR / ".cache" / "http-cache.db"))
+HTTP_CACHE_MAX_BYTES = int(os.getenv("HTTP_CACHE_MAX_BYTES", str(50 * 1024 * 1024)))
+HTTP_CACHE_TTL_GLOBAL = float(os.getenv("HTTP_CACHE_TTL_GLOBAL", "3600"))
+HTTP_CACHE_TTL_SEARCH = float(os.getenv("HTTP_CACHE_TTL_SEARCH", "86400"))
+HTTP_CACHE_TTL_FRED = float(os.getenv("HTTP_CACHE_TTL_FRED", "86400"))
+HTTP_CACHE_TTL_FNG = float(os.getenv("HTTP_CACHE_TTL_FNG", "3600"))
+
 COINGECKO_BASE_URL = os.getenv("COINGECKO_BASE_URL", "https://api.coingecko.com/api/v3")
 FRED_BASE_URL = os.getenv("FRED_BASE_URL", "https://api.stlouisfed.org/fred")
 FNG_BASE_URL = os.getenv("FNG_BASE_URL", "https://api.alternative.me")
 COINGECKO_THROTTLE_MS = int(os.getenv("COINGECKO_THROTTLE_MS", "800"))
+# Token bucket shared by all processes: one request per COINGECKO_THROTTLE_MS, bursts up to COINGECKO_BURST
+COINGECKO_BURST = int(os.getenv("COINGECKO_BURST", "1"))
+# Max Coingecko requests in flight for the async client
+COINGECKO_CONCURRENCY = int(os.getenv("COINGECKO_CONCURRENCY", "4"))
+RATE_LIMIT_DIR = os.getenv("RATE_LIMIT_DIR", str(BASE_DIR / ".cache"))
 COINGECKO_USE_API_KEY = os.getenv("COINGECKO_USE_API_KEY", "false").strip().lower() == "true"
 
 # Business rule defaults (env-overridable)
@@ -32,6 +60,8 @@ AVG_COST_DEFAULT_CCY = os.getenv("AVG_COST_CCY", "GBP").upper()
 
 MIN_TRADE_USD_DEFAULT = float(os.getenv("MIN_TRADE_USD", "50"))
 DRIFT_BAND_DEFAULT = float(os.getenv("DRIFT_BAND", "0.2"))
+# Where rebalance trades land inside the band: 0 = exactly on target, towards 1 = just inside the edge
+REBALANCE_BAND_FRACTION = float(os.getenv("REBALANCE_BAND_FRACTION", "0.5"))
 
 _ladder_env = os.getenv("LADDER_VALUE_MULTIPLES", "2,3,5")
 try:
@@ -40,3 +70,46 @@ except Exception:
     LADDER_VALUE_MULTIPLES = [2.0, 3.0, 5.0]
 
 COINGECKO_PER_PAGE = int(os.getenv("COINGECKO_PER_PAGE", "250"))
+
+# Incremental backfill treats a series as up to date when its newest point is this recent
+BACKFILL_FRESH_MINUTES = float(os.getenv("BACKFILL_FRESH_MINUTES", "60"))
+
+# Rows per executemany batch for bulk price / FX inserts
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "5000"))
+
+# Most OHLC buckets a history query reads before moving to a coarser rollup tier
+ROLLUP_MAX_POINTS = int(os.getenv("ROLLUP_MAX_POINTS", "5000"))
+# Compaction drops hourly / daily OHLC rollup buckets older than these (monthly are kept).
+# The defaults match the raw-row tiers; raise the hourly span to backtest hourly closes further back.
+ROLLUP_HOURLY_DAYS = float(os.getenv("ROLLUP_HOURLY_DAYS", "1"))
+ROLLUP_DAILY_DAYS = float(os.getenv("ROLLUP_DAILY_DAYS", "365"))
+
+# Cold history: whole months older than ARCHIVE_AFTER_DAYS move from prices to Parquet files
+ARCHIVE_ENABLED = os.getenv("ARCHIVE_ENABLED", "true").strip().lower() == "true"
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", str(BASE_DIR / "data" / "archive"))
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "400"))
+
+# Memory-mapped (assets x buckets) close matrices for analytics, refreshed after each run
+MATRIX_CACHE_ENABLED = os.getenv("MATRIX_CACHE_ENABLED", "true").strip().lower() == "true"
+MATRIX_CACHE_DIR = os.getenv("MATRIX_CACHE_DIR", str(BASE_DIR / ".cache" / "matrices"))
+
+# Rebuild the price_changes table (1h..1y % changes per asset and currency) after each price fetch
+PRICE_CHANGES_ENABLED = os.getenv("PRICE_CHANGES_ENABLED", "true").strip().lower() == "true"
+
+# Evaluate rules and export portfolio-<name>.json for every portfolio per run, optionally in a process pool
+RUN_ALL_PORTFOLIOS = os.getenv("RUN_ALL_PORTFOLIOS", "false").strip().lower() == "true"
+PORTFOLIO_WORKERS = int(os.getenv("PORTFOLIO_WORKERS", "0"))
+
+# Monte Carlo risk (VaR/CVaR, ladder-hit odds) from daily closes, recomputed at most every RISK_EVERY_HOURS
+RISK_ENABLED = os.getenv("RISK_ENABLED", "true").strip().lower() == "true"
+RISK_SCENARIOS = int(os.getenv("RISK_SCENARIOS", "20000"))
+RISK_HORIZON_DAYS = int(os.getenv("RISK_HORIZON_DAYS", "30"))
+RISK_LOOKBACK_DAYS = int(os.getenv("RISK_LOOKBACK_DAYS", "365"))
+RISK_EVERY_HOURS = float(os.getenv("RISK_EVERY_HOURS", "24"))
+_risk_conf_env = os.getenv("RISK_CONFIDENCE", "0.95,0.99")
+try:
+    RISK_CONFIDENCE = [float(x.strip()) for x in _risk_conf_env.split(",") if x.strip()]
+except Exception:
+    RISK_CONFIDENCE = [0.95, 0.99]
+# Fixed RNG seed for reproducible scenarios; empty draws fresh ones each time
+RISK_SEED = int(os.getenv("RISK_SEED")) if os.getenv("RISK_SEED", "").strip() else None
@@ -0,0 +1,127 @@
+from __future__ import annotations
+from typing import Any, Dict, Iterable, Set, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from .buckets import COLUMNS
+from .models import FxCoverage, PriceCoverage
+
+# Which hour / day buckets hold data, per price and FX series, as one bitmap row
+# per (series, tier) in price_coverage / fx_coverage. Every write through
+# balancer.bulk (and ORM inserts, via the models listeners) sets the bits of the
+# buckets it touched, so health checks and the repair planner read a few
+# hundred bytes per series instead of COUNT(DISTINCT bucket) scans of prices.
+# Compaction keeps the latest row of every bucket it prunes and the Parquet
+# archive only takes months far older than TIER_SPAN, so neither clears a bit.
+#
+# A bitmap is an int: bit i is bucket base + i, base being the oldest bucket kept. Only the newest TIER_SPAN
+# buckets of each series are kept; older bits are shifted out on the next write.
+
+TIER_SPAN: Dict[str, int] = {"hour": 72, "day": 400}
+
+_TABLES = {
+    "prices": (PriceCoverage.__table__, ("asset_id", "ccy")),
+    "fx_rates": (FxCoverage.__table__, ("base_ccy", "quote_ccy")),
+}
+
+# (series key) -> tier -> bucket keys written
+Seen = Dict[Tuple[Any, Any], Dict[str, Set[int]]]
+
+
+def note(seen: Seen, key: Tuple[Any, Any], hour: int, day: int) -> None:
+    tiers = seen.setdefault(key, {"hour": set(), "day": set()})
+    tiers["hour"].add(hour)
+    tiers["day"].add(day)
+
+
+def unpack(bits: bytes | None) -> int:
+    return int.from_bytes(bits or b"", "little")
+
+
+def _pack(value: int) -> bytes:
+    return value.to_bytes(max(1, (value.bit_length() + 7) // 8), "little")
+
+
+def merge(base: int | None, value: int, buckets: Iterable[int], span: int) -> Tuple[int, int]:
+    """Set ``buckets`` in the bitmap (base, value), keeping only the newest ``span`` buckets."""
+    buckets = list(buckets)
+    if base is None:
+        base, value = min(buckets), 0
+    top = max(base + value.bit_length() - 1, max(buckets))
+    new_base = max(top - span + 1, min(base, min(buckets)))
+    value = value >> (new_base - base) if new_base >= base else value << (base - new_base)
+    for b in buckets:
+        if b >= new_base:
+            value |= 1 << (b - new_base)
+    # Canonical form: the lowest set bit is bit 0
+    low = (value & -value).bit_length() - 1
+    return new_base + low, value >> low
+
+
+def count_present(base: int, value: int, lo: int, hi: int) -> int:
+    """Buckets in [lo, hi] with data."""
+    start = max(lo, base)
+    if hi < start:
+        return 0
+    return ((value >> (start - base)) & ((1 << (hi - start + 1)) - 1)).bit_count()
+
+
+def is_present(base: int | None, value: int, bucket: int) -> bool:
+    return base is not None and bucket >= base and (value >> (bucket - base)) & 1 == 1
+
+
+def load_coverage(db, table: str) -> Dict[Tuple[Any, Any, str], Tuple[int, int]]:
+    """Every coverage bitmap of ``table`` in one query: (key1, key2, tier) -> (base, bits)."""
+    cov, (k1, k2) = _TABLES[table]
+    return {
+        (r[0], r[1], r[2]): (r[3], unpack(r[4]))
+        for r in db.execute(select(cov.c[k1], cov.c[k2], cov.c.tier, cov.c.base, cov.c.bits))
+    }
+
+
+def mark_coverage(db, table: str, seen: Seen) -> None:
+    """Merge the buckets in ``seen`` into the coverage rows of ``table`` ("prices"
+    or "fx_rates"). ``db`` is a Session or Connection; the caller commits."""
+    if not seen:
+        return
+    cov, (k1, k2) = _TABLES[table]
+    firsts = sorted({k[0] for k in seen})
+    current: Dict[tuple, Tuple[int, int]] = {}
+    for i in range(0, len(firsts), 500):
+        for r in db.execute(select(cov).where(cov.c[k1].in_(firsts[i:i + 500]))):
+            m = r._mapping
+            current[(m[k1], m[k2], m["tier"])] = (m["base"], unpack(m["bits"]))
+    rows = []
+    for key, tiers in seen.items():
+        for tier, buckets in tiers.items():
+            if not buckets:
+                continue
+            base, value = current.get((key[0], key[1], tier), (None, 0))
+            base, value = merge(base, value, buckets, TIER_SPAN[tier])
+            rows.append({k1: key[0], k2: key[1], "tier": tier, "base": base, "bits": _pack(value)})
+    stmt = sqlite_insert(cov)
+    db.execute(
+        stmt.on_conflict_do_update(index_elements=[k1, k2, "tier"],
+                                   set_={"base": stmt.excluded.base, "bits": stmt.excluded.bits}),
+        rows,
+    )
+
+
+def rebuild_coverage(conn) -> None:
+    """Recompute both coverage tables from the stored rows (migration / repair)."""
+    for table, (cov, (k1, k2)) in _TABLES.items():
+        conn.execute(cov.delete())
+        seen: Seen = {}
+        for tier, span in TIER_SPAN.items():
+            col = COLUMNS[tier]
+            # The newest ``span`` buckets of each series
+            rows = conn.exec_driver_sql(
+                f"SELECT t.{k1}, t.{k2}, t.{col} FROM {table} t "
+                f"JOIN (SELECT {k1}, {k2}, MAX({col}) AS top FROM {table} GROUP BY {k1}, {k2}) m "
+                f"ON m.{k1} = t.{k1} AND m.{k2} = t.{k2} "
+                f"WHERE t.{col} > m.top - {span} GROUP BY t.{k1}, t.{k2}, t.{col}"
+            )
+            for a, b, bucket in rows:
+                seen.setdefault((a, b), {"hour": set(), "day": set()})[tier].add(bucket)
+        mark_coverage(conn, table, seen)
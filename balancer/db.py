@@ -1,7 +1,83 @@
-from sqlalchemy import create_engine
+from typing import Any, Dict
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker, declarative_base
+from . import config
 from .config import DB_PATH
 
-engine = create_engine(f"sqlite:///{DB_PATH}", echo=False, future=True)
+
+def pragma_profile() -> Dict[str, Any]:
+    """Per-connection pragmas from config (order matters: journal_mode first)."""
+    return {
+        "journal_mode": config.SQLITE_JOURNAL_MODE,
+        "synchronous": config.SQLITE_SYNCHRONOUS,
+        "busy_timeout": config.SQLITE_BUSY_TIMEOUT_MS,
+        "mmap_size": config.SQLITE_MMAP_SIZE,
+        "cache_size": config.SQLITE_CACHE_SIZE,
+        "temp_store": config.SQLITE_TEMP_STORE,
+    }
+
+
+def _apply_pragmas(dbapi_conn, pragmas: Dict[str, Any]) -> None:
+    cur = dbapi_conn.cursor()
+    try:
+        for name, value in pragmas.items():
+            if value is None or value == "":
+                continue
+            cur.execute(f"PRAGMA {name}={value}")
+    finally:
+        cur.close()
+
+
+def make_engine(path: str | None = None, readonly: bool = False, pragmas: Dict[str, Any] | None = None) -> Engine:
+    """SQLite engine with the pragma profile applied on connect.
+
+    ``readonly`` opens the file with ``mode=ro`` and ``query_only`` so UI-style
+    readers never take a write lock; journal_mode is left to the writers (WAL is
+    persistent in the file once set).
+    """
+    path = path or DB_PATH
+    profile = dict(pragma_profile() if pragmas is None else pragmas)
+    if readonly:
+        profile.pop("journal_mode", None)
+        profile["query_only"] = "ON"
+        eng = create_engine(f"sqlite:///file:{path}?mode=ro&uri=true", echo=False, future=True)
+    else:
+        eng = create_engine(f"sqlite:///{path}", echo=False, future=True)
+
+    @event.listens_for(eng, "connect")
+    def _on_connect(dbapi_conn, _record):
+        _apply_pragmas(dbapi_conn, profile)
+
+    return eng
+
+
+engine = make_engine()
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
 Base = declarative_base()
+
+_read_engine: Engine | None = None
+
+
+def read_engine() -> Engine:
+    """Process-wide read-only engine on DB_PATH (created on first use)."""
+    global _read_engine
+    if _read_engine is None:
+        _read_engine = make_engine(readonly=True)
+    return _read_engine
+
+
+def maintenance(bind: Engine | None = None, checkpoint_mode: str | None = None) -> Dict[str, Any]:
+    """Checkpoint the WAL back into the main file and let SQLite refresh planner stats.
+
+    Uses the configured (non-blocking by default) checkpoint mode so it can run
+    after every hourly write cycle without stalling readers.
+    """
+    bind = bind or engine
+    mode = (checkpoint_mode or config.SQLITE_CHECKPOINT_MODE).upper()
+    with bind.connect() as conn:
+        row = conn.exec_driver_sql(f"PRAGMA wal_checkpoint({mode})").first()
+        conn.exec_driver_sql("PRAGMA optimize")
+        conn.commit()
+    busy, log_frames, checkpointed = (row or (0, -1, -1))
+    return {"mode": mode, "busy": busy, "wal_frames": log_frames, "checkpointed": checkpointed}
@@ -1,15 +1,23 @@
+import hashlib
 import json
+import os
 from pathlib import Path
 from datetime import datetime, UTC
 from typing import Dict, Any, List
 
+from sqlalchemy import and_, join, select
+from sqlalchemy.orm import aliased
+
 from .db import SessionLocal
-from .models import Portfolio, Position, Asset, Price, FxRate
-from .rules import position_market_value_usd, position_cost_basis_usd
+from .models import Portfolio, Position, Asset, Price, FxRate, LatestFx, LatestPrice, RiskReport
+from .rules import gbp_to_usd, position_market_value_usd, position_cost_basis_usd
+from .latest import PriceSnapshot
 from .config import BASE_DIR, DEFAULT_PORTFOLIO_NAME
 
 
-def latest_price_usd(db, asset_id: int) -> float | None:
+def latest_price_usd(db, asset_id: int, snap: PriceSnapshot | None = None) -> float | None:
+    if snap is not None:
+        return snap.price(asset_id, "USD")
     row = (
         db.query(Price)
         .filter(Price.asset_id == asset_id, Price.ccy == "USD")
@@ -19,7 +27,9 @@ def latest_price_usd(db, asset_id: int) -> float | None:
     return float(row.price) if row else None
 
 
-def latest_price_ccy(db, asset_id: int, ccy: str) -> float | None:
+def latest_price_ccy(db, asset_id: int, ccy: str, snap: PriceSnapshot | None = None) -> float | None:
+    if snap is not None:
+        return snap.price(asset_id, ccy)
     row = (
         db.query(Price)
         .filter(Price.asset_id == asset_id, Price.ccy == ccy)
@@ -29,7 +39,9 @@ def latest_price_ccy(db, asset_id: int, ccy: str) -> float | None:
     return float(row.price) if row else None
 
 
-def latest_fx(db, base: str, quote: str) -> float | None:
+def latest_fx(db, base: str, quote: str, snap: PriceSnapshot | None = None) -> float | None:
+    if snap is not None:
+        return snap.rate(base, quote)
     row = (
         db.query(FxRate)
         .filter(FxRate.base_ccy == base, FxRate.quote_ccy == quote)
@@ -39,33 +51,107 @@ def latest_fx(db, base: str, quote: str) -> float | None:
     return float(row.rate) if row else None
 
 
-def export_portfolio_json(portfolio_name: str = DEFAULT_PORTFOLIO_NAME) -> Path:
-    out_path = Path(BASE_DIR) / "portfolio.json"
+def _snapshot_rows(db, portfolio_name: str, with_prices: bool) -> List[Any]:
+    """One joined query: the portfolio, its positions on active assets, the
+    stored risk report and (``with_prices``) the latest USD/GBP/BTC prices and
+    GBPUSD / BTCUSD rates. A portfolio without positions gives one row with
+    NULL position columns; an unknown one gives no rows."""
+    usd, gbp, btc = (aliased(LatestPrice) for _ in range(3))
+
+    def fx(base: str):
+        return (
+            select(LatestFx.rate)
+            .where(LatestFx.base_ccy == base, LatestFx.quote_ccy == "USD")
+            .scalar_subquery()
+        )
+
+    cols = [
+        Portfolio.id.label("portfolio_id"), Portfolio.name.label("portfolio"), RiskReport.report_json,
+        Position.asset_id, Position.coins, Position.avg_cost_ccy, Position.avg_cost_per_unit,
+        Asset.symbol, Asset.name, Asset.coingecko_id, Asset.is_stable, Asset.is_fiat,
+    ]
+    held = join(Position, Asset, and_(Asset.id == Position.asset_id, Asset.active))
+    q = select(*cols).select_from(Portfolio).outerjoin(held, Position.portfolio_id == Portfolio.id)
+    if with_prices:
+        q = q.add_columns(usd.price.label("px_usd"), gbp.price.label("px_gbp"), btc.price.label("px_btc"),
+                          fx("GBP").label("gbp_usd"), fx("BTC").label("btc_usd"))
+        for alias, ccy in ((usd, "USD"), (gbp, "GBP"), (btc, "BTC")):
+            q = q.outerjoin(alias, and_(alias.asset_id == Position.asset_id, alias.ccy == ccy))
+    q = (
+        q.outerjoin(RiskReport, RiskReport.portfolio_id == Portfolio.id)
+        .where(Portfolio.name == portfolio_name)
+        .order_by(Portfolio.id, Position.id)
+    )
+    rows = db.execute(q).all()
+    # Names are not unique in the schema; like .first(), keep the oldest portfolio
+    return [r for r in rows if r.portfolio_id == rows[0].portfolio_id] if rows else []
+
+
+def _rows_snapshot(db, rows: List[Any]) -> PriceSnapshot:
+    """PriceSnapshot holding just the prices and rates read by _snapshot_rows."""
+    snap = PriceSnapshot()
+    for r in rows:
+        for ccy, v in (("USD", r.px_usd), ("GBP", r.px_gbp), ("BTC", r.px_btc)):
+            if r.asset_id is not None and v is not None:
+                snap.prices[(r.asset_id, ccy)] = float(v)
+    for base, v in (("GBP", rows[0].gbp_usd), ("BTC", rows[0].btc_usd)):
+        if v is not None:
+            snap.fx[(base, "USD")] = float(v)
+    if ("GBP", "USD") not in snap.fx:
+        # The USDC-implied fallback may need prices outside this portfolio
+        snap.derived["gbp_usd"] = gbp_to_usd(db)
+    return snap
+
+
+def write_snapshot(out_path: str | Path, payload: Dict[str, Any]) -> bool:
+    """Write ``payload`` plus a content ``version`` atomically (temp file +
+    os.replace), so readers never see a partial file. ``as_of`` is left out of
+    the hash; when the file already holds the same version nothing is written.
+    Returns whether the file was written."""
+    out_path = Path(out_path)
+    body = {k: v for k, v in payload.items() if k != "as_of"}
+    version = hashlib.sha256(json.dumps(body, sort_keys=True, separators=(",", ":")).encode("utf-8")).hexdigest()[:16]
+    try:
+        if json.loads(out_path.read_text()).get("version") == version:
+            return False
+    except (OSError, ValueError, AttributeError):
+        pass
+    tmp = out_path.with_name(out_path.name + ".tmp")
+    tmp.write_text(json.dumps({"as_of": payload.get("as_of"), "version": version, **body}, separators=(",", ":")))
+    os.replace(tmp, out_path)
+    return True
+
+
+def export_portfolio_json(portfolio_name: str = DEFAULT_PORTFOLIO_NAME, snap: PriceSnapshot | None = None,
+                          out_path: str | Path | None = None) -> Path:
+    """Write the UI snapshot for one portfolio (default BASE_DIR/portfolio.json).
+    Pass ``snap`` to value it against an already loaded price snapshot; otherwise
+    prices come from the same single query as the positions. The file is only
+    rewritten when its content changed (see write_snapshot)."""
+    out_path = Path(out_path) if out_path else Path(BASE_DIR) / "portfolio.json"
+    as_of = datetime.now(UTC).isoformat() + "Z"
     with SessionLocal() as db:
-        pf = db.query(Portfolio).filter_by(name=portfolio_name).first()
-        if not pf:
-            out_path.write_text(json.dumps({"as_of": datetime.now(UTC).isoformat() + "Z", "assets": []}, indent=2))
+        rows = _snapshot_rows(db, portfolio_name, with_prices=snap is None)
+        if not rows:
+            write_snapshot(out_path, {"as_of": as_of, "assets": []})
             return out_path
-        positions = (
-            db.query(Position)
-            .join(Asset, Asset.id == Position.asset_id)
-            .filter(Position.portfolio_id == pf.id, Asset.active)
-            .all()
-        )
+        snap = snap if snap is not None else _rows_snapshot(db, rows)
         assets_payload: List[Dict[str, Any]] = []
         total_mv_usd = 0.0
         total_mv_gbp = 0.0
         total_mv_btc = 0.0
-        gbp_usd = latest_fx(db, "GBP", "USD") or 0.0
-        btc_usd = latest_fx(db, "BTC", "USD") or 0.0
-        for pos in positions:
-            asset = db.get(Asset, pos.asset_id)
-            mv_usd = position_market_value_usd(db, pos) or 0.0
-            cb_usd = position_cost_basis_usd(db, pos) or 0.0
-            price_usd = latest_price_usd(db, pos.asset_id) or 0.0
+        gbp_usd = latest_fx(db, "GBP", "USD", snap) or 0.0
+        btc_usd = latest_fx(db, "BTC", "USD", snap) or 0.0
+        for pos in rows:
+            if pos.asset_id is None:
+                continue
+            # Rows carry the Position attributes the valuation helpers read
+            mv_usd = position_market_value_usd(db, pos, snap) or 0.0
+            cb_usd = position_cost_basis_usd(db, pos, snap) or 0.0
+            price_usd = latest_price_usd(db, pos.asset_id, snap) or 0.0
 
-            price_gbp = latest_price_ccy(db, pos.asset_id, "GBP") or 0.0
-            price_btc = latest_price_ccy(db, pos.asset_id, "BTC") or 0.0
+            price_gbp = latest_price_ccy(db, pos.asset_id, "GBP", snap) or 0.0
+            price_btc = latest_price_ccy(db, pos.asset_id, "BTC", snap) or 0.0
 
             mv_gbp = price_gbp * pos.coins if price_gbp else (mv_usd / gbp_usd if gbp_usd else 0.0)
             mv_btc = price_btc * pos.coins if price_btc else (mv_usd / btc_usd if btc_usd else 0.0)
@@ -78,11 +164,11 @@ def export_portfolio_json(portfolio_name: str = DEFAULT_PORTFOLIO_NAME) -> Path:
             total_mv_btc += mv_btc
             assets_payload.append(
                 {
-                    "symbol": asset.symbol,
-                    "name": asset.name,
-                    "coingecko_id": asset.coingecko_id,
-                    "is_stable": bool(asset.is_stable),
-                    "is_fiat": bool(asset.is_fiat),
+                    "symbol": pos.symbol,
+                    "name": pos.name,
+                    "coingecko_id": pos.coingecko_id,
+                    "is_stable": bool(pos.is_stable),
+                    "is_fiat": bool(pos.is_fiat),
                     "coins": pos.coins,
                     "price_usd": price_usd,
                     "price_gbp": price_gbp,
@@ -96,16 +182,21 @@ def export_portfolio_json(portfolio_name: str = DEFAULT_PORTFOLIO_NAME) -> Path:
                 }
             )
         payload: Dict[str, Any] = {
-            "as_of": datetime.now(UTC).isoformat() + "Z",
-            "portfolio": pf.name,
+            "as_of": as_of,
+            "portfolio": rows[0].portfolio,
             "total_mv_usd": total_mv_usd,
             "total_mv_gbp": total_mv_gbp,
             "total_mv_btc": total_mv_btc,
             "assets": assets_payload,
         }
-        out_path.write_text(json.dumps(payload, indent=2))
-        return out_path
+    # Latest Monte Carlo summary, refreshed by the runner on its own cadence
+    if rows[0].report_json:
+        payload["risk"] = json.loads(rows[0].report_json)
+    write_snapshot(out_path, payload)
+    return out_path
 
 
 if __name__ == "__main__":
+    from .schema import ensure_schema
+    ensure_schema()
     export_portfolio_json()
@@ -1,8 +1,9 @@
 from __future__ import annotations
-from datetime import datetime, timedelta, UTC
-from typing import Dict, Any
+from datetime import datetime, UTC
+from typing import Dict, Any, Tuple
 from .db import SessionLocal
-from .models import Asset, Position
+from .buckets import hour_bucket, day_bucket
+from .coverage import count_present, unpack
 from sqlalchemy import text
 
 
@@ -10,112 +11,97 @@ def _now() -> datetime:
     return datetime.now(UTC)
 
 
-def verify_health() -> Dict[str, Any]:
-    """Return simple coverage stats for prices (USD) and FX (GBPUSD, BTCUSD).
-    - Checks last 24h hourly coverage and last 365d daily coverage by bucket presence.
-    """
-    now = _now()
-    since_24h = now - timedelta(hours=24)
-    since_1y = now - timedelta(days=365)
+def _held_coverage(db) -> Tuple[Dict[int, Dict[str, Any]], Dict[str, Dict[str, Tuple[int, int]]]]:
+    """One query: every held, non-fiat asset with its USD price coverage bitmaps, plus
+    the GBPUSD / BTCUSD FX bitmaps. Returns ({asset_id: {"symbol", tier: (base, bits)}},
+    {base_ccy: {tier: (base, bits)}})."""
+    rows = db.execute(
+        text(
+            """
+            SELECT 'p', a.id, a.symbol, c.tier, c.base, c.bits
+              FROM assets a
+              LEFT JOIN price_coverage c ON c.asset_id = a.id AND c.ccy = 'USD'
+             WHERE a.id IN (SELECT asset_id FROM positions WHERE coins > 0)
+               AND (a.is_fiat = 0 OR a.is_fiat IS NULL)
+            UNION ALL
+            SELECT 'fx', base_ccy, quote_ccy, tier, base, bits
+              FROM fx_coverage
+             WHERE quote_ccy = 'USD' AND base_ccy IN ('GBP', 'BTC')
+            """
+        )
+    ).fetchall()
+    assets: Dict[int, Dict[str, Any]] = {}
+    fx: Dict[str, Dict[str, Tuple[int, int]]] = {"GBP": {}, "BTC": {}}
+    for kind, k1, k2, tier, base, bits in rows:
+        if kind == "p":
+            entry = assets.setdefault(int(k1), {"symbol": k2})
+            if tier is not None:
+                entry[tier] = (int(base), unpack(bits))
+        else:
+            fx[k1][tier] = (int(base), unpack(bits))
+    return assets, fx
 
-    with SessionLocal() as db:
-        # Only consider assets that are in the portfolio (positions), held (>0 coins), and are not fiat
-        asset_ids = [
-            row[0]
-            for row in (
-                db.query(Position.asset_id)
-                .join(Asset, Asset.id == Position.asset_id)
-                .filter(Position.coins > 0, (Asset.is_fiat == False) | (Asset.is_fiat.is_(None)))
-                .distinct()
-                .all()
-            )
-        ]
-        out: Dict[str, Any] = {
-            "assets_total": len(asset_ids),
-            "prices": {"hourly_24h_missing": 0, "daily_1y_missing": 0},
-            "fx": {"GBPUSD": {"hourly_24h_missing": 0, "daily_1y_missing": 0},
-                    "BTCUSD": {"hourly_24h_missing": 0, "daily_1y_missing": 0}},
-        }
 
-        # Helper to count distinct buckets present
-        def count_price_buckets_hourly(asset_id: int) -> int:
-            sql = text(
-                "SELECT COUNT(DISTINCT strftime('%Y-%m-%d %H', at)) AS c FROM prices "
-                "WHERE asset_id = :aid AND ccy = 'USD' AND at >= datetime('now','-24 hours')"
-            )
-            row = db.execute(sql, {"aid": asset_id}).fetchone()
-            return int((row[0] if row else 0) or 0)
+def _windows(now: datetime) -> Dict[str, Tuple[int, int]]:
+    # The last 24 hour buckets and last 365 day buckets, each ending with the current one
+    h, d = hour_bucket(now), day_bucket(now)
+    return {"hour": (h - 23, h), "day": (d - 364, d)}
+
 
-        def count_price_buckets_daily(asset_id: int) -> int:
-            sql = text(
-                "SELECT COUNT(DISTINCT date(at)) AS c FROM prices "
-                "WHERE asset_id = :aid AND ccy = 'USD' AND at >= datetime('now','-365 days')"
-            )
-            row = db.execute(sql, {"aid": asset_id}).fetchone()
-            return int((row[0] if row else 0) or 0)
+def _present(cov: Dict[str, Any], tier: str, window: Tuple[int, int]) -> int:
+    if tier not in cov:
+        return 0
+    base, bits = cov[tier]
+    return count_present(base, bits, *window)
 
-        def count_fx_buckets_hourly(base: str) -> int:
-            sql = text(
-                "SELECT COUNT(DISTINCT strftime('%Y-%m-%d %H', at)) AS c FROM fx_rates "
-                "WHERE base_ccy = :base AND quote_ccy = 'USD' AND at >= datetime('now','-24 hours')"
-            )
-            row = db.execute(sql, {"base": base}).fetchone()
-            return int((row[0] if row else 0) or 0)
 
-        def count_fx_buckets_daily(base: str) -> int:
-            sql = text(
-                "SELECT COUNT(DISTINCT date(at)) AS c FROM fx_rates "
-                "WHERE base_ccy = :base AND quote_ccy = 'USD' AND at >= datetime('now','-365 days')"
-            )
-            row = db.execute(sql, {"base": base}).fetchone()
-            return int((row[0] if row else 0) or 0)
+def verify_health() -> Dict[str, Any]:
+    """Return simple coverage stats for prices (USD) and FX (GBPUSD, BTCUSD).
+    - Checks last 24h hourly coverage and last 365d daily coverage by bucket presence,
+      read from the coverage bitmaps kept current on every price / FX write.
+    """
+    win = _windows(_now())
+    with SessionLocal() as db:
+        # Only consider assets that are in the portfolio (positions), held (>0 coins), and are not fiat
+        assets, fx = _held_coverage(db)
+    out: Dict[str, Any] = {
+        "assets_total": len(assets),
+        "prices": {"hourly_24h_missing": 0, "daily_1y_missing": 0},
+        "fx": {"GBPUSD": {"hourly_24h_missing": 0, "daily_1y_missing": 0},
+                "BTCUSD": {"hourly_24h_missing": 0, "daily_1y_missing": 0}},
+    }
 
-        # Prices: expect ~24 hourly buckets in last 24h and ~365 daily buckets in last 1y
-        for aid in asset_ids:
-            hourly = count_price_buckets_hourly(aid)
-            if hourly < 20:  # allow slack
-                out["prices"]["hourly_24h_missing"] += 1
-            daily = count_price_buckets_daily(aid)
-            if daily < 300:  # allow slack
-                out["prices"]["daily_1y_missing"] += 1
+    # Prices: expect ~24 hourly buckets in last 24h and ~365 daily buckets in last 1y
+    for cov in assets.values():
+        if _present(cov, "hour", win["hour"]) < 20:  # allow slack
+            out["prices"]["hourly_24h_missing"] += 1
+        if _present(cov, "day", win["day"]) < 300:  # allow slack
+            out["prices"]["daily_1y_missing"] += 1
 
-        # FX coverage
-        for base in ("GBP", "BTC"):
-            hourly = count_fx_buckets_hourly(base)
-            if hourly < 20:
-                out["fx"][f"{base}USD"]["hourly_24h_missing"] += 1
-            daily = count_fx_buckets_daily(base)
-            if daily < 300:
-                out["fx"][f"{base}USD"]["daily_1y_missing"] += 1
+    # FX coverage
+    for base in ("GBP", "BTC"):
+        if _present(fx[base], "hour", win["hour"]) < 20:
+            out["fx"][f"{base}USD"]["hourly_24h_missing"] += 1
+        if _present(fx[base], "day", win["day"]) < 300:
+            out["fx"][f"{base}USD"]["daily_1y_missing"] += 1
 
-        return out
+    return out
 
 
 def report_24h_per_asset() -> Dict[str, Any]:
     """Return per-asset 24h hourly bucket coverage for non-fiat, held assets.
     Classify assets with >=20 hourly buckets as 'full', others as 'missing'.
     """
+    win = _windows(_now())["hour"]
     with SessionLocal() as db:
-        rows = db.execute(
-            text(
-                """
-                SELECT a.symbol AS symbol,
-                       COUNT(DISTINCT strftime('%Y-%m-%d %H', p.at)) AS buckets
-                  FROM positions pos
-                  JOIN assets a ON a.id = pos.asset_id
-                  LEFT JOIN prices p ON p.asset_id = a.id AND p.ccy = 'USD' AND p.at >= datetime('now','-24 hours')
-                 WHERE pos.coins > 0 AND (a.is_fiat = 0 OR a.is_fiat IS NULL)
-                 GROUP BY a.id, a.symbol
-                 ORDER BY a.symbol
-                """
-            )
-        ).fetchall()
-        full: list[dict] = []
-        missing: list[dict] = []
-        for symbol, buckets in rows:
-            item = {"symbol": symbol, "buckets_24h": int(buckets or 0), "ok": int(buckets or 0) >= 20}
-            if item["ok"]:
-                full.append(item)
-            else:
-                missing.append(item)
-        return {"full": full, "missing": missing, "total": len(full) + len(missing)}
+        assets, _ = _held_coverage(db)
+    full: list[dict] = []
+    missing: list[dict] = []
+    for cov in sorted(assets.values(), key=lambda c: c["symbol"]):
+        buckets = _present(cov, "hour", win)
+        item = {"symbol": cov["symbol"], "buckets_24h": buckets, "ok": buckets >= 20}
+        if item["ok"]:
+            full.append(item)
+        else:
+            missing.append(item)
+    return {"full": full, "missing": missing, "total": len(full) + len(missing)}
@@ -0,0 +1,200 @@
+from __future__ import annotations
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from .config import HTTP_CACHE_PATH, HTTP_CACHE_MAX_BYTES, HTTP_CACHE_ENABLED
+
+# Query parameters carrying credentials; dropped from the URL stored with an entry
+SECRET_PARAMS = frozenset({"x_cg_demo_api_key", "x_cg_pro_api_key", "api_key", "apikey", "key", "token", "access_token"})
+
+
+def redact_url(url: str) -> str:
+    """``url`` without secret query parameters (the cache key is a hash, so only
+    the stored URL could leak them)."""
+    parts = urlsplit(url)
+    if not parts.query:
+        return url
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k.lower() not in SECRET_PARAMS]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+@dataclass
+class CacheEntry:
+    key: str
+    url: str
+    status: int
+    headers: Dict[str, str]
+    body: bytes
+    etag: str | None
+    last_modified: str | None
+    expires_at: float
+
+    @property
+    def fresh(self) -> bool:
+        return time.time() < self.expires_at
+
+    def to_response(self) -> requests.Response:
+        resp = requests.Response()
+        resp.status_code = self.status
+        resp._content = self.body
+        resp.headers = CaseInsensitiveDict(self.headers)
+        resp.url = self.url
+        resp.encoding = requests.utils.get_encoding_from_headers(resp.headers)
+        return resp
+
+
+class ResponseCache:
+    """SQLite-backed HTTP response cache keyed by URL + params.
+
+    Entries carry their own expiry (TTL chosen per call) and validators so stale
+    entries can be revalidated with If-None-Match / If-Modified-Since. Total body
+    size is bounded; the least recently used entries are evicted first.
+    """
+
+    def __init__(self, path: str | Path | None = None, max_bytes: int | None = None):
+        self.path = Path(path or HTTP_CACHE_PATH)
+        self.max_bytes = max_bytes if max_bytes is not None else HTTP_CACHE_MAX_BYTES
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0, "revalidated": 0, "stale": 0, "stores": 0, "evictions": 0}
+        self._lock = threading.Lock()
+        self._ready = False
+
+    def _connect(self) -> sqlite3.Connection:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10)
+        if not self._ready:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS http_cache (
+                    key TEXT PRIMARY KEY,
+                    url TEXT NOT NULL,
+                    status INTEGER NOT NULL,
+                    headers TEXT NOT NULL,
+                    body BLOB NOT NULL,
+                    etag TEXT,
+                    last_modified TEXT,
+                    expires_at REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    size INTEGER NOT NULL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_http_cache_access ON http_cache(last_access)")
+            # Scrub URLs stored before secrets were redacted
+            rows = conn.execute("SELECT key, url FROM http_cache WHERE url LIKE '%key=%' OR url LIKE '%token=%'").fetchall()
+            conn.executemany("UPDATE http_cache SET url = ? WHERE key = ?", [(redact_url(u), k) for k, u in rows])
+            conn.commit()
+            self._ready = True
+        return conn
+
+    @staticmethod
+    def key(url: str, params: Optional[Dict[str, Any]] = None) -> str:
+        items = sorted((str(k), str(v)) for k, v in (params or {}).items())
+        return hashlib.sha256(json.dumps([url, items]).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> CacheEntry | None:
+        with self._lock:
+            conn = self._connect()
+            try:
+                row = conn.execute(
+                    "SELECT url, status, headers, body, etag, last_modified, expires_at FROM http_cache WHERE key = ?",
+                    (key,),
+                ).fetchone()
+                if not row:
+                    return None
+                conn.execute("UPDATE http_cache SET last_access = ? WHERE key = ?", (time.time(), key))
+                conn.commit()
+            finally:
+                conn.close()
+        url, status, headers, body, etag, last_modified, expires_at = row
+        return CacheEntry(key, url, status, json.loads(headers), bytes(body), etag, last_modified, expires_at)
+
+    def put(self, key: str, resp: requests.Response, ttl: float) -> None:
+        body = resp.content or b""
+        if self.max_bytes and len(body) > self.max_bytes:
+            return
+        headers = {k: v for k, v in resp.headers.items() if k.lower() in ("content-type", "etag", "last-modified", "date")}
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO http_cache (key, url, status, headers, body, etag, last_modified, expires_at, last_access, size) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        key,
+                        redact_url(resp.url or ""),
+                        int(resp.status_code),
+                        json.dumps(headers),
+                        sqlite3.Binary(body),
+                        resp.headers.get("ETag"),
+                        resp.headers.get("Last-Modified"),
+                        now + ttl,
+                        now,
+                        len(body),
+                    ),
+                )
+                self._evict(conn)
+                conn.commit()
+            finally:
+                conn.close()
+        self.stats["stores"] += 1
+
+    def touch(self, key: str, ttl: float) -> None:
+        """Extend an entry's expiry after a 304 revalidation."""
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute("UPDATE http_cache SET expires_at = ?, last_access = ? WHERE key = ?", (now + ttl, now, key))
+                conn.commit()
+            finally:
+                conn.close()
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        if not self.max_bytes:
+            return
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM http_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        doomed = []
+        for key, size in conn.execute("SELECT key, size FROM http_cache ORDER BY last_access ASC"):
+            if total <= self.max_bytes:
+                break
+            doomed.append((key,))
+            total -= size
+        conn.executemany("DELETE FROM http_cache WHERE key = ?", doomed)
+        self.stats["evictions"] += len(doomed)
+
+    def clear(self) -> None:
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute("DELETE FROM http_cache")
+                conn.commit()
+            finally:
+                conn.close()
+
+
+_default_cache: ResponseCache | None = None
+_default_lock = threading.Lock()
+
+
+def default_cache() -> ResponseCache | None:
+    """Process-wide cache at HTTP_CACHE_PATH, or None when HTTP_CACHE_ENABLED is off."""
+    global _default_cache
+    if not HTTP_CACHE_ENABLED:
+        return None
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = ResponseCache()
+        return _default_cache
@@ -2,24 +2,83 @@ from typing import Any, Dict, Optional
 import time
 import requests
 from .config import HTTP_TIMEOUT, HTTP_RETRIES
+from .http_cache import ResponseCache, default_cache
+from .rate_limit import RateLimiter, retry_after_seconds
 
 class HttpClient:
-    def __init__(self, timeout: float | None = None, retries: int | None = None):
+    def __init__(
+        self,
+        timeout: float | None = None,
+        retries: int | None = None,
+        limiter: RateLimiter | None = None,
+        cache: ResponseCache | None = None,
+        use_cache: bool = True,
+    ):
         self.timeout = timeout if timeout is not None else HTTP_TIMEOUT
         self.retries = retries if retries is not None else HTTP_RETRIES
+        self.limiter = limiter
+        self.cache = cache if cache is not None else (default_cache() if use_cache else None)
         self.session = requests.Session()
 
-    def get(self, url: str, params: Optional[Dict[str, Any]] = None, headers: Optional[Dict[str, str]] = None) -> requests.Response:
+    def get(
+        self,
+        url: str,
+        params: Optional[Dict[str, Any]] = None,
+        headers: Optional[Dict[str, str]] = None,
+        ttl: float | None = None,
+    ) -> requests.Response:
+        """GET with retries. When ``ttl`` is given and a cache is configured, a fresh
+        cached response is returned without a request; a stale one is revalidated
+        via ETag/Last-Modified and served as a fallback if the request fails.
+        """
+        if not ttl or self.cache is None:
+            return self._fetch(url, params, headers)
+        key = self.cache.key(url, params)
+        entry = self.cache.get(key)
+        if entry and entry.fresh:
+            self.cache.stats["hits"] += 1
+            return entry.to_response()
+        self.cache.stats["misses"] += 1
+        req_headers = dict(headers or {})
+        if entry and entry.etag:
+            req_headers["If-None-Match"] = entry.etag
+        if entry and entry.last_modified:
+            req_headers["If-Modified-Since"] = entry.last_modified
+        try:
+            resp = self._fetch(url, params, req_headers or None)
+        except Exception:
+            if entry:
+                self.cache.stats["stale"] += 1
+                return entry.to_response()
+            raise
+        if resp.status_code == 304 and entry:
+            self.cache.touch(key, ttl)
+            self.cache.stats["revalidated"] += 1
+            return entry.to_response()
+        self.cache.put(key, resp, ttl)
+        return resp
+
+    def _fetch(self, url: str, params: Optional[Dict[str, Any]], headers: Optional[Dict[str, str]]) -> requests.Response:
         last_exc: Exception | None = None
         for attempt in range(self.retries + 1):
             try:
+                if self.limiter:
+                    self.limiter.acquire()
                 resp = self.session.get(url, params=params, headers=headers, timeout=self.timeout)
                 resp.raise_for_status()
                 return resp
             except Exception as e:
                 last_exc = e
                 if attempt < self.retries:
-                    time.sleep(1.0 * (attempt + 1))
+                    delay = 1.0 * (attempt + 1)
+                    response = getattr(e, "response", None)
+                    if getattr(response, "status_code", None) == 429:
+                        delay = retry_after_seconds(response) or delay
+                        if self.limiter:
+                            # Everyone sharing the quota backs off, not just this caller
+                            self.limiter.penalize(delay)
+                            continue
+                    time.sleep(delay)
                 else:
                     raise
         # Should not reach here
@@ -165,4 +165,6 @@ def import_portfolio_json(path: str, portfolio_name: str = "Default") -> None:
 
 
 if __name__ == "__main__":
+    from .schema import ensure_schema
+    ensure_schema()
     import_tokenlist()
@@ -0,0 +1,58 @@
+from __future__ import annotations
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import String, cast, literal, select
+
+from .models import LatestPrice, LatestFx
+
+
+@dataclass
+class PriceSnapshot:
+    """Current prices and FX rates loaded once from latest_prices / latest_fx."""
+    prices: Dict[Tuple[int, str], float] = field(default_factory=dict)
+    fx: Dict[Tuple[str, str], float] = field(default_factory=dict)
+    # Memo for values derived from the snapshot (e.g. USDC-implied GBPUSD)
+    derived: Dict[str, Optional[float]] = field(default_factory=dict)
+
+    def price(self, asset_id: int, ccy: str) -> Optional[float]:
+        return self.prices.get((asset_id, ccy))
+
+    def rate(self, base: str, quote: str) -> Optional[float]:
+        return self.fx.get((base, quote))
+
+
+def load_snapshot(db) -> PriceSnapshot:
+    """Load every latest price and FX rate in a single query."""
+    q = select(
+        literal("p").label("kind"),
+        cast(LatestPrice.asset_id, String).label("k1"),
+        LatestPrice.ccy.label("k2"),
+        LatestPrice.price.label("v"),
+    ).union_all(
+        select(literal("fx"), LatestFx.base_ccy, LatestFx.quote_ccy, LatestFx.rate)
+    )
+    snap = PriceSnapshot()
+    for kind, k1, k2, v in db.execute(q):
+        if v is None:
+            continue
+        if kind == "p":
+            snap.prices[(int(k1), k2)] = float(v)
+        else:
+            snap.fx[(k1, k2)] = float(v)
+    return snap
+
+
+def rebuild_latest(conn) -> None:
+    """Recompute latest_prices / latest_fx from the raw tables (SQLite picks the
+    bare price/rate column from the MAX(at) row)."""
+    conn.exec_driver_sql("DELETE FROM latest_prices")
+    conn.exec_driver_sql(
+        "INSERT INTO latest_prices (asset_id, ccy, price, at) "
+        "SELECT asset_id, ccy, price, MAX(at) FROM prices GROUP BY asset_id, ccy"
+    )
+    conn.exec_driver_sql("DELETE FROM latest_fx")
+    conn.exec_driver_sql(
+        "INSERT INTO latest_fx (base_ccy, quote_ccy, rate, at) "
+        "SELECT base_ccy, quote_ccy, rate, MAX(at) FROM fx_rates GROUP BY base_ccy, quote_ccy"
+    )
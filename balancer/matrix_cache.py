@@ -0,0 +1,311 @@
+from __future__ import annotations
+import json
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime, UTC
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import text
+
+from . import db as _db
+from .buckets import COLUMNS, bucket_key, bucket_start
+from .config import MATRIX_CACHE_DIR, MATRIX_CACHE_ENABLED
+from .rollups import ROLLUPS
+
+# name -> (raw table, tier, window in buckets ending at the current one; None = all history)
+SERIES: Dict[str, Tuple[str, str, Optional[int]]] = {
+    "prices_hour": ("prices", "hour", 24),
+    "prices_day": ("prices", "day", 366),
+    "prices_month": ("prices", "month", None),
+    "fx_hour": ("fx_rates", "hour", 24),
+    "fx_day": ("fx_rates", "day", 366),
+    "fx_month": ("fx_rates", "month", None),
+}
+# Rows are asset ids (USD prices) or base currencies (FX quoted in USD)
+_QUOTE = "USD"
+
+# Files per series in the cache dir, one set per build version <v>:
+#   <name>.<v>.npy        float64 (n_rows x n_buckets) bucket closes, NaN where no data
+#   <name>.<v>.rows.npy   row index: int64 asset ids or unicode base currencies
+#   <name>.<v>.times.npy  column index: datetime64[us] bucket starts (naive UTC)
+#   <name>.meta.json      current version, tier, bucket range, shape and the raw-table
+#                         id it was built at
+# A build writes a new version's files, then swaps meta.json, the only pointer, in
+# one os.replace; readers never pair one build's values with another's indexes.
+# The previous version is kept so a reader that just read the old meta can still
+# open its files.
+
+
+@dataclass
+class PriceMatrix:
+    """A cached matrix opened read-only with np.memmap; slicing never copies."""
+    name: str
+    tier: str
+    values: np.ndarray
+    rows: np.ndarray
+    times: np.ndarray
+    lo: int  # bucket key of the first column
+    built_id: int  # raw-table id the build saw; newer rows are not in the values
+    db: str | None = None  # database file the matrix was built from
+
+    def index(self, key) -> int:
+        hits = np.flatnonzero(self.rows == key)
+        if not len(hits):
+            raise KeyError(key)
+        return int(hits[0])
+
+    def window(self, start: datetime | None = None, end: datetime | None = None) -> np.ndarray:
+        """View of the columns whose bucket starts fall in [start, end)."""
+        i = 0 if start is None else int(np.searchsorted(self.times, np.datetime64(start, "us")))
+        j = len(self.times) if end is None else int(np.searchsorted(self.times, np.datetime64(end, "us")))
+        return self.values[:, i:j]
+
+
+def _meta_path(base: Path, name: str) -> Path:
+    return base / f"{name}.meta.json"
+
+
+def _paths(base: Path, name: str, version: int) -> Dict[str, Path]:
+    return {
+        "values": base / f"{name}.{version}.npy",
+        "rows": base / f"{name}.{version}.rows.npy",
+        "times": base / f"{name}.{version}.times.npy",
+    }
+
+
+def _read_meta(base: Path, name: str) -> Dict[str, Any] | None:
+    try:
+        meta = json.loads(_meta_path(base, name).read_text())
+    except (FileNotFoundError, ValueError):
+        return None
+    # Unversioned meta from an older layout: rebuild
+    return meta if "version" in meta else None
+
+
+def _prune(base: Path, name: str, keep: Tuple[int, ...]) -> None:
+    for p in base.glob(f"{name}.*.npy"):
+        version = p.name[len(name) + 1:].split(".", 1)[0]
+        if not version.isdigit() or int(version) not in keep:
+            p.unlink(missing_ok=True)
+    for legacy in (f"{name}.npy", f"{name}.rows.npy", f"{name}.times.npy"):
+        (base / legacy).unlink(missing_ok=True)
+
+
+def _replace_npy(path: Path, arr: np.ndarray) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        np.save(f, arr)
+    os.replace(tmp, path)
+
+
+def _db_name(conn) -> str | None:
+    return conn.engine.url.database
+
+
+def _naive(dt: datetime) -> datetime:
+    return dt.astimezone(UTC).replace(tzinfo=None) if dt.tzinfo else dt
+
+
+def _row_keys(conn, table: str) -> np.ndarray:
+    if table == "prices":
+        ids = [r[0] for r in conn.exec_driver_sql("SELECT id FROM assets WHERE active = 1 ORDER BY id")]
+        return np.array(ids, dtype=np.int64)
+    bases = [r[0] for r in conn.exec_driver_sql(
+        "SELECT DISTINCT base_ccy FROM latest_fx WHERE quote_ccy = ? ORDER BY base_ccy", (_QUOTE,)
+    )]
+    return np.array(bases, dtype="<U16")
+
+
+def _bucket_range(conn, table: str, tier: str, window: Optional[int], now: datetime, rolled: int) -> Tuple[int, int]:
+    hi = bucket_key(tier, now)
+    if window is not None:
+        return hi - window + 1, hi
+    (k1, k2), _, targets = ROLLUPS[table]
+    col = COLUMNS[tier]
+    lo = conn.exec_driver_sql(
+        f"SELECT MIN(b) FROM ("
+        f" SELECT MIN(bucket) AS b FROM {targets[tier]} WHERE {k2} = ?"
+        f" UNION ALL SELECT MIN({col}) FROM {table} WHERE {k2} = ? AND id > ?)",
+        (_QUOTE, _QUOTE, rolled),
+    ).scalar()
+    return (hi if lo is None else min(lo, hi)), hi
+
+
+def _rolled_id(conn, table: str) -> int:
+    return conn.exec_driver_sql(
+        "SELECT COALESCE(rollup_id, 0) FROM compaction_state WHERE table_name = ?", (table,)
+    ).scalar() or 0
+
+
+def _fetch(conn, table: str, tier: str, keys: np.ndarray, lo: int, hi: int, rolled: int,
+           quote: str = _QUOTE) -> np.ndarray:
+    """Bucket closes for columns lo..hi: the rollup close, overridden by any newer
+    raw row not yet folded into the rollups."""
+    (k1, k2), value, targets = ROLLUPS[table]
+    col = COLUMNS[tier]
+    out = np.full((len(keys), hi - lo + 1), np.nan, dtype=np.float64)
+    if hi < lo or not len(keys):
+        return out
+    row_of = {(int(k) if table == "prices" else str(k)): i for i, k in enumerate(keys.tolist())}
+    rows = conn.execute(text(
+        f"SELECT {k1}, bucket, close, close_at FROM {targets[tier]} WHERE {k2} = :q AND bucket BETWEEN :lo AND :hi"
+        f" UNION ALL"
+        f" SELECT {k1}, {col}, {value}, at FROM {table} WHERE {k2} = :q AND {col} BETWEEN :lo AND :hi AND id > :rolled"
+        f" ORDER BY 4"
+    ), {"q": quote, "lo": lo, "hi": hi, "rolled": rolled})
+    for key, bucket, v, _ in rows:
+        i = row_of.get(key)
+        if i is not None and v is not None:
+            out[i, bucket - lo] = v
+    return out
+
+
+def _build_one(conn, base: Path, name: str, now: datetime, full: bool, rolled: int, built_id: int) -> Dict[str, Any]:
+    table, tier, window = SERIES[name]
+    keys = _row_keys(conn, table)
+    lo, hi = _bucket_range(conn, table, tier, window, now, rolled)
+
+    meta = None if full else _read_meta(base, name)
+    if meta is not None:
+        old_paths = _paths(base, name, meta["version"])
+        if (meta.get("tier") != tier or not old_paths["values"].exists()
+                or not np.array_equal(np.load(old_paths["rows"]), keys)):
+            meta = None
+    # Reuse cached columns when the new range overlaps the old one from the left edge
+    incremental = meta is not None and meta["lo"] <= lo <= meta["hi"] + 1
+    refetch_from = lo
+    if incremental:
+        col = COLUMNS[tier]
+        # Late rows (backfill, repair) landing in buckets we already hold
+        dirty = conn.exec_driver_sql(
+            f"SELECT MIN({col}) FROM {table} WHERE id > ? AND {col} BETWEEN ? AND ?",
+            (meta["built_id"], lo, meta["hi"]),
+        ).scalar()
+        # The newest cached bucket may have been partial, so it is always refetched
+        refetch_from = max(lo, min(meta["hi"], dirty if dirty is not None else meta["hi"]))
+
+    values = np.full((len(keys), hi - lo + 1), np.nan, dtype=np.float64)
+    if incremental and refetch_from > lo:
+        old = np.load(old_paths["values"], mmap_mode="r")
+        values[:, : refetch_from - lo] = old[:, lo - meta["lo"]: refetch_from - meta["lo"]]
+        del old
+    values[:, refetch_from - lo:] = _fetch(conn, table, tier, keys, refetch_from, hi, rolled)
+
+    base.mkdir(parents=True, exist_ok=True)
+    previous = _read_meta(base, name)
+    version = previous["version"] + 1 if previous else 1
+    paths = _paths(base, name, version)
+    _replace_npy(paths["values"], values)
+    _replace_npy(paths["rows"], keys)
+    times = np.array([bucket_start(tier, b) for b in range(lo, hi + 1)], dtype="datetime64[us]")
+    _replace_npy(paths["times"], times)
+    meta = {"version": version, "tier": tier, "lo": lo, "hi": hi, "shape": list(values.shape),
+            "built_id": built_id, "db": _db_name(conn), "built_at": datetime.now(UTC).isoformat()}
+    tmp = _meta_path(base, name).with_name(_meta_path(base, name).name + ".tmp")
+    tmp.write_text(json.dumps(meta))
+    os.replace(tmp, _meta_path(base, name))
+    _prune(base, name, (version, previous["version"]) if previous else (version,))
+    return {"mode": "incremental" if incremental else "full", "shape": list(values.shape),
+            "fetched_buckets": hi - refetch_from + 1}
+
+
+def build_matrices(now: datetime | None = None, full: bool = False, bind=None,
+                   cache_dir: str | Path | None = None, names: List[str] | None = None) -> Dict[str, Any]:
+    """Materialise the SERIES matrices under MATRIX_CACHE_DIR.
+
+    When a previous build exists for the same rows, only buckets that are new,
+    or that received rows since that build, are read from the DB; the rest are
+    copied from the old file. ``full=True`` re-reads everything. Returns mode,
+    shape, buckets fetched and seconds per series.
+    """
+    now = _naive(now or datetime.now(UTC))
+    base = Path(cache_dir or MATRIX_CACHE_DIR)
+    bind = bind or _db.engine
+    report: Dict[str, Any] = {}
+    with bind.connect() as conn:
+        for name in names or list(SERIES):
+            table = SERIES[name][0]
+            t0 = time.perf_counter()
+            rolled = _rolled_id(conn, table)
+            built_id = conn.exec_driver_sql(f"SELECT COALESCE(MAX(id), 0) FROM {table}").scalar()
+            report[name] = _build_one(conn, base, name, now, full, rolled, built_id)
+            report[name]["seconds"] = round(time.perf_counter() - t0, 4)
+    return report
+
+
+def bucket_closes(conn, table: str, tier: str, keys: np.ndarray, lo: int, hi: int,
+                  quote: str = _QUOTE) -> np.ndarray:
+    """(len(keys) x buckets lo..hi) closes quoted in ``quote`` straight from the
+    rollups and pending raw rows, for ranges the cached matrices do not cover."""
+    return _fetch(conn, table, tier, keys, lo, hi, _rolled_id(conn, table), quote)
+
+
+def load_matrix(name: str, cache_dir: str | Path | None = None) -> PriceMatrix:
+    """Open a built matrix read-only via np.memmap, with its row and time indexes."""
+    base = Path(cache_dir or MATRIX_CACHE_DIR)
+    for attempt in range(3):
+        meta = _read_meta(base, name)
+        if meta is None:
+            raise FileNotFoundError(_meta_path(base, name))
+        paths = _paths(base, name, meta["version"])
+        try:
+            return PriceMatrix(
+                name=name,
+                tier=meta["tier"],
+                values=np.load(paths["values"], mmap_mode="r"),
+                rows=np.load(paths["rows"]),
+                times=np.load(paths["times"]),
+                lo=meta["lo"],
+                built_id=meta["built_id"],
+                db=meta.get("db"),
+            )
+        except FileNotFoundError:
+            # Two builds went by since meta was read; read the new pointer
+            if attempt == 2:
+                raise
+    raise AssertionError("unreachable")
+
+
+def cached_closes(conn, table: str, tier: str, keys: np.ndarray, lo: int, hi: int,
+                  quote: str = _QUOTE, cache_dir: str | Path | None = None) -> np.ndarray:
+    """Same as bucket_closes, but served from the hour/day matrices where they cover
+    the request. Buckets outside the cached range, rows the matrix lacks, and
+    buckets that received rows since the build come from the DB."""
+    name = f"{'prices' if table == 'prices' else 'fx'}_{tier}"
+    m = None
+    if MATRIX_CACHE_ENABLED and quote == _QUOTE and name in SERIES:
+        try:
+            m = load_matrix(name, cache_dir)
+        except FileNotFoundError:
+            pass
+        if m is not None and m.db != _db_name(conn):
+            m = None
+    c_lo, c_hi = (max(lo, m.lo), min(hi, m.lo + len(m.times) - 1)) if m is not None else (1, 0)
+    if c_hi >= c_lo:
+        (_, k2), _, _ = ROLLUPS[table]
+        col = COLUMNS[tier]
+        dirty = conn.exec_driver_sql(
+            f"SELECT MIN({col}) FROM {table} WHERE {k2} = ? AND id > ? AND {col} BETWEEN ? AND ?",
+            (quote, m.built_id, c_lo, c_hi),
+        ).scalar()
+        if dirty is not None:
+            c_hi = dirty - 1
+    if c_hi < c_lo:
+        return bucket_closes(conn, table, tier, keys, lo, hi, quote)
+
+    keys = np.asarray(keys)
+    out = np.full((len(keys), hi - lo + 1), np.nan, dtype=np.float64)
+    pos = {k: i for i, k in enumerate(m.rows.tolist())}
+    idx = np.array([pos.get(k, -1) for k in keys.tolist()], dtype=np.int64)
+    hit = idx >= 0
+    out[hit, c_lo - lo: c_hi - lo + 1] = m.values[idx[hit], c_lo - m.lo: c_hi - m.lo + 1]
+    if (~hit).any():
+        out[~hit, c_lo - lo: c_hi - lo + 1] = bucket_closes(conn, table, tier, keys[~hit], c_lo, c_hi, quote)
+    if c_lo > lo:
+        out[:, : c_lo - lo] = bucket_closes(conn, table, tier, keys, lo, c_lo - 1, quote)
+    if c_hi < hi:
+        out[:, c_hi - lo + 1:] = bucket_closes(conn, table, tier, keys, c_hi + 1, hi, quote)
+    return out
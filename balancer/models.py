@@ -1,7 +1,17 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Float, ForeignKey, UniqueConstraint, Text
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Float, ForeignKey, UniqueConstraint, Text, Index, LargeBinary, PrimaryKeyConstraint, event
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import relationship, declared_attr
 from datetime import datetime, UTC
 from .db import Base
+from .buckets import hour_bucket, day_bucket, month_bucket
+
+def _bucket_default(fn):
+    """Column default deriving a bucket key from the row's `at` (set explicitly or by its own default)."""
+    def _default(ctx):
+        at = ctx.get_current_parameters().get("at")
+        return fn(at) if at is not None else None
+    return _default
+
 
 class Asset(Base):
     __tablename__ = "assets"
@@ -41,6 +51,17 @@ class Price(Base):
     ccy = Column(String, index=True, nullable=False)
     price = Column(Float, nullable=False)
     at = Column(DateTime, index=True, default=lambda: datetime.now(UTC))
+    # Stored UTC bucket keys (see buckets.py) so grouping by hour/day/month can use indexes
+    hour_bucket = Column(Integer, default=_bucket_default(hour_bucket))
+    day_bucket = Column(Integer, default=_bucket_default(day_bucket))
+    month_bucket = Column(Integer, default=_bucket_default(month_bucket))
+    # Unique index rather than a table constraint so existing DBs can add it in place (schema.ensure_schema)
+    __table_args__ = (
+        Index("uq_price_asset_ccy_at", "asset_id", "ccy", "at", unique=True),
+        Index("idx_prices_hour", "asset_id", "ccy", "hour_bucket", "at"),
+        Index("idx_prices_day", "asset_id", "ccy", "day_bucket", "at"),
+        Index("idx_prices_month", "asset_id", "ccy", "month_bucket", "at"),
+    )
 
 class FxRate(Base):
     __tablename__ = "fx_rates"
@@ -49,7 +70,105 @@ class FxRate(Base):
     quote_ccy = Column(String, index=True, nullable=False)
     rate = Column(Float, nullable=False)
     at = Column(DateTime, index=True, default=lambda: datetime.now(UTC))
-    __table_args__ = (UniqueConstraint("base_ccy", "quote_ccy", "at", name="uq_fx_pair_time"),)
+    hour_bucket = Column(Integer, default=_bucket_default(hour_bucket))
+    day_bucket = Column(Integer, default=_bucket_default(day_bucket))
+    month_bucket = Column(Integer, default=_bucket_default(month_bucket))
+    __table_args__ = (
+        UniqueConstraint("base_ccy", "quote_ccy", "at", name="uq_fx_pair_time"),
+        Index("idx_fx_hour", "base_ccy", "quote_ccy", "hour_bucket", "at"),
+        Index("idx_fx_day", "base_ccy", "quote_ccy", "day_bucket", "at"),
+        Index("idx_fx_month", "base_ccy", "quote_ccy", "month_bucket", "at"),
+    )
+
+class LatestPrice(Base):
+    """Newest row per (asset_id, ccy) in prices; kept current on every price write."""
+    __tablename__ = "latest_prices"
+    asset_id = Column(Integer, ForeignKey("assets.id"), primary_key=True)
+    ccy = Column(String, primary_key=True)
+    price = Column(Float, nullable=False)
+    at = Column(DateTime, nullable=False)
+
+class LatestFx(Base):
+    """Newest row per (base_ccy, quote_ccy) in fx_rates; kept current on every FX write."""
+    __tablename__ = "latest_fx"
+    base_ccy = Column(String, primary_key=True)
+    quote_ccy = Column(String, primary_key=True)
+    rate = Column(Float, nullable=False)
+    at = Column(DateTime, nullable=False)
+
+class PriceCoverage(Base):
+    """Bitmap of the hour / day buckets holding at least one price per (asset_id, ccy):
+    bit i of ``bits`` (little-endian) is bucket ``base`` + i. Maintained on every
+    price write (balancer.coverage); only the last coverage.TIER_SPAN buckets are kept."""
+    __tablename__ = "price_coverage"
+    asset_id = Column(Integer, ForeignKey("assets.id"), primary_key=True)
+    ccy = Column(String, primary_key=True)
+    tier = Column(String, primary_key=True)  # hour / day
+    base = Column(Integer, nullable=False)
+    bits = Column(LargeBinary, nullable=False)
+
+class FxCoverage(Base):
+    """Bucket bitmap per (base_ccy, quote_ccy), as PriceCoverage."""
+    __tablename__ = "fx_coverage"
+    base_ccy = Column(String, primary_key=True)
+    quote_ccy = Column(String, primary_key=True)
+    tier = Column(String, primary_key=True)
+    base = Column(Integer, nullable=False)
+    bits = Column(LargeBinary, nullable=False)
+
+class CompactionState(Base):
+    """Per-table watermark for incremental compaction."""
+    __tablename__ = "compaction_state"
+    table_name = Column(String, primary_key=True)
+    last_id = Column(Integer, nullable=False, default=0)  # rows with id > last_id are uncompacted
+    rollup_id = Column(Integer)  # rows with id > rollup_id are not yet in the OHLC rollups
+    hour_since = Column(DateTime)  # tier boundaries used by the last pass
+    day_since = Column(DateTime)
+    hour_rollup_since = Column(DateTime)  # hourly / daily rollup buckets before these were dropped
+    day_rollup_since = Column(DateTime)
+    updated_at = Column(DateTime, default=lambda: datetime.now(UTC))
+
+class _Ohlc:
+    """Per-bucket OHLC of raw rows, merged in by compaction before they are pruned.
+    `bucket` is the buckets.py key for the table's tier."""
+    bucket = Column(Integer, nullable=False)
+    open = Column(Float, nullable=False)
+    high = Column(Float, nullable=False)
+    low = Column(Float, nullable=False)
+    close = Column(Float, nullable=False)
+    count = Column(Integer, nullable=False, default=0)
+    open_at = Column(DateTime, nullable=False)
+    close_at = Column(DateTime, nullable=False)
+
+class _PriceOhlc(_Ohlc):
+    @declared_attr
+    def asset_id(cls):
+        return Column(Integer, ForeignKey("assets.id"), nullable=False)
+    ccy = Column(String, nullable=False)
+    __table_args__ = (PrimaryKeyConstraint("asset_id", "ccy", "bucket"),)
+
+class _FxOhlc(_Ohlc):
+    base_ccy = Column(String, nullable=False)
+    quote_ccy = Column(String, nullable=False)
+    __table_args__ = (PrimaryKeyConstraint("base_ccy", "quote_ccy", "bucket"),)
+
+class PriceHourly(_PriceOhlc, Base):
+    __tablename__ = "prices_hourly"
+
+class PriceDaily(_PriceOhlc, Base):
+    __tablename__ = "prices_daily"
+
+class PriceMonthly(_PriceOhlc, Base):
+    __tablename__ = "prices_monthly"
+
+class FxHourly(_FxOhlc, Base):
+    __tablename__ = "fx_hourly"
+
+class FxDaily(_FxOhlc, Base):
+    __tablename__ = "fx_daily"
+
+class FxMonthly(_FxOhlc, Base):
+    __tablename__ = "fx_monthly"
 
 class Target(Base):
     __tablename__ = "targets"
@@ -83,6 +202,48 @@ class Alert(Base):
     severity = Column(String, default="info")
     at = Column(DateTime, index=True, default=lambda: datetime.now(UTC))
 
+class RuleState(Base):
+    """Inputs and results of the last rules evaluation of each (portfolio, asset).
+    Rows are only rewritten when the asset is evaluated, so they describe the
+    state the skip pre-pass measures movement against."""
+    __tablename__ = "rule_state"
+    portfolio_id = Column(Integer, ForeignKey("portfolios.id"), primary_key=True)
+    asset_id = Column(Integer, ForeignKey("assets.id"), primary_key=True)
+    inputs = Column(String, nullable=False)  # position / target / ladder fingerprint
+    price_usd = Column(Float)
+    unit_cost_usd = Column(Float)
+    mv_usd = Column(Float)
+    total_mv_usd = Column(Float)
+    weight = Column(Float)
+    pnl_multiple = Column(Float)
+    evaluated_at = Column(DateTime, default=lambda: datetime.now(UTC))
+
+class PriceChange(Base):
+    """Percentage change per (asset, currency) over each UI window, rebuilt
+    after every price fetch (balancer.changes); NULL where no reference price."""
+    __tablename__ = "price_changes"
+    asset_id = Column(Integer, ForeignKey("assets.id"), primary_key=True)
+    ccy = Column(String, primary_key=True)
+    latest = Column(Float, nullable=False)
+    at = Column(DateTime, nullable=False)  # time of the latest USD price
+    h1 = Column(Float)
+    d1 = Column(Float)
+    d7 = Column(Float)
+    d30 = Column(Float)
+    d60 = Column(Float)
+    d90 = Column(Float)
+    d365 = Column(Float)
+    since_first = Column(Float)
+    computed_at = Column(DateTime, nullable=False)
+
+class RiskReport(Base):
+    """Latest Monte Carlo risk summary per portfolio (VaR/CVaR, ladder-hit
+    probabilities) as JSON; recomputed on the RISK_EVERY_HOURS cadence."""
+    __tablename__ = "risk_report"
+    portfolio_id = Column(Integer, ForeignKey("portfolios.id"), primary_key=True)
+    computed_at = Column(DateTime, nullable=False)
+    report_json = Column(Text, nullable=False)
+
 class TradeManual(Base):
     __tablename__ = "trades_manual"
     id = Column(Integer, primary_key=True)
@@ -112,3 +273,55 @@ class NewsItem(Base):
     title = Column(String)
     url = Column(String)
     at = Column(DateTime, index=True, default=lambda: datetime.now(UTC))
+
+class BackfillJob(Base):
+    __tablename__ = "backfill_jobs"
+    id = Column(Integer, primary_key=True)
+    days = Column(String, nullable=False)
+    incremental = Column(Boolean, default=False)
+    status = Column(String, index=True, default="running")  # running/done/failed
+    started_at = Column(DateTime, default=lambda: datetime.now(UTC))
+    finished_at = Column(DateTime)
+
+class BackfillTask(Base):
+    __tablename__ = "backfill_tasks"
+    id = Column(Integer, primary_key=True)
+    job_id = Column(Integer, ForeignKey("backfill_jobs.id"), index=True, nullable=False)
+    key = Column(String, nullable=False)  # asset:<cg_id> or fx:<BASE>
+    range_from = Column(DateTime)  # exclusive; NULL = full `days` window
+    range_to = Column(DateTime)  # NULL = now at execution time
+    status = Column(String, index=True, default="pending")  # pending/done/failed
+    attempts = Column(Integer, default=0)
+    rows = Column(Integer, default=0)
+    error = Column(Text)
+    updated_at = Column(DateTime, default=lambda: datetime.now(UTC))
+    __table_args__ = (UniqueConstraint("job_id", "key", name="uq_backfill_task_job_key"),)
+
+
+def _latest_upsert(table, keys, value):
+    stmt = sqlite_insert(table)
+    return stmt.on_conflict_do_update(
+        index_elements=keys,
+        set_={value: stmt.excluded[value], "at": stmt.excluded.at},
+        where=stmt.excluded.at > table.c.at,
+    )
+
+
+LATEST_PRICE_UPSERT = _latest_upsert(LatestPrice.__table__, ["asset_id", "ccy"], "price")
+LATEST_FX_UPSERT = _latest_upsert(LatestFx.__table__, ["base_ccy", "quote_ccy"], "rate")
+
+
+# ORM inserts (fixtures, ad-hoc scripts) keep the latest and coverage tables current in the
+# same flush; Core bulk inserts go through balancer.bulk, which upserts them itself.
+@event.listens_for(Price, "after_insert")
+def _price_inserted(mapper, connection, target):
+    from .coverage import mark_coverage
+    connection.execute(LATEST_PRICE_UPSERT, {"asset_id": target.asset_id, "ccy": target.ccy, "price": target.price, "at": target.at})
+    mark_coverage(connection, "prices", {(target.asset_id, target.ccy): {"hour": {hour_bucket(target.at)}, "day": {day_bucket(target.at)}}})
+
+
+@event.listens_for(FxRate, "after_insert")
+def _fx_inserted(mapper, connection, target):
+    from .coverage import mark_coverage
+    connection.execute(LATEST_FX_UPSERT, {"base_ccy": target.base_ccy, "quote_ccy": target.quote_ccy, "rate": target.rate, "at": target.at})
+    mark_coverage(connection, "fx_rates", {(target.base_ccy, target.quote_ccy): {"hour": {hour_bucket(target.at)}, "day": {day_bucket(target.at)}}})
@@ -1,10 +1,12 @@
+from dataclasses import dataclass, field
 from typing import Dict, List, Tuple
 from datetime import datetime, UTC
 from .config import CG_MAPPING_FILE
 from .db import SessionLocal
-from .models import Asset, Price, FxRate, Position
+from .models import Asset, Position
 from .clients import CoingeckoClient
 from .compaction import compact_all
+from .bulk import insert_prices, insert_fx
 
 
 def read_mapping_ids() -> List[str]:
@@ -61,6 +63,60 @@ def fetch_markets(ids: List[str], vs: str) -> List[dict]:
     return client.markets(ids, vs)
 
 
+QUOTE_CURRENCIES = ("usd", "gbp", "btc")
+
+
+@dataclass
+class FetchPlan:
+    """Requests needed to quote ``ids``: one simple/price call for every id, plus a
+    markets call only for ids without an asset row (to learn symbol/name).
+    """
+    ids: List[str]
+    known: Dict[str, Tuple[str, str]] = field(default_factory=dict)  # cg_id -> (symbol, name)
+    unknown_ids: List[str] = field(default_factory=list)
+
+    @property
+    def request_count(self) -> int:
+        if not self.ids:
+            return 0
+        return 1 + (1 if self.unknown_ids else 0)
+
+
+def plan_price_fetch(ids: List[str]) -> FetchPlan:
+    with SessionLocal() as db:
+        rows = db.query(Asset.coingecko_id, Asset.symbol, Asset.name).filter(Asset.coingecko_id.in_(ids)).all() if ids else []
+    known = {cg_id: (symbol, name) for cg_id, symbol, name in rows}
+    return FetchPlan(ids=list(ids), known=known, unknown_ids=[i for i in ids if i not in known])
+
+
+def fetch_quotes(ids: List[str], client: CoingeckoClient | None = None) -> Dict[str, List[dict]]:
+    """Fetch USD, GBP and BTC quotes for ``ids`` in as few requests as possible.
+    Returns markets-shaped rows per currency ({"usd": [...], "gbp": [...], "btc": [...]}),
+    so the result can be fed straight to store_prices.
+    """
+    plan = plan_price_fetch(ids)
+    out: Dict[str, List[dict]] = {c: [] for c in QUOTE_CURRENCIES}
+    if not plan.ids:
+        return out
+    client = client or CoingeckoClient()
+    quotes = client.simple_price(plan.ids, QUOTE_CURRENCIES)
+    meta = dict(plan.known)
+    if plan.unknown_ids:
+        for row in client.markets(plan.unknown_ids, "usd"):
+            if row.get("id"):
+                meta[row["id"]] = (row.get("symbol") or "", row.get("name") or "")
+    for cg_id in plan.ids:
+        q = quotes.get(cg_id)
+        if not q or cg_id not in meta:
+            continue
+        symbol, name = meta[cg_id]
+        for ccy in QUOTE_CURRENCIES:
+            price = q.get(ccy)
+            if isinstance(price, (int, float)):
+                out[ccy].append({"id": cg_id, "symbol": (symbol or "").lower(), "name": name, "current_price": float(price)})
+    return out
+
+
 def upsert_assets_for_markets(market_rows: List[dict]) -> Dict[str, int]:
     """Ensure assets table has rows for each market id; returns map cg_id -> asset_id."""
     m: Dict[str, int] = {}
@@ -94,7 +150,6 @@ def store_prices(rows_usd: List[dict], rows_gbp: List[dict]) -> Tuple[float, int
     by_id_usd = {r.get("id"): r for r in rows_usd}
     by_id_gbp = {r.get("id"): r for r in rows_gbp}
     btc_usd = 0.0
-    stored = 0
     with SessionLocal() as db:
         # ensure assets exist and get ids mapping
         m = upsert_assets_for_markets(list(by_id_usd.values()) or list(by_id_gbp.values()))
@@ -126,25 +181,25 @@ def store_prices(rows_usd: List[dict], rows_gbp: List[dict]) -> Tuple[float, int
             rate_gbp_usd = 1.0 / usdc_gbp
 
         # Store USD prices only
+        price_rows = []
         for cg_id, asset_id in m.items():
             u = by_id_usd.get(cg_id)
             if u and isinstance(u.get("current_price"), (int, float)):
-                usd_price = float(u["current_price"])
-                db.add(Price(asset_id=asset_id, ccy="USD", price=usd_price, at=now))
-                stored += 1
+                price_rows.append((asset_id, "USD", float(u["current_price"]), now))
             elif rate_gbp_usd:
                 # Derive USD from GBP price when available
                 g = by_id_gbp.get(cg_id)
                 if g and isinstance(g.get("current_price"), (int, float)):
-                    usd_price = float(g["current_price"]) * rate_gbp_usd
-                    db.add(Price(asset_id=asset_id, ccy="USD", price=usd_price, at=now))
-                    stored += 1
+                    price_rows.append((asset_id, "USD", float(g["current_price"]) * rate_gbp_usd, now))
+        stored = insert_prices(db, price_rows)
 
         # Store FX rates
+        fx_rows = []
         if rate_gbp_usd:
-            db.add(FxRate(base_ccy="GBP", quote_ccy="USD", rate=rate_gbp_usd, at=now))
+            fx_rows.append(("GBP", "USD", rate_gbp_usd, now))
         if btc_usd:
-            db.add(FxRate(base_ccy="BTC", quote_ccy="USD", rate=btc_usd, at=now))
+            fx_rows.append(("BTC", "USD", btc_usd, now))
+        insert_fx(db, fx_rows)
 
         db.commit()
     return btc_usd, stored
@@ -155,17 +210,16 @@ def derive_and_store_btc_prices(rows_usd: List[dict], btc_usd: float) -> int:
     if not btc_usd:
         return 0
     with SessionLocal() as db:
-        db.add(FxRate(base_ccy="BTC", quote_ccy="USD", rate=btc_usd, at=datetime.now(UTC)))
+        insert_fx(db, [("BTC", "USD", btc_usd, datetime.now(UTC))])
         db.commit()
     return 0
 
 
 def run_price_fetch() -> None:
     ids = ids_from_positions() or read_mapping_ids()
-    # Fetch USD for all; GBP for USDC to derive GBPUSD (and we can pass all ids; we'll just use USDC row)
-    rows_usd = fetch_markets(ids, "usd")
-    rows_gbp = fetch_markets(ids, "gbp")
-    btc_usd, _ = store_prices(rows_usd, rows_gbp)
-    derive_and_store_btc_prices(rows_usd, btc_usd)
+    # One multi-currency quote request; GBP quotes only feed the USDC-implied GBPUSD rate
+    quotes = fetch_quotes(ids)
+    btc_usd, _ = store_prices(quotes["usd"], quotes["gbp"])
+    derive_and_store_btc_prices(quotes["usd"], btc_usd)
     # Compact after insert
     compact_all()
@@ -0,0 +1,148 @@
+from __future__ import annotations
+import asyncio
+import json
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator
+
+from .config import COINGECKO_THROTTLE_MS, COINGECKO_BURST, RATE_LIMIT_DIR
+
+try:  # POSIX only; elsewhere the bucket is shared per process
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+
+class RateLimiter:
+    """Token bucket shared by threads, coroutines and processes.
+
+    One token is added every ``interval`` seconds up to ``burst``. State lives in
+    ``<state_dir>/ratelimit-<name>.json`` guarded by an flock, so the backend loop
+    and ad-hoc backfill/repair commands draw from the same quota.
+    """
+
+    def __init__(self, name: str, interval: float, burst: int = 1, state_dir: str | Path | None = None):
+        self.name = name
+        self.interval = max(0.0, float(interval))
+        self.burst = max(1, int(burst))
+        self.path = Path(state_dir or RATE_LIMIT_DIR) / f"ratelimit-{name}.json"
+        self._lock = threading.Lock()
+        self._local_state: Dict[str, float] = {}
+
+    @contextmanager
+    def _state(self) -> Iterator[Dict[str, Any]]:
+        with self._lock:
+            if fcntl is None:
+                yield self._local_state
+                return
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a+", encoding="utf-8") as f:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                try:
+                    f.seek(0)
+                    try:
+                        state = json.loads(f.read() or "{}")
+                    except ValueError:
+                        state = {}
+                    yield state
+                    f.seek(0)
+                    f.truncate()
+                    f.write(json.dumps(state))
+                    f.flush()
+                finally:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _take(self, state: Dict[str, Any], now: float) -> float:
+        """Consume a token if available; otherwise return seconds to wait."""
+        blocked_until = float(state.get("blocked_until", 0.0))
+        if now < blocked_until:
+            return blocked_until - now
+        if self.interval <= 0:
+            return 0.0
+        tokens = float(state.get("tokens", self.burst))
+        updated = float(state.get("updated", now))
+        tokens = min(float(self.burst), tokens + max(0.0, now - updated) / self.interval)
+        state["updated"] = now
+        if tokens >= 1.0:
+            state["tokens"] = tokens - 1.0
+            return 0.0
+        state["tokens"] = tokens
+        return (1.0 - tokens) * self.interval
+
+    def try_acquire(self) -> float:
+        """Take a token without blocking. Returns 0.0 on success or the wait needed.
+
+        With ``interval`` 0 there is no quota, but a penalty (429) still holds callers.
+        """
+        if self.interval <= 0 and fcntl is not None and not self.path.exists():
+            # Never penalized: skip the state file entirely
+            return 0.0
+        with self._state() as state:
+            return self._take(state, time.time())
+
+    def acquire(self) -> float:
+        """Block until a token is available. Returns total seconds waited."""
+        waited = 0.0
+        while True:
+            wait = self.try_acquire()
+            if wait <= 0:
+                return waited
+            time.sleep(wait)
+            waited += wait
+
+    async def acquire_async(self) -> float:
+        waited = 0.0
+        while True:
+            wait = await asyncio.to_thread(self.try_acquire)
+            if wait <= 0:
+                return waited
+            await asyncio.sleep(wait)
+            waited += wait
+
+    def penalize(self, seconds: float) -> None:
+        """Hold every caller (in any process) for ``seconds``, e.g. after a 429."""
+        if seconds <= 0:
+            return
+        with self._state() as state:
+            until = time.time() + float(seconds)
+            state["blocked_until"] = max(float(state.get("blocked_until", 0.0)), until)
+            state["tokens"] = 0.0
+            state["updated"] = until
+
+
+def retry_after_seconds(resp) -> float | None:
+    """Parse a Retry-After header (delta-seconds or HTTP-date) from a response."""
+    headers = getattr(resp, "headers", None) or {}
+    value = headers.get("Retry-After")
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+_limiters: Dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(name: str, interval: float, burst: int = 1) -> RateLimiter:
+    """Return the process-wide limiter for ``name`` (created on first use)."""
+    with _limiters_lock:
+        limiter = _limiters.get(name)
+        if limiter is None:
+            limiter = RateLimiter(name, interval=interval, burst=burst)
+            _limiters[name] = limiter
+        return limiter
+
+
+def coingecko_limiter() -> RateLimiter:
+    return get_limiter("coingecko", interval=COINGECKO_THROTTLE_MS / 1000.0, burst=COINGECKO_BURST)
@@ -0,0 +1,130 @@
+from __future__ import annotations
+from dataclasses import dataclass
+
+import numpy as np
+
+from .config import REBALANCE_BAND_FRACTION
+
+# Portfolio-level rebalance: one coordinated, cash-neutral trade set instead of
+# an independent trade back to target per drifting asset.
+#
+#   1. Every targeted asset outside its band (|weight - target| >= drift_band)
+#      trades to the nearest point of its inner band, target +- fraction * band.
+#      A trade smaller than the asset's min_trade_usd is raised to the minimum
+#      if that still lands inside the band; otherwise the asset is left alone
+#      and reported as unresolved.
+#   2. The net of those trades is offset by trading the other way. Existing
+#      trades in that direction are extended first, since that adds no trades.
+#      Then new assets are used, largest capacity first. Each moves no further
+#      than its own inner band edge and trades at least its minimum, so the set
+#      uses as few trades as the greedy order allows. Turnover is the least
+#      possible for the landing points, twice the larger of the buy and sell totals.
+#      When the other side lacks room (e.g. most of the value sits in untargeted
+#      holdings) the shortfall is reported as residual_usd instead of netted.
+#
+# All arrays may carry leading batch axes (e.g. the backtester's config axis);
+# every step works along the last (asset) axis.
+
+
+@dataclass
+class RebalancePlan:
+    trades_usd: np.ndarray  # signed USD per asset, buy > 0
+    weights_after: np.ndarray
+    unresolved: np.ndarray  # bool: still outside its band after the trades
+    residual_usd: np.ndarray  # net cash the trades could not offset; 0 when feasible
+
+    @property
+    def count(self) -> np.ndarray:
+        return (self.trades_usd != 0).sum(axis=-1)
+
+    @property
+    def turnover_usd(self) -> np.ndarray:
+        return np.abs(self.trades_usd).sum(axis=-1)
+
+
+def _take(cap: np.ndarray, amount: np.ndarray) -> np.ndarray:
+    """Take up to ``amount`` (per batch row) from ``cap``, largest capacities first."""
+    order = np.argsort(-cap, axis=-1, kind="stable")
+    c = np.take_along_axis(cap, order, axis=-1)
+    before = np.cumsum(c, axis=-1) - c
+    taken = np.clip(amount[..., None] - before, 0.0, c)
+    out = np.empty_like(cap)
+    np.put_along_axis(out, order, taken, axis=-1)
+    return out
+
+
+def plan_rebalance(mv: np.ndarray, target_weight: np.ndarray, drift_band: np.ndarray,
+                   min_trade_usd: np.ndarray, has_target: np.ndarray | None = None,
+                   band_fraction: float | np.ndarray | None = None) -> RebalancePlan:
+    """Smallest cash-neutral trade set bringing every targeted asset inside its band.
+
+    ``mv`` holds USD market values, NaN for assets without a price (they are
+    neither traded nor counted in the total). ``band_fraction`` (default
+    REBALANCE_BAND_FRACTION, 0 <= f < 1; may be per batch row) sets where trades
+    land: 0 is exactly on target, values near 1 just inside the band edge.
+    """
+    f = np.asarray(REBALANCE_BAND_FRACTION if band_fraction is None else band_fraction, dtype=np.float64)
+    if not np.all((f >= 0) & (f < 1)):
+        raise ValueError("band_fraction must be in [0, 1)")
+    single = np.ndim(mv) == 1
+    mv = np.atleast_2d(np.asarray(mv, dtype=np.float64))
+    shape = mv.shape
+    tw, band, min_trade = (np.broadcast_to(np.asarray(a, dtype=np.float64), shape)
+                           for a in (target_weight, drift_band, min_trade_usd))
+    priced = ~np.isnan(mv)
+    targeted = priced & (True if has_target is None else np.broadcast_to(np.asarray(has_target, dtype=bool), shape))
+    mv = np.where(priced, mv, 0.0)
+    total = mv.sum(axis=-1, keepdims=True)
+    live = total > 0
+    safe_total = np.where(live, total, 1.0)
+    w = mv / safe_total
+    lo, hi = tw - f * band, tw + f * band
+
+    # 1. Out-of-band assets to the nearest inner edge, respecting minimum sizes
+    out = targeted & live & (np.abs(w - tw) >= band)
+    need = np.where(out, (np.clip(w, lo, hi) - w) * safe_total, 0.0)
+    small = out & (np.abs(need) < min_trade)
+    bumped = np.sign(need) * min_trade
+    bump_ok = small & (np.abs(w + bumped / safe_total - tw) < band)
+    need = np.where(bump_ok, bumped, np.where(small, 0.0, need))
+
+    # 2. Offset the net with trades the other way
+    net = need.sum(axis=-1)
+    d = np.sign(net)[..., None]  # +1: net buying, so sells are needed
+    r = np.abs(net)
+    after = w + need / safe_total
+    # How far each asset can move against the net before leaving its inner band
+    room = np.where(d > 0, after - lo, hi - after) * safe_total
+    room = np.where(targeted & live, np.maximum(room, 0.0), 0.0)
+    against = need * d < 0
+    fresh = need == 0
+
+    extend = _take(np.where(against, room, 0.0), r)
+    r = r - extend.sum(axis=-1)
+    cand = fresh & (room >= min_trade)
+    new = _take(np.where(cand, room, 0.0), r)
+    r = r - new.sum(axis=-1)
+    # The last new donor may have taken less than its minimum: top it up and hand
+    # the overshoot back from slack elsewhere on the same side, or else by
+    # extending trades on the net side
+    short = (new > 0) & (new < min_trade)
+    over = np.where(short, min_trade - new, 0.0).sum(axis=-1)
+    new = np.where(short, min_trade, new)
+    slack = extend + np.where(new > 0, new - min_trade, 0.0)
+    give = _take(slack, over)
+    from_extend = np.minimum(give, extend)
+    extend = extend - from_extend
+    new = new - (give - from_extend)
+    over = over - give.sum(axis=-1)
+    along = need * d > 0
+    back_room = np.where(d > 0, hi - after, after - lo) * safe_total
+    grow = _take(np.where(along, np.maximum(back_room, 0.0), 0.0), over)
+    over = over - grow.sum(axis=-1)
+
+    trades = need - d * (extend + new) + d * grow
+    residual = trades.sum(axis=-1)
+    w_after = (mv + trades) / safe_total
+    unresolved = targeted & live & (np.abs(w_after - tw) >= band)
+    if single:
+        trades, w_after, unresolved, residual = trades[0], w_after[0], unresolved[0], residual[0]
+    return RebalancePlan(trades_usd=trades, weights_after=w_after, unresolved=unresolved, residual_usd=residual)
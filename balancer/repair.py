@@ -1,11 +1,14 @@
 from __future__ import annotations
 from datetime import datetime, timedelta
-from typing import Iterable, List, Tuple
+from typing import Iterable
 from .db import SessionLocal
 from .models import Price, FxRate, Asset
 from .price_fetcher import ids_from_positions, read_mapping_ids, upsert_assets_for_markets
-from .clients import CoingeckoClient
-import time
+from .clients import CoingeckoClient, AsyncCoingeckoClient
+from .bulk import insert_prices, insert_fx
+from .buckets import bucket_key
+from .coverage import is_present, load_coverage
+import asyncio
 
 
 def _bucket_hours(now: datetime, hours: int) -> Iterable[datetime]:
@@ -24,87 +27,53 @@ def carry_forward_missing(now: datetime | None = None) -> None:
     """Fill gaps by carrying forward the last known value for:
     - Prices (USD): hourly last 24h buckets and daily last 365d buckets
     - FX (GBP->USD, BTC->USD): same buckets
+    Gaps come from the coverage bitmaps (one query per table and tier, so each
+    tier sees the previous one's fills); only missing buckets look up the value
+    to carry.
     """
     now = now or datetime.utcnow()
     with SessionLocal() as db:
         asset_ids = [r[0] for r in db.query(Asset.id).filter(Asset.active == True).all()]
 
-        # Prices hourly (24h)
-        for aid in asset_ids:
-            for ts in _bucket_hours(now, 24):
-                # if no price in that hour, insert last known before
-                exists = (
-                    db.query(Price)
-                    .filter(Price.asset_id == aid, Price.ccy == "USD", Price.at >= ts, Price.at < ts + timedelta(hours=1))
-                    .first()
-                )
-                if exists:
-                    continue
-                ref = (
-                    db.query(Price)
-                    .filter(Price.asset_id == aid, Price.ccy == "USD", Price.at < ts)
-                    .order_by(Price.at.desc())
-                    .first()
-                )
-                if ref:
-                    db.add(Price(asset_id=aid, ccy="USD", price=ref.price, at=ts))
-        db.commit()
-
-        # Prices daily (365d)
-        for aid in asset_ids:
-            for ts in _bucket_days(now, 365):
-                exists = (
-                    db.query(Price)
-                    .filter(Price.asset_id == aid, Price.ccy == "USD", Price.at >= ts, Price.at < ts + timedelta(days=1))
-                    .first()
-                )
-                if exists:
-                    continue
-                ref = (
-                    db.query(Price)
-                    .filter(Price.asset_id == aid, Price.ccy == "USD", Price.at < ts)
-                    .order_by(Price.at.desc())
-                    .first()
-                )
-                if ref:
-                    db.add(Price(asset_id=aid, ccy="USD", price=ref.price, at=ts))
-        db.commit()
-
-        # FX hourly and daily for GBP and BTC
-        for base in ("GBP", "BTC"):
-            for ts in _bucket_hours(now, 24):
-                exists = (
-                    db.query(FxRate)
-                    .filter(FxRate.base_ccy == base, FxRate.quote_ccy == "USD", FxRate.at >= ts, FxRate.at < ts + timedelta(hours=1))
-                    .first()
-                )
-                if not exists:
+        # Prices hourly (24h) and daily (365d)
+        for tier, buckets in (("hour", list(_bucket_hours(now, 24))), ("day", list(_bucket_days(now, 365)))):
+            price_cov = load_coverage(db, "prices")
+            rows = []
+            for aid in asset_ids:
+                base, bits = price_cov.get((aid, "USD", tier), (None, 0))
+                for ts in buckets:
+                    # if no price in that bucket, insert last known before
+                    if is_present(base, bits, bucket_key(tier, ts)):
+                        continue
                     ref = (
-                        db.query(FxRate)
-                        .filter(FxRate.base_ccy == base, FxRate.quote_ccy == "USD", FxRate.at < ts)
-                        .order_by(FxRate.at.desc())
+                        db.query(Price)
+                        .filter(Price.asset_id == aid, Price.ccy == "USD", Price.at < ts)
+                        .order_by(Price.at.desc())
                         .first()
                     )
                     if ref:
-                        db.add(FxRate(base_ccy=base, quote_ccy="USD", rate=ref.rate, at=ts))
+                        rows.append((aid, "USD", ref.price, ts))
+            insert_prices(db, rows)
             db.commit()
 
-            for ts in _bucket_days(now, 365):
-                exists = (
-                    db.query(FxRate)
-                    .filter(FxRate.base_ccy == base, FxRate.quote_ccy == "USD", FxRate.at >= ts, FxRate.at < ts + timedelta(days=1))
-                    .first()
-                )
-                if not exists:
+        # FX hourly and daily for GBP and BTC
+        for base_ccy in ("GBP", "BTC"):
+            for tier, buckets in (("hour", _bucket_hours(now, 24)), ("day", _bucket_days(now, 365))):
+                base, bits = load_coverage(db, "fx_rates").get((base_ccy, "USD", tier), (None, 0))
+                rows = []
+                for ts in buckets:
+                    if is_present(base, bits, bucket_key(tier, ts)):
+                        continue
                     ref = (
                         db.query(FxRate)
-                        .filter(FxRate.base_ccy == base, FxRate.quote_ccy == "USD", FxRate.at < ts)
+                        .filter(FxRate.base_ccy == base_ccy, FxRate.quote_ccy == "USD", FxRate.at < ts)
                         .order_by(FxRate.at.desc())
                         .first()
                     )
                     if ref:
-                        db.add(FxRate(base_ccy=base, quote_ccy="USD", rate=ref.rate, at=ts))
-            db.commit()
+                        rows.append((base_ccy, "USD", ref.rate, ts))
+                insert_fx(db, rows)
+                db.commit()
 
 
 def _ms_to_dt(ms: int) -> datetime:
@@ -112,6 +81,49 @@ def _ms_to_dt(ms: int) -> datetime:
     return datetime.utcfromtimestamp(ms / 1000.0)
 
 
+def _chunks(seq, n):
+    for i in range(0, len(seq), n):
+        yield seq[i:i+n]
+
+
+def _store_fx_24h(db, usdc_usd, usdc_gbp, btc_usd) -> None:
+    # GBPUSD derivation by aligning to nearest timestamp; existing pair/time rows are skipped on insert
+    rows = []
+    j = 0
+    for t_ms, usd_price in usdc_usd:
+        while j + 1 < len(usdc_gbp) and abs(usdc_gbp[j + 1][0] - t_ms) <= abs(usdc_gbp[j][0] - t_ms):
+            j += 1
+        gbp_price = usdc_gbp[j][1] if usdc_gbp else 0.0
+        if usd_price and gbp_price:
+            try:
+                rows.append(("GBP", "USD", float(usd_price) / float(gbp_price), _ms_to_dt(int(t_ms))))
+            except Exception:
+                pass
+    for t_ms, p in btc_usd:
+        try:
+            rows.append(("BTC", "USD", float(p), _ms_to_dt(int(t_ms))))
+        except Exception:
+            pass
+    insert_fx(db, rows)
+    db.commit()
+
+
+def _store_prices_24h(db, cg_id: str, series) -> None:
+    # Resolve asset strictly by coingecko_id to avoid creating mismatched placeholders
+    asset = db.query(Asset).filter(Asset.coingecko_id == cg_id).first()
+    if not asset:
+        # Skip if asset mapping is not established yet
+        return
+    rows = []
+    for t_ms, price in series:
+        try:
+            rows.append((asset.id, "USD", float(price), _ms_to_dt(int(t_ms))))
+        except Exception:
+            continue
+    insert_prices(db, rows)
+    db.commit()
+
+
 def hourly_backfill_24h() -> None:
     """Fetch 24h series at ~5-min granularity and insert raw USD prices and FX (GBPUSD via USDC, BTCUSD via BTC) for the last 24h.
     Caller should run compaction after this to collapse to hourly buckets.
@@ -121,10 +133,7 @@ def hourly_backfill_24h() -> None:
         return
     client = CoingeckoClient()
 
-    # Ensure assets have coingecko_id mapping populated; batch to avoid rate limits
-    def _chunks(seq, n):
-        for i in range(0, len(seq), n):
-            yield seq[i:i+n]
+    # Ensure assets have coingecko_id mapping populated; batched, paced by the shared rate limiter
     for batch in _chunks(ids, 50):
         try:
             market_rows = client.markets(batch, vs_currency="usd")
@@ -132,83 +141,72 @@ def hourly_backfill_24h() -> None:
                 upsert_assets_for_markets(market_rows)
         except Exception:
             pass
-        time.sleep(0.4)
 
     # FX series first: GBPUSD via USDC (USD/GBP) and BTCUSD via BTC USD
     try:
         usdc_usd = client.market_chart("usd-coin", vs_currency="usd", days="1").get("prices", [])
-        time.sleep(0.3)
     except Exception:
         usdc_usd = []
     try:
         usdc_gbp = client.market_chart("usd-coin", vs_currency="gbp", days="1").get("prices", [])
-        time.sleep(0.3)
     except Exception:
         usdc_gbp = []
     try:
         btc_usd = client.market_chart("bitcoin", vs_currency="usd", days="1").get("prices", [])
-        time.sleep(0.3)
     except Exception:
         btc_usd = []
 
     with SessionLocal() as db:
-        # GBPUSD derivation by aligning to nearest timestamp
-        j = 0
-        for t_ms, usd_price in usdc_usd:
-            while j + 1 < len(usdc_gbp) and abs(usdc_gbp[j + 1][0] - t_ms) <= abs(usdc_gbp[j][0] - t_ms):
-                j += 1
-            gbp_price = usdc_gbp[j][1] if usdc_gbp else 0.0
-            if usd_price and gbp_price:
-                try:
-                    at_dt = _ms_to_dt(int(t_ms))
-                    exists = (
-                        db.query(FxRate)
-                        .filter(
-                            FxRate.base_ccy == "GBP",
-                            FxRate.quote_ccy == "USD",
-                            FxRate.at == at_dt,
-                        )
-                        .first()
-                    )
-                    if not exists:
-                        rate = float(usd_price) / float(gbp_price)
-                        db.add(FxRate(base_ccy="GBP", quote_ccy="USD", rate=rate, at=at_dt))
-                except Exception:
-                    pass
-        for t_ms, p in btc_usd:
-            try:
-                at_dt = _ms_to_dt(int(t_ms))
-                exists = (
-                    db.query(FxRate)
-                    .filter(
-                        FxRate.base_ccy == "BTC",
-                        FxRate.quote_ccy == "USD",
-                        FxRate.at == at_dt,
-                    )
-                    .first()
-                )
-                if not exists:
-                    db.add(FxRate(base_ccy="BTC", quote_ccy="USD", rate=float(p), at=at_dt))
-            except Exception:
-                pass
-        db.commit()
+        _store_fx_24h(db, usdc_usd, usdc_gbp, btc_usd)
 
         # Prices for assets (USD)
         for cg_id in ids:
             try:
                 series = client.market_chart(cg_id, vs_currency="usd", days="1").get("prices", [])
-                time.sleep(0.3)
-                # Resolve asset strictly by coingecko_id to avoid creating mismatched placeholders
-                asset = db.query(Asset).filter(Asset.coingecko_id == cg_id).first()
-                if not asset:
-                    # Skip if asset mapping is not established yet
-                    continue
-                for t_ms, price in series:
-                    try:
-                        db.add(Price(asset_id=asset.id, ccy="USD", price=float(price), at=_ms_to_dt(int(t_ms))))
-                    except Exception:
-                        continue
-                db.commit()
+                _store_prices_24h(db, cg_id, series)
+            except Exception:
+                db.rollback()
+                continue
+
+
+async def hourly_backfill_24h_async(concurrency: int | None = None) -> None:
+    """Async variant of hourly_backfill_24h: markets batches and 24h charts are
+    fetched concurrently (bounded by ``concurrency``), then written serially.
+    Caller should run compaction after this.
+    """
+    ids = ids_from_positions() or read_mapping_ids()
+    if not ids:
+        return
+    client = AsyncCoingeckoClient(concurrency=concurrency)
+
+    batches = await asyncio.gather(
+        *(client.markets(batch, vs_currency="usd") for batch in _chunks(ids, 50)),
+        return_exceptions=True,
+    )
+    for market_rows in batches:
+        if market_rows and not isinstance(market_rows, BaseException):
+            try:
+                upsert_assets_for_markets(market_rows)
+            except Exception:
+                pass
+
+    charts = await asyncio.gather(
+        client.market_chart("usd-coin", vs_currency="usd", days="1"),
+        client.market_chart("usd-coin", vs_currency="gbp", days="1"),
+        client.market_chart("bitcoin", vs_currency="usd", days="1"),
+        *(client.market_chart(cg_id, vs_currency="usd", days="1") for cg_id in ids),
+        return_exceptions=True,
+    )
+    series = [[] if isinstance(c, BaseException) else (c or {}).get("prices", []) for c in charts]
+    usdc_usd, usdc_gbp, btc_usd = series[:3]
+
+    with SessionLocal() as db:
+        _store_fx_24h(db, usdc_usd, usdc_gbp, btc_usd)
+        for cg_id, chart, points in zip(ids, charts[3:], series[3:]):
+            if isinstance(chart, BaseException):
+                continue
+            try:
+                _store_prices_24h(db, cg_id, points)
             except Exception:
                 db.rollback()
                 continue
@@ -0,0 +1,206 @@
+from __future__ import annotations
+import json
+import math
+import time
+from datetime import datetime, timedelta, UTC
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from .backtest import _ffill, load_history
+from .buckets import bucket_key
+from .config import (
+    DEFAULT_PORTFOLIO_NAME, RISK_CONFIDENCE, RISK_EVERY_HOURS, RISK_HORIZON_DAYS, RISK_LOOKBACK_DAYS,
+    RISK_SCENARIOS, RISK_SEED,
+)
+from .db import SessionLocal
+from .latest import PriceSnapshot, load_snapshot
+from .matrix_cache import cached_closes
+from .models import Portfolio, RiskReport
+from .rules_engine import PortfolioState, load_state, unit_values
+
+# Monte Carlo downside estimate for a portfolio's current holdings.
+#
+# Daily log returns of every held asset plus GBPUSD and BTCUSD come from the
+# stored day closes (rollups + pending raw rows). Their covariance is estimated
+# pairwise, so assets listed part-way through the lookback still count, and
+# made positive semi-definite by clipping negative eigenvalues. Scenarios are
+# zero-drift daily paths drawn from that covariance over the horizon; each one
+# revalues the portfolio in USD, GBP and BTC (the FX legs move with the assets)
+# and tracks every position's P&L multiple, whose running peak gives the odds
+# of crossing each take-profit rung within the horizon. Costs held in GBP are
+# converted at the simulated GBPUSD, as rules.py converts them at the live rate.
+
+# Normals generated per chunk (scenarios x days x factors); bounds peak memory
+_CHUNK_ELEMS = 2_000_000
+# Fewer daily returns than this and an asset is held at its current price
+MIN_OBSERVATIONS = 20
+CURRENCIES = ("USD", "GBP", "BTC")
+
+
+def estimate_covariance(returns: np.ndarray, min_obs: int = MIN_OBSERVATIONS) -> Tuple[np.ndarray, np.ndarray]:
+    """Pairwise covariance of (days x series) returns with NaN gaps, PSD-repaired.
+
+    Returns the (series x series) covariance and a bool mask of the series with
+    at least ``min_obs`` returns; the rest get zero variance.
+    """
+    seen = ~np.isnan(returns)
+    n_obs = seen.sum(axis=0)
+    ok = n_obs >= min_obs
+    mean = np.where(seen, returns, 0.0).sum(axis=0) / np.maximum(n_obs, 1)
+    xc = np.where(seen & ok, returns - mean, 0.0)
+    pairs = seen.T.astype(np.float64) @ seen.astype(np.float64)
+    cov = (xc.T @ xc) / np.maximum(pairs - 1.0, 1.0)
+    w, v = np.linalg.eigh(cov)
+    return (v * np.clip(w, 0.0, None)) @ v.T, ok
+
+
+def _factor(cov: np.ndarray) -> np.ndarray:
+    """L with L @ L.T == cov; eigen-based so singular matrices work too."""
+    w, v = np.linalg.eigh(cov)
+    return v * np.sqrt(np.clip(w, 0.0, None))
+
+
+def simulate(mv_usd: np.ndarray, pnl_multiple: np.ndarray, cost_is_gbp: np.ndarray, multiples: Sequence[float],
+             cov: np.ndarray, gbp_usd: float, btc_usd: float, horizon_days: int, scenarios: int,
+             rng: np.random.Generator) -> Dict[str, Any]:
+    """Draw ``scenarios`` paths of ``horizon_days`` daily returns.
+
+    ``cov`` covers the n assets followed by GBPUSD and BTCUSD. Returns the P&L
+    samples per horizon (1 day and the full horizon) and currency, NaN-filled for
+    a currency without a rate, and the (n x rungs) probability that each
+    position's P&L multiple reaches each rung at some day-close in the horizon.
+    """
+    n = len(mv_usd)
+    k = n + 2
+    mv = np.where(np.isnan(mv_usd), 0.0, mv_usd)
+    v0 = mv.sum()
+    horizons = sorted({1, horizon_days})
+    pnl = {h: {c: np.full(scenarios, np.nan) for c in CURRENCIES} for h in horizons}
+    log_m = np.log(np.asarray(multiples, dtype=np.float64))
+    log_pnl0 = np.log(np.where(pnl_multiple > 0, pnl_multiple, np.nan))
+    gbp_cost = cost_is_gbp.astype(np.float64)
+    hits = np.zeros((n, len(log_m)))
+    L = _factor(cov)
+    chunk = max(1, _CHUNK_ELEMS // (horizon_days * k))
+    for a in range(0, scenarios, chunk):
+        m = min(chunk, scenarios - a)
+        path = np.cumsum(rng.standard_normal((m, horizon_days, k)) @ L.T, axis=1)
+        for h in horizons:
+            c = path[:, h - 1]
+            v = (mv * np.exp(c[:, :n])).sum(axis=1)
+            pnl[h]["USD"][a:a + m] = v - v0
+            if gbp_usd > 0:
+                pnl[h]["GBP"][a:a + m] = v / (gbp_usd * np.exp(c[:, n])) - v0 / gbp_usd
+            if btc_usd > 0:
+                pnl[h]["BTC"][a:a + m] = v / (btc_usd * np.exp(c[:, n + 1])) - v0 / btc_usd
+        if n and len(log_m):
+            # Multiple = price / cost; a GBP cost moves with GBPUSD. The start counts as day 0
+            rise = path[:, :, :n] - path[:, :, n:n + 1] * gbp_cost
+            peak = log_pnl0 + np.maximum(rise.max(axis=1), 0.0)
+            hits += (peak[:, :, None] >= log_m).sum(axis=0)
+    return {"pnl": pnl, "hit_prob": hits / max(scenarios, 1)}
+
+
+def tail_risk(pnl: np.ndarray, confidence: Sequence[float]) -> Tuple[Dict[str, float | None], Dict[str, float | None]]:
+    """(VaR, CVaR) per confidence level as positive losses; None for NaN samples."""
+    var: Dict[str, float | None] = {}
+    cvar: Dict[str, float | None] = {}
+    for q in confidence:
+        key = f"{q:g}"
+        if not len(pnl) or np.isnan(pnl).any():
+            var[key] = cvar[key] = None
+            continue
+        cut = np.quantile(pnl, 1.0 - q)
+        var[key] = float(-cut)
+        cvar[key] = float(-pnl[pnl <= cut].mean())
+    return var, cvar
+
+
+def load_returns(db, state: PortfolioState, now: datetime, lookback_days: int) -> np.ndarray:
+    """(days x assets+2) daily log returns over the lookback: assets, GBPUSD, BTCUSD."""
+    start = now - timedelta(days=lookback_days)
+    hist = load_history(state.asset_ids.tolist(), start, now, "day", bind=db.get_bind())
+    lo, hi = bucket_key("day", start), bucket_key("day", now - timedelta(microseconds=1))
+    btc = _ffill(cached_closes(db.connection(), "fx_rates", "day", np.array(["BTC"]), lo, hi, "USD")[0])
+    closes = np.column_stack([hist.px_usd.reshape(len(hist.times), -1), hist.gbp_usd, btc])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        logs = np.log(np.where(closes > 0, closes, np.nan))
+    return np.diff(logs, axis=0)
+
+
+def compute_risk(db, portfolio_id: int, snap: PriceSnapshot | None = None, now: datetime | None = None,
+                 scenarios: int | None = None, horizon_days: int | None = None, lookback_days: int | None = None,
+                 confidence: Sequence[float] | None = None, seed: int | None = None) -> Dict[str, Any]:
+    """Risk report for the portfolio's current holdings (see the module comment)."""
+    t0 = time.perf_counter()
+    now = now or datetime.now(UTC).replace(tzinfo=None)
+    scenarios = RISK_SCENARIOS if scenarios is None else scenarios
+    horizon_days = max(1, RISK_HORIZON_DAYS if horizon_days is None else horizon_days)
+    lookback_days = RISK_LOOKBACK_DAYS if lookback_days is None else lookback_days
+    confidence = list(RISK_CONFIDENCE if confidence is None else confidence)
+    snap = snap if snap is not None else load_snapshot(db)
+    state = load_state(db, portfolio_id, snap, with_alerts=False)
+    px, unit_cost = unit_values(state)
+    mv = px * state.coins
+    with np.errstate(invalid="ignore", divide="ignore"):
+        pnl_multiple = np.where(unit_cost * state.coins > 0, px / unit_cost, np.nan)
+    gbp_usd = state.gbp_usd if state.gbp_usd > 0 else math.nan
+    btc_usd = snap.rate("BTC", "USD") or math.nan
+
+    returns = load_returns(db, state, now, lookback_days)
+    cov, ok = estimate_covariance(returns)
+    sim = simulate(mv, pnl_multiple, state.cost_is_gbp, state.multiples, cov, gbp_usd, btc_usd,
+                   horizon_days, scenarios, np.random.default_rng(RISK_SEED if seed is None else seed))
+
+    total = float(np.nansum(mv))
+    value = {"USD": total, "GBP": total / gbp_usd, "BTC": total / btc_usd}
+    var: Dict[str, Any] = {}
+    cvar: Dict[str, Any] = {}
+    for h, by_ccy in sim["pnl"].items():
+        var[f"{h}d"], cvar[f"{h}d"] = {}, {}
+        for ccy, samples in by_ccy.items():
+            var[f"{h}d"][ccy], cvar[f"{h}d"][ccy] = tail_risk(samples, confidence)
+    n = len(state.asset_ids)
+    ladder: List[Dict[str, Any]] = []
+    for i in range(n):
+        if math.isnan(pnl_multiple[i]):
+            continue
+        ladder.append({
+            "symbol": state.symbols[i],
+            "pnl_multiple": float(pnl_multiple[i]),
+            "hit_prob": {f"{m:g}": float(sim["hit_prob"][i, j]) for j, m in enumerate(state.multiples)},
+        })
+    return {
+        "computed_at": now.isoformat() + "Z",
+        "horizon_days": horizon_days,
+        "scenarios": scenarios,
+        "lookback_days": lookback_days,
+        "observations": int(len(returns)),
+        "value": {c: (None if math.isnan(v) else v) for c, v in value.items()},
+        "var": var,
+        "cvar": cvar,
+        "ladder": ladder,
+        # Priced positions without enough history to estimate a volatility (held flat)
+        "no_history": [state.symbols[i] for i in range(n) if not ok[i] and mv[i] > 0],
+        "seconds": round(time.perf_counter() - t0, 4),
+    }
+
+
+def refresh_risk(portfolio_name: str = DEFAULT_PORTFOLIO_NAME, snap: PriceSnapshot | None = None,
+                 now: datetime | None = None, force: bool = False, **kwargs) -> Dict[str, Any] | None:
+    """Recompute and store the portfolio's risk report when the stored one is
+    older than RISK_EVERY_HOURS (or ``force``); otherwise return the stored one.
+    Extra keyword arguments go to compute_risk. None for an unknown portfolio."""
+    now = now or datetime.now(UTC).replace(tzinfo=None)
+    with SessionLocal() as db:
+        pf = db.query(Portfolio).filter_by(name=portfolio_name).first()
+        if not pf:
+            return None
+        row = db.get(RiskReport, pf.id)
+        if row and not force and now - row.computed_at < timedelta(hours=RISK_EVERY_HOURS):
+            return json.loads(row.report_json)
+        report = compute_risk(db, pf.id, snap=snap, now=now, **kwargs)
+        db.merge(RiskReport(portfolio_id=pf.id, computed_at=now, report_json=json.dumps(report)))
+        db.commit()
+        return report
@@ -0,0 +1,174 @@
+from __future__ import annotations
+from datetime import datetime, timedelta, UTC
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from .buckets import COLUMNS, TIERS, bucket_key, bucket_start
+from .config import ROLLUP_DAILY_DAYS, ROLLUP_HOURLY_DAYS, ROLLUP_MAX_POINTS
+from .models import CompactionState
+
+# Raw table -> (key columns, value column, rollup table per tier)
+ROLLUPS: Dict[str, Tuple[Tuple[str, str], str, Dict[str, str]]] = {
+    "prices": (("asset_id", "ccy"), "price", {"hour": "prices_hourly", "day": "prices_daily", "month": "prices_monthly"}),
+    "fx_rates": (("base_ccy", "quote_ccy"), "rate", {"hour": "fx_hourly", "day": "fx_daily", "month": "fx_monthly"}),
+}
+# Approximate bucket widths, used only to size a range in buckets
+_WIDTH = {"hour": timedelta(hours=1), "day": timedelta(days=1), "month": timedelta(days=30)}
+
+
+def _merge_sql(table: str, tier: str) -> str:
+    (k1, k2), value, targets = ROLLUPS[table]
+    target, col = targets[tier], COLUMNS[tier]
+    # open/close are looked up on the (key, at) unique index; the upsert folds a
+    # new partial bucket into an existing one (earliest open, latest close)
+    return f"""
+    INSERT INTO {target} ({k1}, {k2}, bucket, open, high, low, close, count, open_at, close_at)
+    SELECT g.{k1}, g.{k2}, g.bucket,
+      (SELECT o.{value} FROM {table} AS o WHERE o.{k1} = g.{k1} AND o.{k2} = g.{k2} AND o.at = g.open_at),
+      g.high, g.low,
+      (SELECT c.{value} FROM {table} AS c WHERE c.{k1} = g.{k1} AND c.{k2} = g.{k2} AND c.at = g.close_at),
+      g.n, g.open_at, g.close_at
+    FROM (
+      SELECT {k1}, {k2}, {col} AS bucket, MIN(at) AS open_at, MAX(at) AS close_at,
+             MAX({value}) AS high, MIN({value}) AS low, COUNT(*) AS n
+      FROM {table}
+      WHERE id > ? AND id <= ? AND {col} IS NOT NULL
+      GROUP BY {k1}, {k2}, {col}
+    ) AS g
+    WHERE true
+    ON CONFLICT ({k1}, {k2}, bucket) DO UPDATE SET
+      open = CASE WHEN excluded.open_at < {target}.open_at THEN excluded.open ELSE {target}.open END,
+      open_at = MIN({target}.open_at, excluded.open_at),
+      high = MAX({target}.high, excluded.high),
+      low = MIN({target}.low, excluded.low),
+      close = CASE WHEN excluded.close_at >= {target}.close_at THEN excluded.close ELSE {target}.close END,
+      close_at = MAX({target}.close_at, excluded.close_at),
+      count = {target}.count + excluded.count
+    """
+
+
+def rollup_rows(conn, table: str, after_id: int, upto_id: int) -> Dict[str, int]:
+    """Fold raw rows with after_id < id <= upto_id into every rollup tier of `table`.
+    Each raw row must be folded in exactly once; compaction tracks that with
+    compaction_state.rollup_id. Returns buckets written per tier."""
+    if upto_id <= after_id:
+        return {tier: 0 for tier in TIERS}
+    return {
+        tier: conn.exec_driver_sql(_merge_sql(table, tier), (after_id, upto_id)).rowcount or 0
+        for tier in TIERS
+    }
+
+
+def prune_rollups(conn, table: str, now: datetime) -> Dict[str, Any]:
+    """Drop hourly / daily rollup buckets of `table` that start before
+    now - ROLLUP_HOURLY_DAYS / ROLLUP_DAILY_DAYS; monthly buckets are kept.
+    Returns buckets deleted per tier and the new edges (bucket starts)."""
+    targets = ROLLUPS[table][2]
+    out: Dict[str, Any] = {}
+    for tier, days in (("hour", ROLLUP_HOURLY_DAYS), ("day", ROLLUP_DAILY_DAYS)):
+        edge = bucket_key(tier, now - timedelta(days=days))
+        deleted = conn.exec_driver_sql(f"DELETE FROM {targets[tier]} WHERE bucket < ?", (edge,)).rowcount or 0
+        out[tier] = {"deleted": deleted, "since": bucket_start(tier, edge)}
+    return out
+
+
+def rollup_since(state, tier: str) -> Optional[datetime]:
+    """Start of the oldest `tier` rollup bucket the last compaction pass kept
+    (from a compaction_state row); None when nothing was dropped."""
+    value = state and state.get(f"{tier}_rollup_since")
+    return _naive(value) if value else None
+
+
+def pick_tier(start: datetime, end: datetime, max_points: int | None = None) -> str:
+    """Finest tier that covers [start, end) in at most `max_points` buckets
+    (coarsest needed), e.g. hourly for a week, daily for a few years."""
+    limit = max_points or ROLLUP_MAX_POINTS
+    span = max(end - start, timedelta(0))
+    for tier in TIERS:
+        if span / _WIDTH[tier] <= limit:
+            return tier
+    return TIERS[-1]
+
+
+def _naive(dt: datetime) -> datetime:
+    return dt.astimezone(UTC).replace(tzinfo=None) if dt.tzinfo else dt
+
+
+def _fold(into: Dict[str, Any], other: Dict[str, Any]) -> None:
+    if other["open_at"] < into["open_at"]:
+        into["open"], into["open_at"] = other["open"], other["open_at"]
+    if other["close_at"] >= into["close_at"]:
+        into["close"], into["close_at"] = other["close"], other["close_at"]
+    into["high"] = max(into["high"], other["high"])
+    into["low"] = min(into["low"], other["low"])
+    into["count"] += other["count"]
+
+
+def _ohlc(db, table: str, key: Tuple[Any, Any], start: datetime, end: datetime,
+          tier: Optional[str], max_points: Optional[int]) -> List[Dict[str, Any]]:
+    start, end = _naive(start), _naive(end)
+    state = db.execute(
+        CompactionState.__table__.select().where(CompactionState.table_name == table)
+    ).mappings().first()
+    if tier is None:
+        tier = pick_tier(start, end, max_points)
+        # Compaction has dropped the finer buckets this far back
+        while tier != TIERS[-1] and (rollup_since(state, tier) or start) > start:
+            tier = TIERS[TIERS.index(tier) + 1]
+    (k1, k2), value, targets = ROLLUPS[table]
+    col = COLUMNS[tier]
+    lo, hi = bucket_key(tier, start), bucket_key(tier, end)
+    params = {"a": key[0], "b": key[1], "lo": lo, "hi": hi}
+    params["after"] = (state["rollup_id"] if state else None) or 0
+
+    out: Dict[int, Dict[str, Any]] = {}
+    for r in db.execute(text(
+        f"SELECT bucket, open, high, low, close, count, open_at, close_at FROM {targets[tier]} "
+        f"WHERE {k1} = :a AND {k2} = :b AND bucket >= :lo AND bucket <= :hi"
+    ), params).mappings():
+        out[r["bucket"]] = dict(r)
+    # Raw rows written since the last compaction are not in the rollups yet
+    pending = f"""
+    SELECT g.*,
+      (SELECT {value} FROM {table} WHERE {k1} = :a AND {k2} = :b AND at = g.open_at) AS open,
+      (SELECT {value} FROM {table} WHERE {k1} = :a AND {k2} = :b AND at = g.close_at) AS close
+    FROM (
+      SELECT {col} AS bucket, MAX({value}) AS high, MIN({value}) AS low, COUNT(*) AS count,
+             MIN(at) AS open_at, MAX(at) AS close_at
+      FROM {table}
+      WHERE {k1} = :a AND {k2} = :b AND {col} >= :lo AND {col} <= :hi AND id > :after
+      GROUP BY {col}
+    ) AS g
+    """
+    for r in db.execute(text(pending), params).mappings():
+        if r["bucket"] in out:
+            _fold(out[r["bucket"]], dict(r))
+        else:
+            out[r["bucket"]] = dict(r)
+    return [
+        {
+            "at": bucket_start(tier, b),
+            "open": out[b]["open"],
+            "high": out[b]["high"],
+            "low": out[b]["low"],
+            "close": out[b]["close"],
+            "count": out[b]["count"],
+        }
+        for b in sorted(out)
+    ]
+
+
+def price_ohlc(db, asset_id: int, ccy: str, start: datetime, end: datetime,
+               tier: Optional[str] = None, max_points: Optional[int] = None) -> List[Dict[str, Any]]:
+    """OHLC candles for buckets overlapping [start, end], from the rollup tier
+    chosen by `pick_tier` (or the next coarser one where compaction has dropped
+    its buckets) unless `tier` is given. Rows not yet compacted are
+    merged in, so results are current. Each candle: at (bucket start, naive UTC),
+    open, high, low, close, count."""
+    return _ohlc(db, "prices", (asset_id, ccy), start, end, tier, max_points)
+
+
+def fx_ohlc(db, base_ccy: str, quote_ccy: str, start: datetime, end: datetime,
+            tier: Optional[str] = None, max_points: Optional[int] = None) -> List[Dict[str, Any]]:
+    return _ohlc(db, "fx_rates", (base_ccy, quote_ccy), start, end, tier, max_points)
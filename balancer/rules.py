@@ -1,7 +1,9 @@
 from __future__ import annotations
 from dataclasses import dataclass
 from datetime import datetime, timedelta, UTC
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Set, Tuple
+
+import numpy as np
 
 from .config import (
     COOLOFF_DAYS,
@@ -9,10 +11,13 @@ from .config import (
     DRIFT_BAND_DEFAULT,
     MIN_TRADE_USD_DEFAULT,
     DEFAULT_PORTFOLIO_NAME,
+    RULES_SKIP_EPSILON,
 )
 from .db import SessionLocal
 from .models import Position, Price, FxRate, Target, Alert, Asset, Portfolio
-from .alerts import log_alert
+from .alerts import AlertSink, log_alert
+from .latest import PriceSnapshot
+from .rebalance import plan_rebalance
 
 
 @dataclass
@@ -22,7 +27,9 @@ class PriceBook:
     btc: float | None
 
 
-def latest_price(db, asset_id: int, ccy: str) -> Optional[float]:
+def latest_price(db, asset_id: int, ccy: str, snap: PriceSnapshot | None = None) -> Optional[float]:
+    if snap is not None:
+        return snap.price(asset_id, ccy)
     row = (
         db.query(Price)
         .filter(Price.asset_id == asset_id, Price.ccy == ccy)
@@ -32,15 +39,17 @@ def latest_price(db, asset_id: int, ccy: str) -> Optional[float]:
     return float(row.price) if row else None
 
 
-def get_price_book(db, asset_id: int) -> PriceBook:
+def get_price_book(db, asset_id: int, snap: PriceSnapshot | None = None) -> PriceBook:
     return PriceBook(
-        usd=latest_price(db, asset_id, "USD"),
-        gbp=latest_price(db, asset_id, "GBP"),
-        btc=latest_price(db, asset_id, "BTC"),
+        usd=latest_price(db, asset_id, "USD", snap),
+        gbp=latest_price(db, asset_id, "GBP", snap),
+        btc=latest_price(db, asset_id, "BTC", snap),
     )
 
 
-def latest_fx(db, base: str, quote: str) -> Optional[float]:
+def latest_fx(db, base: str, quote: str, snap: PriceSnapshot | None = None) -> Optional[float]:
+    if snap is not None:
+        return snap.rate(base, quote)
     row = (
         db.query(FxRate)
         .filter(FxRate.base_ccy == base, FxRate.quote_ccy == quote)
@@ -50,11 +59,20 @@ def latest_fx(db, base: str, quote: str) -> Optional[float]:
     return float(row.rate) if row else None
 
 
-def gbp_to_usd(db) -> Optional[float]:
+def gbp_to_usd(db, snap: PriceSnapshot | None = None) -> Optional[float]:
     # Prefer stored FX
-    rate = latest_fx(db, "GBP", "USD")
+    rate = latest_fx(db, "GBP", "USD", snap)
     if rate:
         return rate
+    if snap is not None:
+        # The USDC fallback needs an asset lookup; do it once per snapshot
+        if "gbp_usd" not in snap.derived:
+            snap.derived["gbp_usd"] = _gbp_to_usd_via_usdc(db, snap)
+        return snap.derived["gbp_usd"]
+    return _gbp_to_usd_via_usdc(db)
+
+
+def _gbp_to_usd_via_usdc(db, snap: PriceSnapshot | None = None) -> Optional[float]:
     # Derive from USDC if available: USD/GBP = usdc_usd / usdc_gbp
     # Find asset with symbol USDC or coingecko_id usd-coin
     usdc_asset = db.query(Asset).filter(Asset.symbol == "USDC").first()
@@ -62,32 +80,32 @@ def gbp_to_usd(db) -> Optional[float]:
         usdc_asset = db.query(Asset).filter(Asset.coingecko_id == "usd-coin").first()
     if not usdc_asset:
         return None
-    usdc_usd = latest_price(db, usdc_asset.id, "USD")
-    usdc_gbp = latest_price(db, usdc_asset.id, "GBP")
+    usdc_usd = latest_price(db, usdc_asset.id, "USD", snap)
+    usdc_gbp = latest_price(db, usdc_asset.id, "GBP", snap)
     if usdc_usd and usdc_gbp and usdc_gbp != 0:
         return usdc_usd / usdc_gbp
     return None
 
 
-def position_market_value_usd(db, pos: Position) -> Optional[float]:
-    pb = get_price_book(db, pos.asset_id)
+def position_market_value_usd(db, pos: Position, snap: PriceSnapshot | None = None) -> Optional[float]:
+    pb = get_price_book(db, pos.asset_id, snap)
     if pb.usd is not None:
         return pb.usd * pos.coins
     if pb.gbp is not None:
-        rate = gbp_to_usd(db)
+        rate = gbp_to_usd(db, snap)
         if rate:
             return pb.gbp * rate * pos.coins
     return None
 
 
-def position_cost_basis_usd(db, pos: Position) -> Optional[float]:
+def position_cost_basis_usd(db, pos: Position, snap: PriceSnapshot | None = None) -> Optional[float]:
     # Avg cost per unit stored in pos.avg_cost_ccy (GBP per spec now)
     if pos.avg_cost_per_unit is None:
         return None
     if (pos.avg_cost_ccy or "").upper() == "USD":
         return pos.avg_cost_per_unit * pos.coins
     if (pos.avg_cost_ccy or "").upper() == "GBP":
-        rate = gbp_to_usd(db)
+        rate = gbp_to_usd(db, snap)
         if rate:
             return pos.avg_cost_per_unit * rate * pos.coins
     # Fallback: unknown ccy, assume USD
@@ -110,12 +128,51 @@ def last_alert_within(db, portfolio_id: int, asset_id: int, kind: str, within: t
     return row is not None
 
 
-def evaluate_take_profit(db, portfolio_id: int, pos: Position) -> None:
+def recent_alert_keys(db, portfolio_id: int, within: timedelta) -> Set[Tuple[int, str]]:
+    """(asset_id, type) of every alert in the cool-off window, in one query."""
+    since = datetime.now(UTC) - within
+    rows = (
+        db.query(Alert.asset_id, Alert.type)
+        .filter(Alert.portfolio_id == portfolio_id, Alert.at >= since)
+        .distinct()
+        .all()
+    )
+    return {(asset_id, kind) for asset_id, kind in rows}
+
+
+def _raise_alert(db, sink: AlertSink | None, portfolio_id: int, asset_id: int, kind: str, row_message: str,
+                 log_kind: str, message: str, payload: dict) -> None:
+    """Log an alert and record its row for cool-off checks: buffered in ``sink``
+    when given, otherwise written and committed immediately."""
+    if sink is not None:
+        sink.log(log_kind, message, payload, "info")
+        sink.record(portfolio_id, asset_id, kind, row_message)
+        return
+    log_alert(kind=log_kind, message=message, payload=payload, severity="info")
+    db.add(Alert(portfolio_id=portfolio_id, asset_id=asset_id, type=kind, message=row_message, severity="info"))
+    db.commit()
+
+
+def take_profit_kind(multiple: float) -> str:
+    return f"take_profit_{int(multiple)}x_value"
+
+
+def evaluate_take_profit(
+    db,
+    portfolio_id: int,
+    pos: Position,
+    snap: PriceSnapshot | None = None,
+    recent: Set[Tuple[int, str]] | None = None,
+    sink: AlertSink | None = None,
+) -> None:
+    """``snap`` / ``recent`` (from load_snapshot / recent_alert_keys) replace the
+    per-position price and cool-off queries when evaluating a whole portfolio;
+    ``sink`` buffers the alerts instead of committing each one."""
     # Skip zero positions
     if not pos.coins or pos.coins <= 0:
         return
-    mv = position_market_value_usd(db, pos)
-    cb = position_cost_basis_usd(db, pos)
+    mv = position_market_value_usd(db, pos, snap)
+    cb = position_cost_basis_usd(db, pos, snap)
     if mv is None or cb is None or cb <= 0:
         return
     pnl_multiple = mv / cb  # e.g., 2.0 => 100% profit
@@ -128,15 +185,20 @@ def evaluate_take_profit(db, portfolio_id: int, pos: Position) -> None:
     cooldown = timedelta(days=COOLOFF_DAYS)
     for m in thresholds:
         if pnl_multiple >= m:
-            if last_alert_within(db, portfolio_id, pos.asset_id, f"take_profit_{int(m)}x_value", cooldown):
+            kind = take_profit_kind(m)
+            if recent is not None:
+                if (pos.asset_id, kind) in recent:
+                    continue
+            elif last_alert_within(db, portfolio_id, pos.asset_id, kind, cooldown):
                 continue
             # Recommend sell 33% of current remaining position
             qty = pos.coins * 0.33
             asset = db.get(Asset, pos.asset_id)
-            log_alert(
-                kind="take_profit",
-                message=f"{asset.symbol}: Value >= {m:.1f}x cost. Consider selling 33% (~{qty:.6f} units)",
-                payload={
+            _raise_alert(
+                db, sink, portfolio_id, pos.asset_id, kind, "suggested take profit",
+                "take_profit",
+                f"{asset.symbol}: Value >= {m:.1f}x cost. Consider selling 33% (~{qty:.6f} units)",
+                {
                     "asset_id": pos.asset_id,
                     "portfolio_id": portfolio_id,
                     "multiple": m,
@@ -144,22 +206,15 @@ def evaluate_take_profit(db, portfolio_id: int, pos: Position) -> None:
                     "mv_usd": mv,
                     "cb_usd": cb,
                 },
-                severity="info",
-            )
-            # Record an alert row for cooldown checks
-            db.add(
-                Alert(
-                    portfolio_id=portfolio_id,
-                    asset_id=pos.asset_id,
-                    type=f"take_profit_{int(m)}x_value",
-                    message="suggested take profit",
-                    severity="info",
-                )
             )
-            db.commit()
+            if recent is not None:
+                recent.add((pos.asset_id, kind))
 
 
-def evaluate_drift(db, portfolio_id: int, positions: List[Position]) -> None:
+def evaluate_drift(db, portfolio_id: int, positions: List[Position], snap: PriceSnapshot | None = None,
+                   sink: AlertSink | None = None) -> None:
+    """Rebalance alerts for the trades of one portfolio-level plan
+    (rebalance.plan_rebalance): cash-neutral, every target back inside its band."""
     # Build map of target weights
     targets: Dict[int, Target] = {t.asset_id: t for t in db.query(Target).filter(Target.portfolio_id == portfolio_id).all()}
     if not targets:
@@ -168,63 +223,119 @@ def evaluate_drift(db, portfolio_id: int, positions: List[Position]) -> None:
     mv_by_asset: Dict[int, float] = {}
     total_mv = 0.0
     for pos in positions:
-        mv = position_market_value_usd(db, pos)
+        mv = position_market_value_usd(db, pos, snap)
         if mv is None:
             continue
         mv_by_asset[pos.asset_id] = mv
         total_mv += mv
     if total_mv <= 0:
         return
-    for pos in positions:
-        t = targets.get(pos.asset_id)
-        if not t:
+    tgts = [targets.get(pos.asset_id) for pos in positions]
+    plan = plan_rebalance(
+        np.array([mv_by_asset.get(pos.asset_id, np.nan) for pos in positions], dtype=np.float64),
+        np.array([(t.target_weight or 0.0) if t else 0.0 for t in tgts]),
+        np.array([t.drift_band if t and t.drift_band is not None else DRIFT_BAND_DEFAULT for t in tgts]),
+        np.array([t.min_trade_usd if t and t.min_trade_usd is not None else MIN_TRADE_USD_DEFAULT for t in tgts]),
+        np.array([t is not None for t in tgts]),
+    )
+    for pos, t, diff_value in zip(positions, tgts, plan.trades_usd.tolist()):
+        if not diff_value:
             continue
         actual_w = (mv_by_asset.get(pos.asset_id, 0.0) / total_mv) if total_mv else 0.0
         drift = actual_w - (t.target_weight or 0.0)
-        band = (t.drift_band if t.drift_band is not None else DRIFT_BAND_DEFAULT)
-        min_trade = (t.min_trade_usd if t.min_trade_usd is not None else MIN_TRADE_USD_DEFAULT)
-        if abs(drift) >= band:
-            # Amount to trade in USD to get back to target
-            target_value = (t.target_weight or 0.0) * total_mv
-            diff_value = target_value - mv_by_asset.get(pos.asset_id, 0.0)
-            if abs(diff_value) >= min_trade:
-                side = "BUY" if diff_value > 0 else "SELL"
-                asset = db.get(Asset, pos.asset_id)
-                price_usd = latest_price(db, pos.asset_id, "USD") or 0.0
-                qty = abs(diff_value) / price_usd if price_usd else 0.0
-                log_alert(
-                    kind="rebalance",
-                    message=f"{asset.symbol}: Drift {drift:+.2%}. {side} ~${abs(diff_value):.2f} (~{qty:.6f} units)",
-                    payload={
-                        "asset_id": pos.asset_id,
-                        "portfolio_id": portfolio_id,
-                        "drift": drift,
-                        "side": side,
-                        "trade_value_usd": abs(diff_value),
-                        "qty_suggested": qty,
-                    },
-                    severity="info",
-                )
-                db.add(
-                    Alert(
-                        portfolio_id=portfolio_id,
-                        asset_id=pos.asset_id,
-                        type="rebalance_suggested",
-                        message="suggested rebalance",
-                        severity="info",
-                    )
-                )
-                db.commit()
-
-
-def run_rules(portfolio_name: str = DEFAULT_PORTFOLIO_NAME) -> None:
+        side = "BUY" if diff_value > 0 else "SELL"
+        asset = db.get(Asset, pos.asset_id)
+        price_usd = latest_price(db, pos.asset_id, "USD", snap) or 0.0
+        qty = abs(diff_value) / price_usd if price_usd else 0.0
+        _raise_alert(
+            db, sink, portfolio_id, pos.asset_id, "rebalance_suggested", "suggested rebalance",
+            "rebalance",
+            f"{asset.symbol}: Drift {drift:+.2%}. {side} ~${abs(diff_value):.2f} (~{qty:.6f} units)",
+            {
+                "asset_id": pos.asset_id,
+                "portfolio_id": portfolio_id,
+                "drift": drift,
+                "side": side,
+                "trade_value_usd": abs(diff_value),
+                "qty_suggested": qty,
+            },
+        )
+
+
+def emit_alerts(sink: AlertSink, state, ev) -> int:
+    """Buffer the alerts of a rules_engine evaluation in ``sink``, in the same
+    order, wording and payloads as evaluate_take_profit / evaluate_drift.
+    Returns the count."""
+    count = 0
+    pid = state.portfolio_id
+    for i, j in zip(*np.nonzero(ev.ladder)):
+        m = state.multiples[j]
+        qty = float(state.coins[i]) * 0.33
+        asset_id = int(state.asset_ids[i])
+        _raise_alert(
+            None, sink, pid, asset_id, take_profit_kind(m), "suggested take profit",
+            "take_profit",
+            f"{state.symbols[i]}: Value >= {m:.1f}x cost. Consider selling 33% (~{qty:.6f} units)",
+            {
+                "asset_id": asset_id,
+                "portfolio_id": pid,
+                "multiple": m,
+                "qty_suggested": qty,
+                "mv_usd": float(ev.mv_usd[i]),
+                "cb_usd": float(ev.cb_usd[i]),
+            },
+        )
+        count += 1
+    for i in np.flatnonzero(ev.rebalance):
+        drift = float(ev.drift[i])
+        trade = float(ev.trade_usd[i])
+        side = "BUY" if trade > 0 else "SELL"
+        qty = float(ev.qty[i])
+        asset_id = int(state.asset_ids[i])
+        _raise_alert(
+            None, sink, pid, asset_id, "rebalance_suggested", "suggested rebalance",
+            "rebalance",
+            f"{state.symbols[i]}: Drift {drift:+.2%}. {side} ~${abs(trade):.2f} (~{qty:.6f} units)",
+            {
+                "asset_id": asset_id,
+                "portfolio_id": pid,
+                "drift": drift,
+                "side": side,
+                "trade_value_usd": abs(trade),
+                "qty_suggested": qty,
+            },
+        )
+        count += 1
+    return count
+
+
+def run_rules(portfolio_name: str = DEFAULT_PORTFOLIO_NAME, snap: PriceSnapshot | None = None,
+              eps: float | None = None) -> Dict[str, int]:
+    """Evaluate take-profit and drift for every position at once (rules_engine).
+    Alerts go through one AlertSink: a single commit and JSONL append per run.
+
+    A pre-pass against rule_state skips positions that moved less than ``eps``
+    (default RULES_SKIP_EPSILON) since their last evaluation and cannot have
+    reached a ladder rung or drift band; only the rest are evaluated and have
+    their rule_state rows rewritten. Returns alerts raised and positions
+    evaluated / skipped."""
+    from .rules_engine import evaluate, load_last_alerts, load_rule_state, load_state, quiet_mask, save_rule_state
+
+    eps = RULES_SKIP_EPSILON if eps is None else eps
     with SessionLocal() as db:
         portfolio = db.query(Portfolio).filter_by(name=portfolio_name).first()
         if not portfolio:
-            return
-        positions = (
-            db.query(Position).join(Asset, Asset.id == Position.asset_id).filter(Position.portfolio_id == portfolio.id, Asset.active).all()
-        )
-        for pos in positions:
-            evaluate_take_profit(db, portfolio.id, pos)
-        evaluate_drift(db, portfolio.id, positions)
+            return {"alerts": 0, "evaluated": 0, "skipped": 0}
+        state = load_state(db, portfolio.id, snap=snap, with_alerts=False)
+        active = ~quiet_mask(state, load_rule_state(db, portfolio.id), eps)
+        report = {"alerts": 0, "evaluated": int(active.sum()), "skipped": int((~active).sum())}
+        if not active.any():
+            return report
+        load_last_alerts(db, state, None if active.all() else active)
+        ev = evaluate(state, active)
+        with AlertSink(db) as sink:
+            # Committed with the alert rows, or below when there are none
+            save_rule_state(db, state, ev, active)
+            report["alerts"] = emit_alerts(sink, state, ev)
+        db.commit()
+        return report
@@ -0,0 +1,273 @@
+from __future__ import annotations
+import math
+from dataclasses import dataclass
+from datetime import datetime, timedelta, UTC
+from typing import Dict, List, Sequence
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from .config import COOLOFF_DAYS, DRIFT_BAND_DEFAULT, LADDER_VALUE_MULTIPLES, MIN_TRADE_USD_DEFAULT
+from .latest import PriceSnapshot, load_snapshot
+from .models import Alert, Asset, Position, RuleState, Target
+from .rebalance import plan_rebalance
+from .rules import gbp_to_usd, take_profit_kind
+
+# Vectorised take-profit / drift evaluation for a whole portfolio. Inputs come
+# from a fixed handful of queries (positions + targets, the latest-price
+# snapshot, last alert per (asset, type), and the USDC fallback only when no
+# GBPUSD rate is stored); outputs match rules.evaluate_take_profit /
+# rules.evaluate_drift position for position.
+
+
+@dataclass
+class PortfolioState:
+    """One row per held position on an active asset, in position-id order."""
+    portfolio_id: int
+    asset_ids: np.ndarray
+    symbols: List[str]
+    coins: np.ndarray
+    avg_cost: np.ndarray  # NaN when avg_cost_per_unit is NULL
+    cost_is_gbp: np.ndarray
+    px_usd: np.ndarray  # NaN when no latest price
+    px_gbp: np.ndarray
+    gbp_usd: float  # NaN when no usable rate
+    has_target: np.ndarray
+    target_weight: np.ndarray
+    drift_band: np.ndarray
+    min_trade_usd: np.ndarray
+    multiples: List[float]
+    # Epoch seconds of the newest alert per (position, ladder rung) in the cool-off window; NaN if none
+    last_alert_at: np.ndarray
+    now: datetime
+    cooloff: timedelta
+
+
+@dataclass
+class Evaluation:
+    mv_usd: np.ndarray  # NaN where no price
+    cb_usd: np.ndarray  # NaN where no cost
+    pnl_multiple: np.ndarray  # NaN where take-profit does not apply
+    ladder: np.ndarray  # bool (n x rungs): rung crossed and not cooling off
+    total_mv: float
+    weight: np.ndarray
+    drift: np.ndarray
+    trade_usd: np.ndarray  # signed USD from the portfolio rebalance plan, 0 = no trade
+    rebalance: np.ndarray  # bool: part of the rebalance plan
+    qty: np.ndarray  # units for the rebalance trade (0 without a USD price)
+
+
+def _f(v) -> float:
+    return math.nan if v is None else float(v)
+
+
+def load_state(db, portfolio_id: int, snap: PriceSnapshot | None = None,
+               now: datetime | None = None, multiples: Sequence[float] | None = None,
+               cooloff: timedelta | None = None, with_alerts: bool = True) -> PortfolioState:
+    """``with_alerts=False`` leaves last_alert_at all-NaN; fill it later with
+    load_last_alerts for just the assets that need evaluating."""
+    now = now or datetime.now(UTC)
+    multiples = list(LADDER_VALUE_MULTIPLES if multiples is None else multiples)
+    cooloff = timedelta(days=COOLOFF_DAYS) if cooloff is None else cooloff
+    rows = (
+        db.query(
+            Position.asset_id, Asset.symbol, Position.coins, Position.avg_cost_ccy, Position.avg_cost_per_unit,
+            Target.id, Target.target_weight, Target.drift_band, Target.min_trade_usd,
+        )
+        .join(Asset, Asset.id == Position.asset_id)
+        .outerjoin(Target, (Target.portfolio_id == Position.portfolio_id) & (Target.asset_id == Position.asset_id))
+        .filter(Position.portfolio_id == portfolio_id, Asset.active)
+        .order_by(Position.id)
+        .all()
+    )
+    snap = snap if snap is not None else load_snapshot(db)
+    rate = gbp_to_usd(db, snap) if rows else None
+
+    ids = np.array([r[0] for r in rows], dtype=np.int64)
+    state = PortfolioState(
+        portfolio_id=portfolio_id,
+        asset_ids=ids,
+        symbols=[r[1] for r in rows],
+        coins=np.array([_f(r[2]) if r[2] is not None else 0.0 for r in rows], dtype=np.float64),
+        avg_cost=np.array([_f(r[4]) for r in rows], dtype=np.float64),
+        cost_is_gbp=np.array([(r[3] or "").upper() == "GBP" for r in rows], dtype=bool),
+        px_usd=np.array([_f(snap.price(int(a), "USD")) for a in ids], dtype=np.float64),
+        px_gbp=np.array([_f(snap.price(int(a), "GBP")) for a in ids], dtype=np.float64),
+        gbp_usd=float(rate) if rate else math.nan,
+        has_target=np.array([r[5] is not None for r in rows], dtype=bool),
+        target_weight=np.array([_f(r[6]) if r[6] is not None else 0.0 for r in rows], dtype=np.float64),
+        drift_band=np.array([_f(r[7]) if r[7] is not None else DRIFT_BAND_DEFAULT for r in rows], dtype=np.float64),
+        min_trade_usd=np.array([_f(r[8]) if r[8] is not None else MIN_TRADE_USD_DEFAULT for r in rows], dtype=np.float64),
+        multiples=multiples,
+        last_alert_at=np.full((len(rows), len(multiples)), np.nan),
+        now=now,
+        cooloff=cooloff,
+    )
+    if with_alerts:
+        load_last_alerts(db, state)
+    return state
+
+
+def load_last_alerts(db, state: PortfolioState, rows: np.ndarray | None = None) -> None:
+    """Fill state.last_alert_at from the alerts table for the positions in
+    ``rows`` (bool mask; default all) in one query."""
+    ids = state.asset_ids if rows is None else state.asset_ids[rows]
+    if not len(ids) or not state.multiples:
+        return
+    rung = {take_profit_kind(m): j for j, m in enumerate(state.multiples)}
+    row_of = {int(a): i for i, a in enumerate(state.asset_ids)}
+    q = (
+        db.query(Alert.asset_id, Alert.type, func.max(Alert.at))
+        .filter(Alert.portfolio_id == state.portfolio_id, Alert.at >= state.now - state.cooloff,
+                Alert.type.in_(list(rung)))
+    )
+    if rows is not None:
+        q = q.filter(Alert.asset_id.in_([int(a) for a in ids]))
+    for asset_id, kind, at in q.group_by(Alert.asset_id, Alert.type):
+        i = row_of.get(asset_id)
+        if i is not None and at is not None:
+            at = at if at.tzinfo else at.replace(tzinfo=UTC)
+            state.last_alert_at[i, rung[kind]] = at.timestamp()
+
+
+def evaluate(state: PortfolioState, active: np.ndarray | None = None) -> Evaluation:
+    """Values every position; ladder flags are only raised for positions in
+    ``active`` (bool mask; default all). Rebalance trades come from one plan
+    over the whole portfolio."""
+    coins = state.coins
+    rate_ok = not math.isnan(state.gbp_usd)
+    has_usd = ~np.isnan(state.px_usd)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        # Same operand order as the scalar functions so results are bit-identical
+        mv_gbp = (state.px_gbp * state.gbp_usd) * coins if rate_ok else np.full_like(coins, np.nan)
+        mv = np.where(has_usd, state.px_usd * coins, mv_gbp)
+
+        # GBP cost without a rate falls back to treating it as USD, as the scalar path does
+        cb_usd = state.avg_cost * coins
+        cb = np.where(state.cost_is_gbp, (state.avg_cost * state.gbp_usd) * coins, cb_usd) if rate_ok else cb_usd
+
+        tp_ok = (coins > 0) & ~np.isnan(mv) & ~np.isnan(cb) & (cb > 0)
+        pnl = np.where(tp_ok, mv / cb, np.nan)
+        mults = np.array(state.multiples, dtype=np.float64)
+        cutoff = (state.now - state.cooloff).timestamp()
+        cooling = ~np.isnan(state.last_alert_at) & (state.last_alert_at >= cutoff)
+        ladder = tp_ok[:, None] & (pnl[:, None] >= mults[None, :]) & ~cooling
+
+        valid = ~np.isnan(mv)
+        # Sequential left fold, as the scalar loop sums
+        total = float(np.add.accumulate(mv[valid])[-1]) if valid.any() else 0.0
+        mv0 = np.where(valid, mv, 0.0)
+        if total > 0:
+            weight = mv0 / total
+            drift = weight - state.target_weight
+        else:
+            weight = drift = np.full_like(coins, np.nan)
+        # One cash-neutral trade set for the whole portfolio (rebalance.plan_rebalance)
+        trade = plan_rebalance(mv, state.target_weight, state.drift_band, state.min_trade_usd, state.has_target).trades_usd
+        rebalance = trade != 0
+        if active is not None:
+            # Offsetting trades may fall on quiet positions: an out-of-band position is never quiet
+            ladder &= active[:, None]
+        px_ok = has_usd & (state.px_usd != 0)
+        qty = np.where(px_ok, np.abs(trade) / np.where(px_ok, state.px_usd, 1.0), 0.0)
+
+    return Evaluation(
+        mv_usd=mv, cb_usd=cb, pnl_multiple=pnl, ladder=ladder, total_mv=total,
+        weight=weight, drift=drift, trade_usd=trade, rebalance=rebalance, qty=qty,
+    )
+
+
+def fingerprints(state: PortfolioState) -> List[str]:
+    """Per-position digest of everything besides prices that the rules read."""
+    ladder = ",".join(repr(float(m)) for m in state.multiples)
+    return [
+        "|".join((
+            repr(float(state.coins[i])), repr(float(state.avg_cost[i])), "GBP" if state.cost_is_gbp[i] else "",
+            repr(float(state.target_weight[i])) if state.has_target[i] else "-",
+            repr(float(state.drift_band[i])), repr(float(state.min_trade_usd[i])), ladder,
+        ))
+        for i in range(len(state.asset_ids))
+    ]
+
+
+def unit_values(state: PortfolioState) -> tuple[np.ndarray, np.ndarray]:
+    """(USD price, USD cost) per unit as evaluate derives them; NaN where unknown."""
+    rate = state.gbp_usd
+    px = np.where(np.isnan(state.px_usd), state.px_gbp * rate, state.px_usd)
+    cost = np.where(state.cost_is_gbp & (not math.isnan(rate)), state.avg_cost * rate, state.avg_cost)
+    return px, cost
+
+
+def quiet_mask(state: PortfolioState, prev: Dict[int, RuleState], eps: float) -> np.ndarray:
+    """True for positions that cannot raise an alert, judged against their last
+    evaluation: same position / target inputs, price, unit cost and portfolio
+    total each within ``eps`` (relative), and even the worst case of those moves
+    keeps the value multiple below every ladder rung and the weight inside the
+    drift band. Any change to the set of positions or their inputs marks every
+    position for evaluation."""
+    n = len(state.asset_ids)
+    if eps <= 0 or not n or set(prev) != {int(a) for a in state.asset_ids}:
+        return np.zeros(n, dtype=bool)
+    rows = [prev[int(a)] for a in state.asset_ids]
+    if any(r.inputs != fp for r, fp in zip(rows, fingerprints(state))):
+        return np.zeros(n, dtype=bool)
+
+    def col(name):
+        return np.array([_f(getattr(r, name)) for r in rows], dtype=np.float64)
+
+    px, cost = unit_values(state)
+    total = float(np.nansum(px * state.coins))
+    lo, hi = 1 - eps, 1 + eps
+    with np.errstate(invalid="ignore", divide="ignore"):
+        moved = (
+            (np.abs(px / col("price_usd") - 1) <= eps)
+            & ((np.abs(cost / col("unit_cost_usd") - 1) <= eps) | (np.isnan(cost) & np.isnan(col("unit_cost_usd"))))
+            & (np.abs(total / col("total_mv_usd") - 1) <= eps)
+        )
+        # Multiple = price / cost, so it moves by at most hi / lo either way
+        pnl = col("pnl_multiple")
+        rung = min(state.multiples) if state.multiples else math.inf
+        below_ladder = np.isnan(pnl) | (pnl * hi / lo < rung)
+        # Weight = mv / total, with mv and total each within eps
+        w = col("weight")
+        w_lo, w_hi = w * lo / hi, w * hi / lo
+        tw = state.target_weight
+        worst = np.maximum(np.abs(w_lo - tw), np.abs(w_hi - tw))
+        in_band = ~state.has_target | (worst < state.drift_band)
+    return moved & below_ladder & in_band & (col("total_mv_usd") > 0)
+
+
+def load_rule_state(db, portfolio_id: int) -> Dict[int, RuleState]:
+    return {r.asset_id: r for r in db.query(RuleState).filter(RuleState.portfolio_id == portfolio_id)}
+
+
+def save_rule_state(db, state: PortfolioState, ev: Evaluation, active: np.ndarray) -> None:
+    """Upsert the rule_state rows of the evaluated positions and drop rows of
+    positions no longer held. Left to the caller's commit."""
+    px, cost = unit_values(state)
+    fps = fingerprints(state)
+    now = state.now.astimezone(UTC).replace(tzinfo=None)
+
+    def num(v) -> float | None:
+        return None if math.isnan(v) else float(v)
+
+    rows = [
+        {
+            "portfolio_id": state.portfolio_id, "asset_id": int(state.asset_ids[i]), "inputs": fps[i],
+            "price_usd": num(px[i]), "unit_cost_usd": num(cost[i]), "mv_usd": num(ev.mv_usd[i]),
+            "total_mv_usd": num(ev.total_mv), "weight": num(ev.weight[i]), "pnl_multiple": num(ev.pnl_multiple[i]),
+            "evaluated_at": now,
+        }
+        for i in np.flatnonzero(active)
+    ]
+    table = RuleState.__table__
+    db.query(RuleState).filter(
+        RuleState.portfolio_id == state.portfolio_id, RuleState.asset_id.notin_([int(a) for a in state.asset_ids])
+    ).delete(synchronize_session=False)
+    if rows:
+        stmt = sqlite_insert(table)
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=["portfolio_id", "asset_id"],
+            set_={c: stmt.excluded[c] for c in rows[0] if c not in ("portfolio_id", "asset_id")},
+        ), rows)
@@ -1,14 +1,140 @@
+import os
+import re
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, UTC
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
 from .price_fetcher import run_price_fetch
 from .indicators import fetch_btcd, fetch_dxy_fred, fetch_fear_greed, store_indicator
 from .rules import run_rules
 from .exporter import export_portfolio_json
+from .risk import refresh_risk
+from .schema import ensure_schema
+from .latest import PriceSnapshot, load_snapshot
+from .models import Portfolio
+from .config import (
+    ARCHIVE_ENABLED, BASE_DIR, DEFAULT_PORTFOLIO_NAME, MATRIX_CACHE_ENABLED, PORTFOLIO_WORKERS, PRICE_CHANGES_ENABLED,
+    RISK_ENABLED, RUN_ALL_PORTFOLIOS,
+)
+from . import db
 
+# Snapshot handed to each pool worker once by its initializer
+_shared_snap: PriceSnapshot | None = None
+
+
+def _slug(name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]+", "-", name).strip("-.") or "portfolio"
+
+
+def portfolio_json_path(name: str, portfolio_id: int | None = None) -> Path:
+    """BASE_DIR/portfolio-<name>.json, with the name reduced to filename-safe
+    characters; with ``portfolio_id``, portfolio-<name>-<id>.json."""
+    suffix = "" if portfolio_id is None else f"-{portfolio_id}"
+    return Path(BASE_DIR) / f"portfolio-{_slug(name)}{suffix}.json"
+
+
+def portfolio_json_paths(portfolios: List[Tuple[int | None, str]]) -> Dict[str, Path]:
+    """Output file per portfolio name. Names that reduce to the same slug (e.g.
+    "A/B" and "A-B") each get their portfolio id appended instead of overwriting
+    one another's file."""
+    by_slug: Dict[str, int] = {}
+    for _, name in portfolios:
+        by_slug[_slug(name).lower()] = by_slug.get(_slug(name).lower(), 0) + 1
+    return {
+        name: portfolio_json_path(name, pid if by_slug[_slug(name).lower()] > 1 else None)
+        for pid, name in portfolios
+    }
+
+
+def _mirror(src: Path, dst: Path) -> None:
+    """Atomically copy ``src`` over ``dst`` unless it already holds the same bytes."""
+    try:
+        if dst.read_bytes() == src.read_bytes():
+            return
+    except OSError:
+        pass
+    tmp = dst.with_name(dst.name + ".tmp")
+    shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+def _refresh_risk(name: str, snap: PriceSnapshot | None = None) -> None:
+    # Daily Monte Carlo stress run; the export picks up the stored report
+    if not RISK_ENABLED:
+        return
+    try:
+        refresh_risk(name, snap=snap)
+    except Exception:
+        pass
+
+
+def _run_portfolio(name: str, out_path: Path | None = None, snap: PriceSnapshot | None = None) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    snap = snap if snap is not None else _shared_snap
+    report = run_rules(portfolio_name=name, snap=snap)
+    _refresh_risk(name, snap)
+    path = export_portfolio_json(name, snap=snap, out_path=out_path or portfolio_json_path(name))
+    if name == DEFAULT_PORTFOLIO_NAME:
+        # The UI still reads the unsuffixed file for the default portfolio
+        _mirror(path, Path(BASE_DIR) / "portfolio.json")
+    return {**report, "path": str(path), "seconds": round(time.perf_counter() - t0, 4)}
+
+
+def _init_worker(snap: PriceSnapshot) -> None:
+    global _shared_snap
+    _shared_snap = snap
+    # Connections inherited from the parent through fork must not be reused
+    db.engine.dispose(close=False)
+
+
+def run_all_portfolios(names: List[str] | None = None, workers: int | None = None) -> Dict[str, Any]:
+    """Rules + JSON export for every portfolio against one price snapshot.
+
+    The latest prices / FX are read once and shared by all portfolios. With
+    ``workers`` > 1 portfolios run in a process pool (each worker gets the
+    snapshot once); otherwise they run in order in this process. Each portfolio
+    writes BASE_DIR/portfolio-<name>.json (see portfolio_json_paths); the default
+    one is also copied to portfolio.json. Returns alerts, path and seconds per
+    portfolio.
+    """
+    workers = PORTFOLIO_WORKERS if workers is None else workers
+    with db.SessionLocal() as s:
+        portfolios = [(pid, n) for pid, n in s.query(Portfolio.id, Portfolio.name).order_by(Portfolio.id)]
+        snap = load_snapshot(s)
+    if names is None:
+        names = [n for _, n in portfolios]
+    known = {n for _, n in portfolios}
+    paths = portfolio_json_paths(portfolios + [(None, n) for n in names if n not in known])
+    out = [paths[n] for n in names]
+    report: Dict[str, Any] = {}
+    if workers > 1 and len(names) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(names)), initializer=_init_worker,
+                                 initargs=(snap,)) as pool:
+            for name, res in zip(names, pool.map(_run_portfolio, names, out)):
+                report[name] = res
+    else:
+        for name, path in zip(names, out):
+            report[name] = _run_portfolio(name, path, snap)
+    return report
+
+
+def run_once() -> Dict[str, Any]:
+    # Bring older DBs up to date (new tables, price uniqueness key)
+    ensure_schema()
 
-def run_once() -> None:
     # Prices (single-request pipeline)
     run_price_fetch()
 
+    # Precompute the UI's % change columns from the fresh prices
+    if PRICE_CHANGES_ENABLED:
+        try:
+            from .changes import compute_changes
+            compute_changes()
+        except Exception:
+            pass
+
     # Indicators
     btcd = fetch_btcd()
     if btcd:
@@ -20,17 +146,45 @@ def run_once() -> None:
     if fng:
         store_indicator("FEAR_GREED", fng)
 
-    # Rules
-    run_rules(portfolio_name="Default")
-    # Export portfolio snapshot for UI
-    export_portfolio_json()
+    # Rules + export portfolio snapshot for UI
+    if RUN_ALL_PORTFOLIOS:
+        rules = run_all_portfolios()
+    else:
+        rules = {"Default": run_rules(portfolio_name="Default")}
+        _refresh_risk("Default")
+        export_portfolio_json()
+
+    # Move cold compacted months out to the Parquet archive (after run_price_fetch compacted)
+    if ARCHIVE_ENABLED:
+        try:
+            from .archive import archive_cold
+            archive_cold()
+        except Exception:
+            pass
+
+    # Append the new buckets to the memory-mapped analytics matrices
+    if MATRIX_CACHE_ENABLED:
+        try:
+            from .matrix_cache import build_matrices
+            build_matrices()
+        except Exception:
+            pass
+
+    # Fold the WAL back after the hourly writes so UI readers stay on a short log
+    try:
+        db.maintenance()
+    except Exception:
+        pass
+    return {"rules": rules}
 
 
 if __name__ == "__main__":
     start = datetime.now(UTC)
-    run_once()
+    report = run_once()
     end = datetime.now(UTC)
     s = start.isoformat().replace("+00:00", "Z")
     e = end.isoformat().replace("+00:00", "Z")
     dur = (end - start).total_seconds()
+    for name, r in report["rules"].items():
+        print(f"[rules] {name}: {r['evaluated']} evaluated, {r['skipped']} skipped, {r['alerts']} alerts")
     print(f"[runner] {s} -> {e} ({dur:.2f}s)")
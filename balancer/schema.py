@@ -0,0 +1,85 @@
+from __future__ import annotations
+from . import db as _db
+from . import models
+from .latest import rebuild_latest
+from .coverage import rebuild_coverage
+from .buckets import COLUMNS, SQL_EXPR
+
+
+def _has_index(conn, name: str) -> bool:
+    row = conn.exec_driver_sql("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (name,)).first()
+    return row is not None
+
+
+def _ensure_price_unique(conn) -> None:
+    """Add the (asset_id, ccy, at) unique index to DBs created before it existed.
+    Exact duplicates are dropped first, keeping the newest row id.
+    """
+    if _has_index(conn, "uq_price_asset_ccy_at"):
+        return
+    conn.exec_driver_sql(
+        "DELETE FROM prices WHERE id NOT IN (SELECT MAX(id) FROM prices GROUP BY asset_id, ccy, at)"
+    )
+    conn.exec_driver_sql("CREATE UNIQUE INDEX uq_price_asset_ccy_at ON prices(asset_id, ccy, at)")
+
+
+def _ensure_bucket_columns(conn) -> None:
+    """Add and backfill hour/day/month bucket keys on prices and fx_rates, then
+    index them. The plain (key, at) indexes are dropped: the unique keys cover them.
+    """
+    for table in ("prices", "fx_rates"):
+        cols = {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table})")}
+        missing = [c for c in COLUMNS.values() if c not in cols]
+        for col in missing:
+            conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {col} INTEGER")
+        if missing:
+            assignments = ", ".join(f"{COLUMNS[t]} = {SQL_EXPR[t]}" for t in COLUMNS)
+            conn.exec_driver_sql(f"UPDATE {table} SET {assignments} WHERE at IS NOT NULL")
+    for model in (models.Price, models.FxRate):
+        for index in model.__table__.indexes:
+            index.create(conn, checkfirst=True)
+    conn.exec_driver_sql("DROP INDEX IF EXISTS idx_prices_asset_ccy_at")
+    conn.exec_driver_sql("DROP INDEX IF EXISTS idx_fx_ccy_at")
+
+
+def _ensure_rollup_watermark(conn) -> None:
+    """compaction_state.rollup_id and the rollup retention edges for DBs compacted
+    before the OHLC rollups (or their pruning) existed."""
+    cols = {row[1] for row in conn.exec_driver_sql("PRAGMA table_info(compaction_state)")}
+    for col, kind in (("rollup_id", "INTEGER"), ("hour_rollup_since", "DATETIME"), ("day_rollup_since", "DATETIME")):
+        if col not in cols:
+            conn.exec_driver_sql(f"ALTER TABLE compaction_state ADD COLUMN {col} {kind}")
+
+
+def _seed_latest(conn) -> None:
+    """Fill latest_prices / latest_fx on DBs that predate them."""
+    if conn.exec_driver_sql("SELECT 1 FROM latest_prices LIMIT 1").first() is not None:
+        return
+    if conn.exec_driver_sql("SELECT 1 FROM prices LIMIT 1").first() is None:
+        return
+    rebuild_latest(conn)
+
+
+def _seed_coverage(conn) -> None:
+    """Fill price_coverage / fx_coverage on DBs that predate them."""
+    if conn.exec_driver_sql("SELECT 1 FROM price_coverage LIMIT 1").first() is not None:
+        return
+    if conn.exec_driver_sql("SELECT 1 FROM prices LIMIT 1").first() is None:
+        return
+    rebuild_coverage(conn)
+
+
+def ensure_schema(bind=None) -> None:
+    """Create any tables added since the DB was first initialised and apply in-place migrations.
+
+    Called once by entry points (runner.run_once, balancerctl), not by library functions.
+    """
+    bind = bind or _db.engine
+    _db.Base.metadata.create_all(bind=bind)
+    engine = getattr(bind, "engine", bind)
+    with engine.begin() as conn:
+        _ensure_price_unique(conn)
+        _ensure_bucket_columns(conn)
+        _ensure_rollup_watermark(conn)
+        _seed_latest(conn)
+        _seed_coverage(conn)
@@ -67,6 +67,27 @@ def test_db():
     Base.metadata.drop_all(engine)
 
 
+@pytest.fixture
+def make_engine(tmp_path):
+    """Factory for file-backed SQLite engines under tmp_path with the full schema
+    and two assets, "A" (id 1) and "B" (id 2), for tests that write through
+    the bulk / compaction paths rather than an ORM session."""
+    engines = []
+
+    def make(name: str = "test.db"):
+        engine = create_engine(f"sqlite:///{tmp_path / name}")
+        Base.metadata.create_all(engine)
+        with sessionmaker(bind=engine)() as db:
+            db.add_all([Asset(symbol="A", name="a"), Asset(symbol="B", name="b")])
+            db.commit()
+        engines.append(engine)
+        return engine
+
+    yield make
+    for engine in engines:
+        engine.dispose()
+
+
 @pytest.fixture
 def sample_portfolio(test_db):
     """Create a sample portfolio for testing."""
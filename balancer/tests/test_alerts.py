@@ -82,3 +82,59 @@ def test_log_alert_creates_directory(tmp_path, monkeypatch):
     assert log_file.exists()
     assert log_file.parent.exists()
 
+
+
+def test_alert_sink_flushes_once(tmp_path, test_db, sample_portfolio, sample_assets):
+    """Buffered alerts are committed and appended together on exit."""
+    from sqlalchemy import event
+    from balancer.alerts import AlertSink
+    from balancer.models import Alert
+
+    commits = []
+    event.listen(test_db, "after_commit", lambda s: commits.append(1))
+    log_file = tmp_path / "alerts.jsonl"
+    with AlertSink(test_db, log_path=log_file) as sink:
+        for a in sample_assets:
+            sink.log("rebalance", f"{a.symbol} drift", {"asset_id": a.id})
+            sink.record(sample_portfolio.id, a.id, "rebalance_suggested", "suggested rebalance")
+        assert not log_file.exists() and test_db.query(Alert).count() == 0
+
+    assert len(commits) == 1
+    assert test_db.query(Alert).count() == len(sample_assets)
+    lines = log_file.read_text().splitlines()
+    assert [json.loads(line)["message"] for line in lines] == [f"{a.symbol} drift" for a in sample_assets]
+
+
+def test_alert_sink_flushes_on_error(tmp_path, test_db, sample_portfolio, sample_assets):
+    """Alerts raised before a failure are still written; the error propagates."""
+    import pytest
+    from balancer.alerts import AlertSink
+    from balancer.models import Alert
+
+    log_file = tmp_path / "alerts.jsonl"
+    with pytest.raises(RuntimeError):
+        with AlertSink(test_db, log_path=log_file) as sink:
+            sink.log("take_profit", "BTC 2x")
+            sink.record(sample_portfolio.id, sample_assets[0].id, "take_profit_2x_value", "suggested take profit")
+            raise RuntimeError("boom")
+    assert test_db.query(Alert).count() == 1
+    assert len(log_file.read_text().splitlines()) == 1
+
+
+def test_alert_sink_keeps_lines_when_commit_fails(tmp_path, test_db, monkeypatch):
+    """No JSONL is written for alerts whose rows failed to commit."""
+    import pytest
+    from balancer.alerts import AlertSink
+
+    log_file = tmp_path / "alerts.jsonl"
+    sink = AlertSink(test_db, log_path=log_file)
+    sink.log("rebalance", "x")
+    sink.record(1, 1, "rebalance_suggested", "suggested rebalance")
+
+    def fail():
+        raise RuntimeError("disk full")
+    monkeypatch.setattr(test_db, "commit", fail)
+    with pytest.raises(RuntimeError):
+        sink.flush()
+    assert not log_file.exists()
+    assert len(sink) == 1
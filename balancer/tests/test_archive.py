@@ -0,0 +1,94 @@
+"""Tests for the Parquet cold-history archive and the merged range reader."""
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from balancer.archive import archive_cold, load_price_history
+from balancer.bulk import insert_prices
+from balancer.compaction import compact_all
+
+
+NOW = datetime(2025, 6, 1)
+
+
+def _daily(start, days, base):
+    return [(start + timedelta(days=i), base + i) for i in range(days)]
+
+
+def test_archive_moves_cold_months_and_reader_merges(make_engine, tmp_path):
+    engine = make_engine()
+    points = _daily(NOW - timedelta(days=800), 800, 100.0)
+    with engine.begin() as conn:
+        insert_prices(conn, [(aid, "USD", p, t) for aid in (1, 2) for t, p in points])
+    compact_all(now=NOW, bind=engine)
+    with engine.connect() as conn:
+        kept = conn.exec_driver_sql("SELECT asset_id, at, price FROM prices WHERE asset_id = 1 ORDER BY at").fetchall()
+
+    report = archive_cold(now=NOW, bind=engine, archive_dir=tmp_path / "arch", after_days=400)
+    assert report["rows"] > 0 and report["months"]
+    assert (tmp_path / "arch" / "prices" / f"{report['months'][0]}.parquet").exists()
+    with engine.connect() as conn:
+        oldest = conn.exec_driver_sql("SELECT MIN(at) FROM prices").scalar()
+    assert oldest >= report["cutoff"].replace("T", " ")
+
+    hist = load_price_history([1, 2, 99], NOW - timedelta(days=900), NOW, bind=engine, archive_dir=tmp_path / "arch")
+    at, px = hist[1]
+    assert at.dtype == np.dtype("datetime64[us]") and px.dtype == np.float64
+    assert len(at) == len(kept)
+    assert np.all(at[1:] > at[:-1])
+    assert np.allclose(px, [r[2] for r in kept])
+    assert len(hist[99][0]) == 0
+
+    # Running again moves nothing new and leaves the reader unchanged
+    assert archive_cold(now=NOW, bind=engine, archive_dir=tmp_path / "arch", after_days=400)["rows"] == 0
+    again = load_price_history([1], NOW - timedelta(days=900), NOW, bind=engine, archive_dir=tmp_path / "arch")
+    assert np.array_equal(again[1][0], at)
+
+
+def test_sqlite_row_wins_over_archived_duplicate(make_engine, tmp_path):
+    engine = make_engine()
+    old = NOW - timedelta(days=600)
+    with engine.begin() as conn:
+        insert_prices(conn, [(1, "USD", 10.0, old), (1, "USD", 20.0, NOW)])
+    compact_all(now=NOW, bind=engine)
+    assert archive_cold(now=NOW, bind=engine, archive_dir=tmp_path / "arch")["rows"] == 1
+    # A later backfill writes the same timestamp again
+    with engine.begin() as conn:
+        insert_prices(conn, [(1, "USD", 11.0, old)])
+
+    at, px = load_price_history([1], old - timedelta(days=1), NOW + timedelta(days=1), bind=engine, archive_dir=tmp_path / "arch")[1]
+    assert list(px) == [11.0, 20.0]
+
+
+def test_uncompacted_rows_are_not_archived(make_engine, tmp_path):
+    engine = make_engine()
+    with engine.begin() as conn:
+        insert_prices(conn, [(1, "USD", 1.0, NOW - timedelta(days=700)), (1, "USD", 2.0, NOW)])
+    assert archive_cold(now=NOW, bind=engine, archive_dir=tmp_path / "arch")["rows"] == 0
+
+
+def test_files_written_outside_the_write_lock(make_engine, tmp_path, monkeypatch):
+    from balancer import archive
+
+    engine = make_engine()
+    old = NOW - timedelta(days=600)
+    with engine.begin() as conn:
+        insert_prices(conn, [(1, "USD", 10.0, old), (1, "USD", 20.0, NOW)])
+    compact_all(now=NOW, bind=engine)
+
+    merge = archive._merge_month
+    def merge_and_write(path, table):
+        # Another writer gets in while the Parquet file is written, and edits the cold row
+        with engine.begin() as conn:
+            conn.exec_driver_sql("UPDATE prices SET price = 12.0 WHERE price = 10.0")
+        return merge(path, table)
+    monkeypatch.setattr(archive, "_merge_month", merge_and_write)
+
+    # The changed row stays in SQLite (and wins in the reader) until the next pass
+    assert archive_cold(now=NOW, bind=engine, archive_dir=tmp_path / "arch")["rows"] == 0
+    at, px = load_price_history([1], old - timedelta(days=1), NOW + timedelta(days=1), bind=engine, archive_dir=tmp_path / "arch")[1]
+    assert list(px) == [12.0, 20.0]
+    monkeypatch.setattr(archive, "_merge_month", merge)
+    assert archive_cold(now=NOW, bind=engine, archive_dir=tmp_path / "arch")["rows"] == 1
+    at, px = load_price_history([1], old - timedelta(days=1), NOW + timedelta(days=1), bind=engine, archive_dir=tmp_path / "arch")[1]
+    assert list(px) == [12.0, 20.0]
@@ -0,0 +1,182 @@
+"""Tests for backfill module."""
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+from balancer.backfill import backfill_prices, plan_incremental, _to_ts
+from balancer.models import Price, FxRate
+
+
+def _naive_now():
+    return datetime.now(timezone.utc).replace(tzinfo=None).replace(microsecond=0)
+
+
+def _use_db(monkeypatch, test_db):
+    @contextmanager
+    def mock_session_local():
+        yield test_db
+    monkeypatch.setattr("balancer.backfill.SessionLocal", mock_session_local)
+
+
+class RangeClient:
+    """Fake Coingecko client returning two points per requested window."""
+    def __init__(self):
+        self.range_calls = []
+        self.chart_calls = []
+    def market_chart(self, cg_id, vs_currency, days="max"):
+        self.chart_calls.append((cg_id, vs_currency))
+        return {"prices": []}
+    def market_chart_range(self, cg_id, vs_currency, from_ts, to_ts):
+        self.range_calls.append((cg_id, vs_currency, from_ts, to_ts))
+        # One point exactly at from_ts (already stored) and one after it
+        return {"prices": [[from_ts * 1000, 1.0], [(from_ts + 3600) * 1000, 2.0]]}
+
+
+def test_plan_incremental_skips_fresh_series(test_db, sample_assets, monkeypatch):
+    _use_db(monkeypatch, test_db)
+    now = _naive_now()
+    btc, eth, usdc = (next(a for a in sample_assets if a.symbol == s) for s in ("BTC", "ETH", "USDC"))
+    test_db.add(Price(asset_id=btc.id, ccy="USD", price=1.0, at=now - timedelta(minutes=5)))
+    test_db.add(Price(asset_id=eth.id, ccy="USD", price=1.0, at=now - timedelta(days=2)))
+    test_db.add(FxRate(base_ccy="BTC", quote_ccy="USD", rate=1.0, at=now - timedelta(minutes=5)))
+    test_db.commit()
+    id_map = {"bitcoin": btc.id, "ethereum": eth.id, "usd-coin": usdc.id}
+
+    plan = plan_incremental(["bitcoin", "ethereum", "usd-coin"], id_map, "365", now=now)
+
+    assert "bitcoin" in plan.skipped and "BTCUSD" in plan.skipped
+    assert plan.asset_since == {"ethereum": now - timedelta(days=2), "usd-coin": None}
+    assert plan.fx_since == {"GBP": None}
+
+
+def test_incremental_backfill_fetches_only_missing_range(test_db, sample_assets, monkeypatch):
+    _use_db(monkeypatch, test_db)
+    now = _naive_now()
+    eth = next(a for a in sample_assets if a.symbol == "ETH")
+    last = now - timedelta(hours=3)
+    test_db.add(Price(asset_id=eth.id, ccy="USD", price=1.0, at=last))
+    for base in ("GBP", "BTC"):
+        test_db.add(FxRate(base_ccy=base, quote_ccy="USD", rate=1.0, at=now))
+    test_db.commit()
+
+    client = RangeClient()
+    compacted = []
+    monkeypatch.setattr("balancer.backfill.ids_from_positions", lambda: ["ethereum"])
+    monkeypatch.setattr("balancer.backfill._upsert_assets_by_ids", lambda ids: {"ethereum": eth.id})
+    monkeypatch.setattr("balancer.backfill.CoingeckoClient", lambda: client)
+    monkeypatch.setattr("balancer.backfill.compact_all", lambda: compacted.append(True))
+
+    backfill_prices(days="365", incremental=True)
+
+    assert client.chart_calls == []
+    assert len(client.range_calls) == 1
+    cg_id, vs, from_ts, _ = client.range_calls[0]
+    assert (cg_id, vs, from_ts) == ("ethereum", "usd", _to_ts(last))
+    # The point at the old watermark is not re-inserted
+    rows = test_db.query(Price).filter(Price.asset_id == eth.id).order_by(Price.at).all()
+    assert [r.price for r in rows] == [1.0, 2.0]
+    assert compacted == [True]
+
+
+def test_incremental_backfill_noop_when_up_to_date(test_db, sample_assets, monkeypatch):
+    _use_db(monkeypatch, test_db)
+    now = _naive_now()
+    eth = next(a for a in sample_assets if a.symbol == "ETH")
+    test_db.add(Price(asset_id=eth.id, ccy="USD", price=1.0, at=now))
+    for base in ("GBP", "BTC"):
+        test_db.add(FxRate(base_ccy=base, quote_ccy="USD", rate=1.0, at=now))
+    test_db.commit()
+
+    client = RangeClient()
+    compacted = []
+    monkeypatch.setattr("balancer.backfill.ids_from_positions", lambda: ["ethereum"])
+    monkeypatch.setattr("balancer.backfill._upsert_assets_by_ids", lambda ids: {"ethereum": eth.id})
+    monkeypatch.setattr("balancer.backfill.CoingeckoClient", lambda: client)
+    monkeypatch.setattr("balancer.backfill.compact_all", lambda: compacted.append(True))
+
+    backfill_prices(days="365", incremental=True)
+
+    assert client.range_calls == [] and client.chart_calls == []
+    assert compacted == []
+
+
+class FlakyClient(RangeClient):
+    """Full-window charts; fails for ids in ``broken`` until they are removed."""
+    def __init__(self, broken):
+        super().__init__()
+        self.broken = set(broken)
+        self.days = []
+    def market_chart(self, cg_id, vs_currency, days="max"):
+        self.chart_calls.append((cg_id, vs_currency))
+        self.days.append(days)
+        if cg_id in self.broken:
+            raise RuntimeError("boom")
+        return {"prices": [[1_700_000_000_000, 2.0]]}
+
+
+def test_backfill_resume_retries_only_failed_tasks(test_db, sample_assets, monkeypatch):
+    from balancer.models import BackfillJob, BackfillTask
+
+    _use_db(monkeypatch, test_db)
+    btc, eth = (next(a for a in sample_assets if a.symbol == s) for s in ("BTC", "ETH"))
+    client = FlakyClient(broken={"ethereum"})
+    monkeypatch.setattr("balancer.backfill.ids_from_positions", lambda: ["bitcoin", "ethereum"])
+    monkeypatch.setattr("balancer.backfill._upsert_assets_by_ids", lambda ids: {"bitcoin": btc.id, "ethereum": eth.id})
+    monkeypatch.setattr("balancer.backfill.CoingeckoClient", lambda: client)
+    monkeypatch.setattr("balancer.backfill.compact_all", lambda: None)
+
+    first = backfill_prices(days="30")
+    assert first["status"] == "failed" and first["failed"] == ["asset:ethereum"]
+    task = test_db.query(BackfillTask).filter_by(key="asset:ethereum").one()
+    assert task.attempts == 1 and "boom" in task.error
+    # Data for completed tasks is kept
+    assert test_db.query(Price).filter(Price.asset_id == btc.id).count() == 1
+
+    client.broken.clear()
+    client.chart_calls.clear()
+    second = backfill_prices(days="30", resume=True)
+
+    assert second["job_id"] == first["job_id"] and second["status"] == "done"
+    assert client.chart_calls == [("ethereum", "usd")]
+    assert test_db.query(Price).filter(Price.asset_id == eth.id).count() == 1
+    assert test_db.query(Price).filter(Price.asset_id == btc.id).count() == 1
+    assert test_db.query(BackfillJob).count() == 1
+
+
+def test_backfill_resume_keeps_the_journalled_range(test_db, sample_assets, monkeypatch):
+    from balancer.models import BackfillJob
+
+    _use_db(monkeypatch, test_db)
+    btc = next(a for a in sample_assets if a.symbol == "BTC")
+    client = FlakyClient(broken={"bitcoin"})
+    monkeypatch.setattr("balancer.backfill.ids_from_positions", lambda: ["bitcoin"])
+    monkeypatch.setattr("balancer.backfill._upsert_assets_by_ids", lambda ids: {"bitcoin": btc.id})
+    monkeypatch.setattr("balancer.backfill.CoingeckoClient", lambda: client)
+    monkeypatch.setattr("balancer.backfill.compact_all", lambda: None)
+
+    first = backfill_prices(days="max")
+    assert first["status"] == "failed"
+    job_days = test_db.get(BackfillJob, first["job_id"]).days
+
+    client.broken.clear()
+    client.days.clear()
+    second = backfill_prices(days="30", resume=True)
+
+    # The resumed task fetches the job's range, not the caller's
+    assert second["job_id"] == first["job_id"] and second["status"] == "done"
+    assert client.days and set(client.days) == {job_days} and job_days != "30"
+
+
+def test_backfill_resume_without_open_job_starts_new(test_db, sample_assets, monkeypatch):
+    _use_db(monkeypatch, test_db)
+    btc = next(a for a in sample_assets if a.symbol == "BTC")
+    client = FlakyClient(broken=())
+    monkeypatch.setattr("balancer.backfill.ids_from_positions", lambda: ["bitcoin"])
+    monkeypatch.setattr("balancer.backfill._upsert_assets_by_ids", lambda ids: {"bitcoin": btc.id})
+    monkeypatch.setattr("balancer.backfill.CoingeckoClient", lambda: client)
+    monkeypatch.setattr("balancer.backfill.compact_all", lambda: None)
+
+    done = backfill_prices(days="30")
+    again = backfill_prices(days="30", resume=True)
+
+    assert done["status"] == "done" and again["job_id"] != done["job_id"]
+    assert again["tasks"] == 3
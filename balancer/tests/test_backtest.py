@@ -0,0 +1,132 @@
+"""Tests for the vectorised rules backtester."""
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from balancer.backtest import BacktestConfig, History, config_grid, run_backtest, simulate
+from balancer.bulk import insert_fx, insert_prices
+from balancer.compaction import compact_all
+from balancer.db import Base
+from balancer.models import Asset, Portfolio, Position, Target
+from balancer.rules_engine import PortfolioState
+
+
+START = datetime(2025, 1, 1)
+DAYS = 10
+
+
+def _engine(tmp_path, btc_prices, eth_price=100.0, targets=False):
+    engine = create_engine(f"sqlite:///{tmp_path / 'bt.db'}")
+    Base.metadata.create_all(engine)
+    with sessionmaker(bind=engine)() as db:
+        pf = Portfolio(name="Default")
+        btc, eth = Asset(symbol="BTC", name="Bitcoin"), Asset(symbol="ETH", name="Ethereum")
+        db.add_all([pf, btc, eth])
+        db.flush()
+        db.add(Position(portfolio_id=pf.id, asset_id=btc.id, coins=1.0, avg_cost_ccy="GBP", avg_cost_per_unit=8000.0))
+        db.add(Position(portfolio_id=pf.id, asset_id=eth.id, coins=100.0, avg_cost_ccy="USD", avg_cost_per_unit=100.0))
+        if targets:
+            db.add(Target(portfolio_id=pf.id, asset_id=btc.id, target_weight=0.5, drift_band=0.1, min_trade_usd=10.0))
+            db.add(Target(portfolio_id=pf.id, asset_id=eth.id, target_weight=0.5, drift_band=0.1, min_trade_usd=10.0))
+        db.commit()
+    rows = []
+    for d, p in enumerate(btc_prices):
+        for h in (6, 18):
+            rows.append((1, "USD", p, START + timedelta(days=d, hours=h)))
+            rows.append((2, "USD", eth_price, START + timedelta(days=d, hours=h)))
+    with engine.begin() as conn:
+        insert_prices(conn, rows)
+        # 1 GBP = 1.25 USD, so BTC costs $10k
+        insert_fx(conn, [("GBP", "USD", 1.25, START + timedelta(hours=1))])
+    return engine
+
+
+def _run(engine, configs, tier="day"):
+    return run_backtest("Default", START, START + timedelta(days=DAYS), tier, configs, bind=engine)
+
+
+def test_ladder_sells_and_cooloff(tmp_path):
+    # BTC doubles on day 2 and stays there
+    engine = _engine(tmp_path, [10000.0, 10000.0] + [20000.0] * (DAYS - 2))
+    configs = config_grid(multiples=[(2, 3)], cooloff_days=[30, 3])
+    report = _run(engine, configs)
+    assert report["steps"] == DAYS and report["configs"] == 2
+    once, repeated = report["results"]
+
+    # One 2x alert selling 33% at a $10k gain per coin
+    assert once["take_profit_alerts"] == 1
+    assert once["realised_usd"] == pytest.approx(0.33 * 10000.0)
+    assert once["turnover_usd"] == pytest.approx(0.33 * 20000.0)
+    assert once["final_mv_usd"] == pytest.approx(0.67 * 20000.0 + 100 * 100.0)
+    assert once["cash_usd"] == pytest.approx(once["turnover_usd"])
+    # A 3-day cool-off includes its last day (as in rules.py), so it re-fires on days 2 and 6
+    assert repeated["take_profit_alerts"] == 2
+    assert repeated["realised_usd"] > once["realised_usd"]
+
+
+def test_drift_rebalances_to_target(tmp_path):
+    engine = _engine(tmp_path, [10000.0] * 3 + [30000.0] * (DAYS - 3), targets=True)
+    no_ladder = [(100,)]
+    grid = config_grid(multiples=no_ladder, drift_band=[0.1, 0.9], min_trade_usd=[10.0], band_fraction=[0.0, 0.5])
+    to_target, mid_band, loose, _ = _run(engine, grid)["results"]
+    # 50/50 at the start; BTC tripling moves it to 75% and one cash-neutral pair of trades fixes it
+    assert to_target["rebalance_alerts"] == 2 and to_target["trades"] == 2
+    assert to_target["turnover_usd"] == pytest.approx(2 * 10000.0)
+    assert to_target["cash_usd"] == pytest.approx(0.0)
+    # Landing halfway inside the band (55/45 of $40k) trades less
+    assert mid_band["trades"] == 2
+    assert mid_band["turnover_usd"] == pytest.approx(2 * 8000.0)
+    assert loose["rebalance_alerts"] == 0 and loose["turnover_usd"] == 0.0
+
+
+def test_grid_matches_single_runs_and_tiers(tmp_path, monkeypatch):
+    prices = [10000.0, 15000.0, 21000.0, 18000.0, 31000.0, 26000.0, 52000.0, 40000.0, 45000.0, 60000.0]
+    engine = _engine(tmp_path, prices, targets=True)
+    grid = config_grid(multiples=[(2, 3, 5), (1.5, 2)], cooloff_days=[0.5, 2], drift_band=[None, 0.05], min_trade_usd=[None, 1000.0])
+    batch = _run(engine, grid)["results"]
+    for cfg, res in zip(grid, batch):
+        assert _run(engine, [cfg])["results"][0] == res
+
+    # Rolled-up hourly candles give the same day closes as the raw rows
+    monkeypatch.setattr("balancer.rollups.ROLLUP_HOURLY_DAYS", 60)
+    compact_all(now=START + timedelta(days=DAYS + 30), bind=engine)
+    assert _run(engine, grid)["results"] == batch
+    hourly = _run(engine, [BacktestConfig((2.0, 3.0, 5.0), 1.0)], tier="hour")
+    assert hourly["steps"] == DAYS * 24
+    assert hourly["results"][0]["take_profit_alerts"] > 0
+
+    # With the default retention those hourly buckets are dropped
+    monkeypatch.undo()
+    compact_all(now=START + timedelta(days=DAYS + 30), bind=engine)
+    with pytest.raises(ValueError, match="hour closes are kept"):
+        _run(engine, [BacktestConfig((2.0, 3.0, 5.0), 1.0)], tier="hour")
+    assert _run(engine, grid)["results"] == batch
+
+
+def test_large_grid_rows_run_independently():
+    # The loop only works on the config rows that trade at each step; every row
+    # of a 360-config grid must still match running that config alone
+    n, steps = 30, 120
+    rng = np.random.default_rng(3)
+    px = 100.0 * np.exp(np.cumsum(rng.normal(0.0, 0.04, (steps, n)), axis=0))
+    times = np.datetime64("2024-01-01T00:00", "us") + np.arange(steps) * np.timedelta64(12, "h")
+    hist = History(tier="hour", times=times, px_usd=px, gbp_usd=np.full(steps, 1.25))
+    state = PortfolioState(
+        portfolio_id=1, asset_ids=np.arange(1, n + 1), symbols=[f"A{i}" for i in range(1, n + 1)],
+        coins=np.full(n, 10.0), avg_cost=np.full(n, 90.0), cost_is_gbp=np.arange(n) % 3 == 0,
+        px_usd=px[0], px_gbp=px[0] / 1.25, gbp_usd=1.25, has_target=np.arange(n) % 5 != 0,
+        target_weight=np.full(n, 1.0 / n), drift_band=np.full(n, 0.01), min_trade_usd=np.full(n, 10.0),
+        multiples=[2.0, 3.0, 5.0], last_alert_at=np.full((n, 3), np.nan), now=START, cooloff=timedelta(days=7),
+    )
+    grid = config_grid(multiples=[(2, 3, 5), (1.5, 2), (3, 5, 10)], cooloff_days=[1, 3, 7, 14],
+                       drift_band=[0.005, 0.01, 0.02, 0.05, 0.1], min_trade_usd=[10, 100, 1000],
+                       band_fraction=[0, 0.5])
+    assert len(grid) == 360
+    batch = simulate(state, hist, grid)
+    assert sum(r["take_profit_alerts"] for r in batch) > 0 and sum(r["rebalance_alerts"] for r in batch) > 0
+    for i in range(0, len(grid), 7):
+        single = simulate(state, hist, [grid[i]])[0]
+        assert single == batch[i]
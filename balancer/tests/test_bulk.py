@@ -0,0 +1,51 @@
+"""Tests for the bulk price / FX writer and the price uniqueness migration."""
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+
+from balancer.bulk import insert_prices, insert_fx
+from balancer.models import Price, FxRate
+from balancer.schema import ensure_schema
+
+
+def test_insert_prices_batches_and_skips_existing(test_db, sample_assets):
+    btc = next(a for a in sample_assets if a.symbol == "BTC")
+    start = datetime(2024, 1, 1)
+    rows = [(btc.id, "USD", float(i), start + timedelta(hours=i)) for i in range(5)]
+
+    assert insert_prices(test_db, rows, batch_size=2) == 5
+    # Same keys again (different prices) are ignored, new ones are added
+    assert insert_prices(test_db, rows[3:] + [(btc.id, "USD", 9.0, start + timedelta(hours=9))]) == 1
+    test_db.commit()
+
+    stored = test_db.query(Price).filter(Price.asset_id == btc.id).order_by(Price.at).all()
+    assert [p.price for p in stored] == [0.0, 1.0, 2.0, 3.0, 4.0, 9.0]
+
+
+def test_insert_fx_skips_existing_pair_time(test_db):
+    at = datetime(2024, 1, 1)
+    assert insert_fx(test_db, [("GBP", "USD", 1.25, at), ("BTC", "USD", 60000.0, at)]) == 2
+    assert insert_fx(test_db, [("GBP", "USD", 1.30, at)]) == 0
+    test_db.commit()
+    assert test_db.query(FxRate).filter_by(base_ccy="GBP").one().rate == 1.25
+
+
+def test_ensure_schema_dedupes_before_adding_price_key(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        # Pre-migration prices table without the unique key
+        conn.exec_driver_sql(
+            "CREATE TABLE prices (id INTEGER PRIMARY KEY, asset_id INTEGER NOT NULL, ccy VARCHAR NOT NULL, price FLOAT NOT NULL, at DATETIME)"
+        )
+        conn.exec_driver_sql(
+            "INSERT INTO prices (asset_id, ccy, price, at) VALUES "
+            "(1, 'USD', 1.0, '2024-01-01 00:00:00.000000'), (1, 'USD', 2.0, '2024-01-01 00:00:00.000000'), (1, 'USD', 3.0, '2024-01-01 01:00:00.000000')"
+        )
+
+    ensure_schema(engine)
+    ensure_schema(engine)  # idempotent
+
+    with engine.begin() as conn:
+        rows = conn.exec_driver_sql("SELECT price FROM prices ORDER BY at").fetchall()
+        assert [r[0] for r in rows] == [2.0, 3.0]
+        assert insert_prices(conn, [(1, "USD", 5.0, datetime(2024, 1, 1, 1))]) == 0
@@ -0,0 +1,130 @@
+"""Tests for the precomputed price_changes table."""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, event, text
+
+from balancer.archive import archive_cold
+from balancer.bulk import insert_fx, insert_prices
+from balancer.changes import WINDOWS, compute_changes
+from balancer.compaction import compact_all
+from balancer.db import Base
+
+NOW = datetime(2025, 6, 1, 12, 0)
+
+
+def _engine(tmp_path, n_assets=3):
+    engine = create_engine(f"sqlite:///{tmp_path / 'changes.db'}")
+    Base.metadata.create_all(engine)
+    prices, fx = [], []
+    # Hourly for two days, then daily back 400 days: the shape compaction leaves
+    times = [NOW - timedelta(hours=h) for h in range(48)] + [NOW - timedelta(days=d, hours=7) for d in range(2, 400)]
+    for t in times:
+        age = (NOW - t).total_seconds() / 86400
+        fx.append(("GBP", "USD", 1.2 + 0.0005 * age, t))
+        fx.append(("BTC", "USD", 60000.0 - 50 * age, t))
+        for a in range(1, n_assets + 1):
+            prices.append((a, "USD", 100.0 * a + 0.3 * age * a, t))
+    # Asset 2 only has a week of history
+    prices = [p for p in prices if p[0] != 2 or NOW - p[3] < timedelta(days=7, hours=12)]
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO assets (id, symbol, name, active) VALUES (1, 'A', 'A', 1), (2, 'B', 'B', 1), (3, 'C', 'C', 1)"))
+        insert_prices(conn, prices)
+        insert_fx(conn, fx)
+    return engine
+
+
+def _route_style(conn, asset_id, ccy):
+    """The per-asset lookups /api/changes used to run, for comparison."""
+    def usd_at(at, first=False):
+        order = "ASC" if first else "DESC"
+        bound = "" if first else "AND at <= :at"
+        return conn.execute(text(f"SELECT price, at FROM prices WHERE asset_id = :a AND ccy = 'USD' {bound} ORDER BY at {order} LIMIT 1"),
+                            {"a": asset_id, "at": at}).first()
+
+    def fx_at(at):
+        row = conn.execute(text("SELECT rate FROM fx_rates WHERE base_ccy = :c AND quote_ccy = 'USD' AND at <= :at ORDER BY at DESC LIMIT 1"),
+                           {"c": ccy, "at": at}).first()
+        return row[0] if row else None
+
+    def conv(usd, at):
+        if usd is None:
+            return None
+        if ccy == "USD":
+            return usd
+        rate = fx_at(at)
+        return usd / rate if rate else None
+
+    def pct(latest, ref):
+        return (latest - ref) / ref * 100 if ref else None
+
+    latest_usd, latest_at = conn.execute(text("SELECT price, at FROM latest_prices WHERE asset_id = :a AND ccy = 'USD'"), {"a": asset_id}).first()
+    latest = conv(latest_usd, latest_at)
+    out = {}
+    for name, w in WINDOWS.items():
+        at = (NOW - w).strftime("%Y-%m-%d %H:%M:%S.%f")
+        row = usd_at(at)
+        out[name] = pct(latest, conv(row[0] if row else None, at))
+    first = usd_at(None, first=True)
+    out["since_first"] = pct(latest, conv(first[0], first[1]))
+    return latest, out
+
+
+def test_changes_match_per_asset_lookups(tmp_path):
+    engine = _engine(tmp_path)
+    report = compute_changes(bind=engine)
+    assert report["currencies"] == ["BTC", "GBP", "USD"] and report["rows"] == 9
+    with engine.connect() as conn:
+        stored = {(r.asset_id, r.ccy): r for r in conn.execute(text("SELECT * FROM price_changes"))}
+        for (asset_id, ccy), row in stored.items():
+            latest, expected = _route_style(conn, asset_id, ccy)
+            assert row.latest == pytest.approx(latest)
+            for name, value in expected.items():
+                assert getattr(row, name) == (pytest.approx(value) if value is not None else None), (asset_id, ccy, name)
+    # Short history: no 30d+ reference, and since-first is the 7-day move
+    b = stored[(2, "USD")]
+    assert b.d7 is not None and b.d30 is None and b.d365 is None
+    assert b.since_first == pytest.approx(b.d7, rel=0.1)
+    assert stored[(1, "USD")].d1 == pytest.approx(-0.3 / 100.3 * 100)
+
+
+def test_statements_do_not_grow_with_assets(tmp_path):
+    engine = _engine(tmp_path, n_assets=3)
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *a: statements.append(a[2]))
+    compute_changes(bind=engine)
+    small = len(statements)
+
+    with engine.begin() as conn:
+        for a in range(4, 40):
+            conn.execute(text("INSERT INTO assets (id, symbol, name, active) VALUES (:i, :s, :s, 1)"), {"i": a, "s": f"X{a}"})
+        insert_prices(conn, [(a, "USD", 10.0, NOW - timedelta(hours=h)) for a in range(4, 40) for h in range(3)])
+    statements.clear()
+    report = compute_changes(bind=engine)
+    assert report["rows"] == 39 * 3
+    assert len(statements) == small
+
+
+def test_since_first_survives_compaction_and_archiving(tmp_path):
+    engine = _engine(tmp_path)
+    compute_changes(bind=engine)
+    query = "SELECT asset_id, ccy, since_first FROM price_changes ORDER BY asset_id, ccy"
+    with engine.connect() as conn:
+        before = conn.exec_driver_sql(query).fetchall()
+        first_at, first = conn.exec_driver_sql(
+            "SELECT at, price FROM prices WHERE asset_id = 1 AND ccy = 'USD' ORDER BY at LIMIT 1"
+        ).one()
+
+    compact_all(now=NOW, bind=engine)
+    assert archive_cold(now=NOW, bind=engine, archive_dir=tmp_path / "arch", after_days=100)["rows"] > 0
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT MIN(at) FROM prices WHERE asset_id = 1").scalar() > first_at
+
+    compute_changes(bind=engine)
+    with engine.connect() as conn:
+        after = conn.exec_driver_sql(query).fetchall()
+        latest = conn.exec_driver_sql("SELECT price FROM latest_prices WHERE asset_id = 1 AND ccy = 'USD'").scalar()
+    assert [r[:2] for r in after] == [r[:2] for r in before]
+    for a, b in zip(after, before):
+        assert a[2] == pytest.approx(b[2]), a
+    assert dict((r[:2], r[2]) for r in after)[(1, "USD")] == pytest.approx((latest - first) / first * 100)
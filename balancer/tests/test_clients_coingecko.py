@@ -28,3 +28,129 @@ def test_coingecko_markets_includes_params(monkeypatch):
     assert params.get("vs_currency") == "gbp"
     if os.getenv("COINGECKO_API_KEY"):
         assert "x_cg_demo_api_key" in params
+
+
+def test_async_client_delegates_and_caps_concurrency():
+    import asyncio
+    import threading
+    import time as _time
+    from balancer.clients import AsyncCoingeckoClient
+
+    lock = threading.Lock()
+    state = {"active": 0, "peak": 0}
+
+    class SlowClient:
+        def market_chart(self, cg_id, vs_currency, days="max"):
+            with lock:
+                state["active"] += 1
+                state["peak"] = max(state["peak"], state["active"])
+            _time.sleep(0.02)
+            with lock:
+                state["active"] -= 1
+            return {"prices": [[0, 1.0]], "id": cg_id}
+
+    async def run():
+        ac = AsyncCoingeckoClient(client=SlowClient(), concurrency=2)
+        return await asyncio.gather(*(ac.market_chart(f"c{i}", "usd", days="1") for i in range(6)))
+
+    out = asyncio.run(run())
+    assert [o["id"] for o in out] == [f"c{i}" for i in range(6)]
+    assert state["peak"] <= 2
+
+
+def test_async_markets_bounds_requests_across_chunks():
+    import asyncio
+    import threading
+    import time as _time
+    from balancer.clients import AsyncCoingeckoClient
+
+    lock = threading.Lock()
+    state = {"active": 0, "peak": 0}
+
+    class SlowHttp:
+        def get(self, url, params=None, headers=None):
+            with lock:
+                state["active"] += 1
+                state["peak"] = max(state["peak"], state["active"])
+            _time.sleep(0.02)
+            with lock:
+                state["active"] -= 1
+            return FakeResp([{"id": i, "current_price": 1.0} for i in params["ids"].split(",")])
+
+    async def run():
+        ac = AsyncCoingeckoClient(client=CoingeckoClient(http=SlowHttp()), concurrency=2)
+        # Three batches of three one-id chunks, all gathered at once
+        return await asyncio.gather(*(ac.markets([f"b{b}-{i}" for i in range(3)], "usd", per_page=1) for b in range(3)))
+
+    out = asyncio.run(run())
+    assert [[r["id"] for r in rows] for rows in out] == [[f"b{b}-{i}" for i in range(3)] for b in range(3)]
+    assert state["peak"] <= 2
+
+
+def test_async_client_keeps_401_fallback():
+    import asyncio
+    from requests import HTTPError
+    from balancer.clients import AsyncCoingeckoClient
+
+    class Resp401:
+        status_code = 401
+
+    class FlakyHttp(FakeHttp):
+        def __init__(self):
+            super().__init__()
+            self.urls = []
+        def get(self, url, params=None, headers=None):
+            self.urls.append(url)
+            if "www.coingecko.com" not in url:
+                raise HTTPError(response=Resp401())
+            return FakeResp({"prices": [[1, 2.0]]})
+
+    http = FlakyHttp()
+    ac = AsyncCoingeckoClient(client=CoingeckoClient(http=http), concurrency=1)
+    out = asyncio.run(ac.market_chart("bitcoin", "usd", days="1"))
+    assert out == {"prices": [[1, 2.0]]}
+    assert http.urls[-1].startswith("https://www.coingecko.com/api/v3/")
+
+
+def test_coingecko_simple_price_params():
+    fake_http = FakeHttp()
+    c = CoingeckoClient(http=fake_http)
+    assert c.simple_price(["bitcoin", "usd-coin"], ("USD", "GBP", "BTC")) == {}
+    params = fake_http.last["params"]
+    assert fake_http.last["url"].endswith("/simple/price")
+    assert params["ids"] == "bitcoin,usd-coin"
+    assert params["vs_currencies"] == "usd,gbp,btc"
+
+
+class PagingHttp:
+    """Serves coins/markets from a fixed universe honouring ids/per_page/page."""
+    def __init__(self, page_cap: int | None = None):
+        self.calls = []
+        self.page_cap = page_cap
+    def get(self, url, params=None, headers=None):
+        params = dict(params or {})
+        self.calls.append(params)
+        ids = params["ids"].split(",")
+        size = min(params["per_page"], self.page_cap or params["per_page"])
+        start = (params["page"] - 1) * size
+        rows = [{"id": i, "current_price": 1.0} for i in ids[start:start + size]]
+        return FakeResp(rows)
+
+
+def test_coingecko_markets_chunks_by_per_page():
+    http = PagingHttp()
+    c = CoingeckoClient(http=http)
+    ids = [f"coin-{i}" for i in range(5)]
+    out = c.markets(ids, "usd", per_page=2)
+    assert [r["id"] for r in out] == ids
+    assert sorted(p["ids"] for p in http.calls) == ["coin-0,coin-1", "coin-2,coin-3", "coin-4"]
+    # Every chunk is satisfied by its first page; no wasted follow-up requests
+    assert all(p["page"] == 1 and p["per_page"] == 2 for p in http.calls)
+
+
+def test_coingecko_markets_chunk_follows_pagination():
+    http = PagingHttp()
+    c = CoingeckoClient(http=http)
+    out = c._markets_chunk(["a", "b", "c"], "usd", per_page=2)
+    assert [r["id"] for r in out] == ["a", "b", "c"]
+    assert [p["page"] for p in http.calls] == [1, 2]
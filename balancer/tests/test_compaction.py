@@ -0,0 +1,90 @@
+"""Tests for watermark-based incremental compaction."""
+import random
+from datetime import datetime, timedelta
+
+from balancer.bulk import insert_prices, insert_fx
+from balancer.compaction import compact_all, compact_prices
+from balancer.models import CompactionState
+
+
+NOW = datetime(2025, 6, 1, 12, 30)
+
+
+def _series(start, end, step, seed):
+    rng = random.Random(seed)
+    out, t = [], start
+    while t < end:
+        out.append((t, rng.uniform(1, 100)))
+        t += step
+    return out
+
+
+def _write(engine, points):
+    with engine.begin() as conn:
+        insert_prices(conn, [(aid, "USD", p, t) for aid in (1, 2) for t, p in points])
+        insert_fx(conn, [("GBP", "USD", p, t) for t, p in points])
+
+
+def _rows(engine):
+    with engine.connect() as conn:
+        prices = conn.exec_driver_sql("SELECT asset_id, ccy, price, at FROM prices ORDER BY 1, 2, 4").fetchall()
+        fx = conn.exec_driver_sql("SELECT base_ccy, quote_ccy, rate, at FROM fx_rates ORDER BY 1, 2, 4").fetchall()
+    return prices, fx
+
+
+def _run_pair(make_engine, now):
+    t0 = now - timedelta(days=2)
+    history = _series(now - timedelta(days=400), t0, timedelta(hours=3), seed=1)
+    recent = _series(t0, now, timedelta(minutes=5), seed=2)
+
+    inc = make_engine(f"inc-{now:%H%M}.db")
+    _write(inc, history)
+    assert compact_all(now=t0, bind=inc)["prices"]["mode"] == "full"
+    _write(inc, recent)
+    assert compact_all(now=now, bind=inc)["prices"]["mode"] == "incremental"
+
+    ref = make_engine(f"ref-{now:%H%M}.db")
+    _write(ref, history + recent)
+    compact_all(now=now, full=True, bind=ref)
+    return _rows(inc), _rows(ref)
+
+
+def test_incremental_matches_full_compaction(make_engine):
+    # Tier edges on bucket edges: identical to a from-scratch full pass
+    inc, ref = _run_pair(make_engine, datetime(2025, 6, 1))
+    assert inc == ref
+
+
+def test_incremental_never_keeps_more_than_full(make_engine):
+    # Mid-bucket tier edges: a full pass may keep the max of a clipped partial
+    # bucket that an earlier pass already removed; never the other way round
+    (inc_p, inc_fx), (ref_p, ref_fx) = _run_pair(make_engine, NOW)
+    assert set(inc_p) <= set(ref_p) and set(inc_fx) <= set(ref_fx)
+    assert len(ref_p) - len(inc_p) <= 2
+
+
+def test_incremental_pass_touches_only_new_buckets(make_engine):
+    engine = make_engine("touch.db")
+    _write(engine, _series(NOW - timedelta(days=30), NOW, timedelta(minutes=10), seed=3))
+    compact_prices(now=NOW, bind=engine)
+
+    # One new hour of 5-minute points, 10 minutes later
+    later = NOW + timedelta(minutes=10)
+    _write(engine, _series(NOW, later, timedelta(minutes=5), seed=4))
+    report = compact_prices(now=later, bind=engine)
+
+    assert report["mode"] == "incremental"
+    assert report["hour"]["buckets"] == 2  # (asset 1, 12:00) and (asset 2, 12:00)
+    assert report["hour"]["deleted"] == 4  # 12:20 and 12:30 superseded by 12:35, per asset
+    assert report["month"]["buckets"] == 0
+    assert {"deleted", "seconds"} <= set(report["day"])
+    with engine.connect() as conn:
+        state = conn.execute(CompactionState.__table__.select()).mappings().first()
+        assert state["last_id"] == report["watermark"] > 0
+
+
+def test_clock_moving_backwards_forces_full_pass(make_engine):
+    engine = make_engine("back.db")
+    _write(engine, _series(NOW - timedelta(days=3), NOW, timedelta(hours=1), seed=5))
+    compact_prices(now=NOW, bind=engine)
+    assert compact_prices(now=NOW - timedelta(hours=2), bind=engine)["mode"] == "full"
@@ -0,0 +1,94 @@
+"""Tests for the incrementally maintained coverage bitmaps."""
+import random
+from datetime import datetime, timedelta
+
+from sqlalchemy.orm import sessionmaker
+
+from balancer import repair
+from balancer.buckets import day_bucket, hour_bucket
+from balancer.bulk import insert_fx, insert_prices
+from balancer.compaction import compact_all
+from balancer.coverage import count_present, load_coverage, merge, rebuild_coverage
+from balancer.models import Price
+
+NOW = datetime(2025, 6, 1, 12, 30)
+
+
+def test_merge_matches_a_set_and_keeps_the_newest_span():
+    rng = random.Random(5)
+    base, value, seen = None, 0, set()
+    for _ in range(200):
+        batch = {rng.randint(1000, 1150) for _ in range(rng.randint(1, 6))}
+        base, value = merge(base, value, batch, 50)
+        seen |= batch
+        top = max(seen)
+        kept = {b for b in seen if b > top - 50}
+        assert value >> (top - base + 1) == 0
+        for lo, hi in ((top - 49, top), (top - 9, top), (top - 30, top - 20)):
+            assert count_present(base, value, lo, hi) == len({b for b in kept if lo <= b <= hi})
+
+
+def test_writes_keep_coverage_equal_to_a_rebuild(make_engine):
+    engine = make_engine()
+    rng = random.Random(7)
+    ats = [NOW - timedelta(minutes=rng.randint(0, 60 * 24 * 500)) for _ in range(3000)]
+    with engine.begin() as conn:
+        for i in range(0, len(ats), 400):
+            chunk = ats[i:i + 400]
+            insert_prices(conn, [(1 + j % 2, "USD", 1.0 + j, at) for j, at in enumerate(chunk)])
+            insert_fx(conn, [("GBP", "USD", 1.25, at) for at in chunk[::3]])
+    # ORM inserts go through the models listeners
+    with sessionmaker(bind=engine)() as db:
+        db.add(Price(asset_id=2, ccy="USD", price=9.0, at=NOW + timedelta(hours=1)))
+        db.commit()
+
+    with sessionmaker(bind=engine)() as db:
+        prices, fx = load_coverage(db, "prices"), load_coverage(db, "fx_rates")
+    with engine.begin() as conn:
+        rebuild_coverage(conn)
+    with sessionmaker(bind=engine)() as db:
+        assert load_coverage(db, "prices") == prices
+        assert load_coverage(db, "fx_rates") == fx
+
+    # Same counts as COUNT(DISTINCT bucket) over prices, before and after compaction
+    h, d = hour_bucket(NOW + timedelta(hours=1)), day_bucket(NOW)
+    def distinct(conn, aid, col, lo, hi):
+        return conn.exec_driver_sql(
+            f"SELECT COUNT(DISTINCT {col}) FROM prices WHERE asset_id = ? AND {col} BETWEEN ? AND ?",
+            (aid, lo, hi),
+        ).scalar()
+    for _ in range(2):
+        with engine.connect() as conn:
+            for aid in (1, 2):
+                hb, hv = prices[(aid, "USD", "hour")]
+                db_, dv = prices[(aid, "USD", "day")]
+                assert count_present(hb, hv, h - 23, h) == distinct(conn, aid, "hour_bucket", h - 23, h)
+                assert count_present(db_, dv, d - 364, d) == distinct(conn, aid, "day_bucket", d - 364, d)
+        compact_all(now=NOW, full=True, bind=engine)
+        with sessionmaker(bind=engine)() as db:
+            assert load_coverage(db, "prices") == prices
+
+
+def test_repair_fills_the_gaps_coverage_reports(make_engine, monkeypatch):
+    engine = make_engine()
+    Session = sessionmaker(bind=engine)
+    # Hourly data except a 5-hour hole; daily data for a year
+    hours = [NOW - timedelta(hours=i) for i in range(30) if not 3 <= i < 8]
+    days = [NOW - timedelta(days=i, hours=1) for i in range(1, 366)]
+    with engine.begin() as conn:
+        insert_prices(conn, [(aid, "USD", 1.0, at) for aid in (1, 2) for at in hours + days])
+        insert_fx(conn, [(b, "USD", 1.0, at) for b in ("GBP", "BTC") for at in hours + days])
+    monkeypatch.setattr("balancer.repair.SessionLocal", Session)
+
+    h = hour_bucket(NOW)
+    with Session() as db:
+        base, bits = load_coverage(db, "prices")[(1, "USD", "hour")]
+    assert count_present(base, bits, h - 23, h) == 19
+
+    repair.carry_forward_missing(now=NOW)
+    with Session() as db:
+        for key, (base, bits) in load_coverage(db, "prices").items():
+            if key[2] == "hour":
+                assert count_present(base, bits, h - 23, h) == 24
+        base, bits = load_coverage(db, "fx_rates")[("BTC", "USD", "hour")]
+        assert count_present(base, bits, h - 23, h) == 24
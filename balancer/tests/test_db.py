@@ -0,0 +1,46 @@
+"""Tests for the SQLite engine profile and maintenance hook."""
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from balancer.db import make_engine, maintenance
+
+
+def _pragma(conn, name):
+    return conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+
+
+def test_make_engine_applies_pragma_profile(tmp_path, monkeypatch):
+    monkeypatch.setattr("balancer.config.SQLITE_BUSY_TIMEOUT_MS", 1234)
+    eng = make_engine(str(tmp_path / "p.db"))
+    with eng.connect() as conn:
+        assert _pragma(conn, "journal_mode") == "wal"
+        assert _pragma(conn, "synchronous") == 1  # NORMAL
+        assert _pragma(conn, "busy_timeout") == 1234
+        assert _pragma(conn, "temp_store") == 2  # MEMORY
+        assert _pragma(conn, "cache_size") == -65536
+
+
+def test_readonly_engine_reads_but_cannot_write(tmp_path):
+    path = str(tmp_path / "ro.db")
+    with make_engine(path).begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE t (x INTEGER)")
+        conn.exec_driver_sql("INSERT INTO t VALUES (1)")
+
+    ro = make_engine(path, readonly=True)
+    with ro.connect() as conn:
+        assert conn.exec_driver_sql("SELECT x FROM t").scalar() == 1
+        assert _pragma(conn, "query_only") == 1
+        with pytest.raises(OperationalError):
+            conn.exec_driver_sql("INSERT INTO t VALUES (2)")
+
+
+def test_maintenance_checkpoints_wal(tmp_path):
+    eng = make_engine(str(tmp_path / "m.db"))
+    with eng.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE t (x INTEGER)")
+        conn.exec_driver_sql("INSERT INTO t VALUES (1)")
+
+    out = maintenance(eng, checkpoint_mode="truncate")
+
+    assert out["mode"] == "TRUNCATE" and out["busy"] == 0
+    assert not (tmp_path / "m.db-wal").exists() or (tmp_path / "m.db-wal").stat().st_size == 0
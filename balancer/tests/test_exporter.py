@@ -1,5 +1,8 @@
 """Tests for exporter module."""
 import json
+from datetime import datetime, UTC
+
+from balancer.models import Asset, FxRate, Portfolio, Position, Price
 from balancer.exporter import (
     latest_price_usd,
     latest_price_ccy,
@@ -126,3 +129,75 @@ def test_export_portfolio_json_totals(tmp_path, test_db, sample_portfolio, sampl
     total_mv_usd = sum(a["mv_usd"] for a in data["assets"])
     assert abs(data["total_mv_usd"] - total_mv_usd) < 0.01
 
+
+
+def _snapshot_db(tmp_path, monkeypatch):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from balancer.db import Base
+    engine = create_engine(f"sqlite:///{tmp_path / 'export.db'}")
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        pf = Portfolio(name="Default")
+        btc, eth = Asset(symbol="BTC", name="Bitcoin"), Asset(symbol="ETH", name="Ethereum")
+        db.add_all([pf, btc, eth])
+        db.flush()
+        db.add(Position(portfolio_id=pf.id, asset_id=btc.id, coins=1.0, avg_cost_ccy="GBP", avg_cost_per_unit=30000.0))
+        db.add(Position(portfolio_id=pf.id, asset_id=eth.id, coins=10.0, avg_cost_ccy="USD", avg_cost_per_unit=2000.0))
+        now = datetime.now(UTC)
+        db.add_all([
+            Price(asset_id=btc.id, ccy="USD", price=60000.0, at=now),
+            Price(asset_id=eth.id, ccy="GBP", price=2400.0, at=now),
+            FxRate(base_ccy="GBP", quote_ccy="USD", rate=1.25, at=now),
+            FxRate(base_ccy="BTC", quote_ccy="USD", rate=60000.0, at=now),
+        ])
+        db.commit()
+    monkeypatch.setattr("balancer.exporter.SessionLocal", Session)
+    return engine, Session
+
+
+def test_export_uses_one_query_and_matches_snapshot_path(tmp_path, monkeypatch):
+    from sqlalchemy import event
+    from balancer.exporter import export_portfolio_json
+    from balancer.latest import load_snapshot
+    engine, Session = _snapshot_db(tmp_path, monkeypatch)
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *a: statements.append(a[2]))
+    path = export_portfolio_json("Default", out_path=tmp_path / "a.json")
+    assert len(statements) == 1
+    data = json.loads(path.read_text())
+    btc, eth = data["assets"]
+    assert btc["cb_usd"] == 30000.0 * 1.25
+    assert eth["mv_usd"] == 10 * 2400.0 * 1.25 and eth["mv_btc"] == eth["mv_usd"] / 60000.0
+
+    # Valuing against a shared snapshot gives the same content
+    with Session() as db:
+        snap = load_snapshot(db)
+    other = export_portfolio_json("Default", snap=snap, out_path=tmp_path / "b.json")
+    assert json.loads(other.read_text())["version"] == data["version"]
+
+
+def test_export_skips_unchanged_and_replaces_atomically(tmp_path, monkeypatch):
+    import os
+    from balancer.exporter import export_portfolio_json
+    _, Session = _snapshot_db(tmp_path, monkeypatch)
+    out = tmp_path / "portfolio.json"
+    out.write_text("{half-writ")
+    export_portfolio_json("Default", out_path=out)
+    first = json.loads(out.read_text())
+    stat = os.stat(out)
+
+    export_portfolio_json("Default", out_path=out)
+    assert os.stat(out).st_mtime_ns == stat.st_mtime_ns and os.stat(out).st_ino == stat.st_ino
+    assert json.loads(out.read_text())["as_of"] == first["as_of"]
+
+    with Session() as db:
+        db.add(Price(asset_id=1, ccy="USD", price=61000.0, at=datetime.now(UTC)))
+        db.commit()
+    export_portfolio_json("Default", out_path=out)
+    second = json.loads(out.read_text())
+    assert second["version"] != first["version"] and second["total_mv_usd"] == first["total_mv_usd"] + 1000.0
+    # Written through a temp file that os.replace swapped in
+    assert os.stat(out).st_ino != stat.st_ino
+    assert list(tmp_path.glob("*.tmp")) == []
@@ -0,0 +1,37 @@
+"""Tests for health coverage checks (bucket-key based)."""
+from contextlib import contextmanager
+from datetime import datetime, timedelta, UTC
+
+from balancer.bulk import insert_prices, insert_fx
+from balancer.health import verify_health, report_24h_per_asset
+
+
+def _use_db(monkeypatch, test_db):
+    @contextmanager
+    def mock_session_local():
+        yield test_db
+    monkeypatch.setattr("balancer.health.SessionLocal", mock_session_local)
+
+
+def test_verify_health_counts_hourly_and_daily_buckets(test_db, sample_positions, sample_assets, monkeypatch):
+    _use_db(monkeypatch, test_db)
+    now = datetime.now(UTC).replace(tzinfo=None)
+    btc = next(a for a in sample_assets if a.symbol == "BTC")
+    # BTC: two points per hour for the last 24h and one per day for a year; others have nothing
+    hourly = [now - timedelta(minutes=30 * i) for i in range(47)]
+    daily = [now - timedelta(days=d, hours=1) for d in range(1, 365)]
+    insert_prices(test_db, [(btc.id, "USD", 1.0, at) for at in hourly + daily])
+    insert_fx(test_db, [("GBP", "USD", 1.27, at) for at in hourly + daily])
+    test_db.commit()
+
+    out = verify_health()
+
+    assert out["assets_total"] == 3
+    assert out["prices"] == {"hourly_24h_missing": 2, "daily_1y_missing": 2}
+    assert out["fx"]["GBPUSD"] == {"hourly_24h_missing": 0, "daily_1y_missing": 0}
+    assert out["fx"]["BTCUSD"] == {"hourly_24h_missing": 1, "daily_1y_missing": 1}
+
+    report = report_24h_per_asset()
+    assert [i["symbol"] for i in report["full"]] == ["BTC"]
+    assert report["full"][0]["buckets_24h"] in (24, 25)
+    assert report["total"] == 3
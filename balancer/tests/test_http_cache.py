@@ -0,0 +1,95 @@
+"""Tests for the HTTP response cache."""
+import requests
+
+from balancer.http_cache import ResponseCache
+from balancer.http_client import HttpClient
+
+
+def _resp(body: bytes, status: int = 200, headers=None, url="https://api.test/x") -> requests.Response:
+    r = requests.Response()
+    r.status_code = status
+    r._content = body
+    r.headers.update(headers or {})
+    r.url = url
+    return r
+
+
+class FakeSession:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = []
+    def get(self, url, params=None, headers=None, timeout=None):
+        self.calls.append({"url": url, "params": params, "headers": dict(headers or {})})
+        return self.responses.pop(0)
+
+
+def _client(tmp_path, responses, max_bytes=1_000_000):
+    cache = ResponseCache(path=tmp_path / "cache.db", max_bytes=max_bytes)
+    http = HttpClient(retries=0, cache=cache)
+    http.session = FakeSession(responses)
+    return http, cache
+
+
+def test_fresh_entry_served_without_request(tmp_path):
+    http, cache = _client(tmp_path, [_resp(b'{"a": 1}')])
+    assert http.get("https://api.test/x", params={"q": 1}, ttl=60).json() == {"a": 1}
+    assert http.get("https://api.test/x", params={"q": 1}, ttl=60).json() == {"a": 1}
+    assert len(http.session.calls) == 1
+    assert cache.stats["hits"] == 1 and cache.stats["misses"] == 1
+
+
+def test_params_are_part_of_key(tmp_path):
+    http, _ = _client(tmp_path, [_resp(b"1"), _resp(b"2")])
+    assert http.get("https://api.test/x", params={"q": 1}, ttl=60).content == b"1"
+    assert http.get("https://api.test/x", params={"q": 2}, ttl=60).content == b"2"
+
+
+def test_api_keys_not_stored(tmp_path):
+    url = "https://api.test/x?ids=btc&x_cg_demo_api_key=SECRET&api_key=FRED"
+    http, cache = _client(tmp_path, [_resp(b"1", url=url)])
+    http.get("https://api.test/x", params={"ids": "btc", "x_cg_demo_api_key": "SECRET"}, ttl=60)
+    assert b"SECRET" not in (tmp_path / "cache.db").read_bytes()
+    key = cache.key("https://api.test/x", {"ids": "btc", "x_cg_demo_api_key": "SECRET"})
+    assert cache.get(key).url == "https://api.test/x?ids=btc"
+
+
+def test_no_ttl_bypasses_cache(tmp_path):
+    http, cache = _client(tmp_path, [_resp(b"1"), _resp(b"2")])
+    http.get("https://api.test/x")
+    assert http.get("https://api.test/x").content == b"2"
+    assert cache.stats["stores"] == 0
+
+
+def test_stale_entry_revalidated_with_etag(tmp_path):
+    http, cache = _client(
+        tmp_path,
+        [_resp(b'{"v": 1}', headers={"ETag": '"abc"', "Last-Modified": "Mon, 01 Jan 2024 00:00:00 GMT"}), _resp(b"", status=304)],
+    )
+    http.get("https://api.test/x", ttl=0.000001)
+    out = http.get("https://api.test/x", ttl=60)
+    assert out.json() == {"v": 1}
+    sent = http.session.calls[1]["headers"]
+    assert sent["If-None-Match"] == '"abc"'
+    assert sent["If-Modified-Since"] == "Mon, 01 Jan 2024 00:00:00 GMT"
+    assert cache.stats["revalidated"] == 1
+    # 304 refreshed the expiry, so the next call is a hit
+    http.get("https://api.test/x", ttl=60)
+    assert cache.stats["hits"] == 1
+
+
+def test_stale_entry_served_when_request_fails(tmp_path):
+    http, cache = _client(tmp_path, [_resp(b"ok"), _resp(b"", status=500)])
+    http.get("https://api.test/x", ttl=0.000001)
+    assert http.get("https://api.test/x", ttl=60).content == b"ok"
+    assert cache.stats["stale"] == 1
+
+
+def test_lru_eviction_bounds_size(tmp_path):
+    http, cache = _client(tmp_path, [_resp(b"a" * 40), _resp(b"b" * 40), _resp(b"c" * 40)], max_bytes=100)
+    http.get("https://api.test/1", ttl=60)
+    http.get("https://api.test/2", ttl=60)
+    http.get("https://api.test/1", ttl=60)  # touch 1 so 2 is least recently used
+    http.get("https://api.test/3", ttl=60)
+    assert cache.stats["evictions"] == 1
+    assert cache.get(cache.key("https://api.test/2")) is None
+    assert cache.get(cache.key("https://api.test/1")) is not None
@@ -0,0 +1,87 @@
+"""Tests for the latest_prices / latest_fx tables and the snapshot loader."""
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+from balancer.bulk import insert_prices, insert_fx
+from balancer.latest import load_snapshot, rebuild_latest
+from balancer.models import LatestPrice, LatestFx, Price, Position, Asset
+from balancer.rules import run_rules, latest_price
+
+
+@contextmanager
+def _count_queries(db):
+    counter = {"n": 0}
+    engine = db.get_bind()
+
+    def _before(*_args, **_kw):
+        counter["n"] += 1
+
+    event.listen(engine, "before_cursor_execute", _before)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, "before_cursor_execute", _before)
+
+
+def test_orm_and_bulk_writes_keep_latest_current(test_db, sample_assets):
+    btc = next(a for a in sample_assets if a.symbol == "BTC")
+    t0 = datetime(2024, 1, 1)
+    test_db.add(Price(asset_id=btc.id, ccy="USD", price=1.0, at=t0))
+    test_db.commit()
+    insert_prices(test_db, [(btc.id, "USD", 3.0, t0 + timedelta(hours=2)), (btc.id, "USD", 2.0, t0 + timedelta(hours=1))])
+    # An older backfilled point must not move latest backwards
+    insert_prices(test_db, [(btc.id, "USD", 0.5, t0 - timedelta(days=1))])
+    insert_fx(test_db, [("GBP", "USD", 1.2, t0), ("GBP", "USD", 1.3, t0 + timedelta(hours=1))])
+    test_db.commit()
+
+    lp = test_db.get(LatestPrice, (btc.id, "USD"))
+    assert (lp.price, lp.at) == (3.0, t0 + timedelta(hours=2))
+    assert test_db.get(LatestFx, ("GBP", "USD")).rate == 1.3
+    assert latest_price(test_db, btc.id, "USD", load_snapshot(test_db)) == latest_price(test_db, btc.id, "USD")
+
+
+def test_load_snapshot_single_query(test_db, sample_prices, sample_fx_rates, sample_assets):
+    btc = next(a for a in sample_assets if a.symbol == "BTC")
+    with _count_queries(test_db) as q:
+        snap = load_snapshot(test_db)
+    assert q["n"] == 1
+    assert snap.price(btc.id, "USD") == 60000.0 and snap.price(btc.id, "GBP") == 48000.0
+    assert snap.rate("GBP", "USD") == 1.27 and snap.rate("EUR", "USD") is None
+
+
+def test_rebuild_latest_from_raw_tables(test_db, sample_prices, sample_fx_rates):
+    test_db.query(LatestPrice).delete()
+    test_db.query(LatestFx).delete()
+    test_db.commit()
+    rebuild_latest(test_db.connection())
+    test_db.commit()
+    assert test_db.query(LatestPrice).count() == len(sample_prices)
+    assert test_db.query(LatestFx).count() == 2
+
+
+def _add_assets(db, portfolio_id, n, start):
+    for i in range(n):
+        a = Asset(symbol=f"X{start + i}", name=f"x{start + i}", active=True)
+        db.add(a)
+        db.flush()
+        db.add(Position(portfolio_id=portfolio_id, asset_id=a.id, coins=1.0, avg_cost_ccy="USD", avg_cost_per_unit=100.0))
+        db.add(Price(asset_id=a.id, ccy="USD", price=100.0, at=datetime(2024, 1, 1)))
+    db.commit()
+
+
+def test_run_rules_query_count_independent_of_portfolio_size(test_db, sample_portfolio, sample_fx_rates, monkeypatch):
+    @contextmanager
+    def mock_session_local():
+        yield test_db
+    monkeypatch.setattr("balancer.rules.SessionLocal", mock_session_local)
+
+    counts = []
+    for n in (2, 20):
+        _add_assets(test_db, sample_portfolio.id, n, start=len(counts) * 100)
+        test_db.expire_all()
+        with _count_queries(test_db) as q:
+            run_rules(portfolio_name="TestPortfolio")
+        counts.append(q["n"])
+    assert counts[0] == counts[1]
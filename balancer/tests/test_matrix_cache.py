@@ -0,0 +1,114 @@
+"""Tests for the memory-mapped price/FX matrix cache."""
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from balancer.bulk import insert_prices, insert_fx
+from balancer.compaction import compact_all
+from balancer.matrix_cache import build_matrices, load_matrix
+
+
+NOW = datetime(2025, 6, 1, 12)
+
+
+def _write(engine, start, end):
+    t, rows, fx = start, [], []
+    while t < end:
+        h = (t - datetime(2024, 1, 1)).total_seconds() / 3600
+        rows += [(1, "USD", 100 + h, t), (2, "USD", 200 + h, t)]
+        fx.append(("GBP", "USD", 1 + h / 1e6, t))
+        t += timedelta(minutes=30)
+    with engine.begin() as conn:
+        insert_prices(conn, rows)
+        insert_fx(conn, fx)
+
+
+def test_build_and_memmap_slices(make_engine, tmp_path):
+    engine = make_engine()
+    _write(engine, NOW - timedelta(days=400), NOW)
+    compact_all(now=NOW, bind=engine)
+    report = build_matrices(now=NOW, bind=engine, cache_dir=tmp_path / "m")
+    assert report["prices_day"]["shape"] == [2, 366]
+    assert report["fx_hour"]["shape"] == [1, 24]
+
+    m = load_matrix("prices_hour", cache_dir=tmp_path / "m")
+    assert isinstance(m.values, np.memmap)
+    assert list(m.rows) == [1, 2]
+    # Close of the 11:00 bucket is the 11:30 point
+    h = (NOW - timedelta(minutes=30) - datetime(2024, 1, 1)).total_seconds() / 3600
+    assert m.values[m.index(2), -2] == 200 + h
+    assert np.isnan(m.values[:, -1]).all()  # current hour has no data yet
+    view = m.window(NOW - timedelta(hours=6), NOW)
+    assert view.shape == (2, 6) and np.shares_memory(view, m.values)
+
+    months = load_matrix("prices_month", cache_dir=tmp_path / "m")
+    assert months.times[0] == np.datetime64("2024-04-01")
+    assert not np.isnan(months.values[:, :-1]).any()
+
+
+def test_incremental_append_matches_full_rebuild(make_engine, tmp_path):
+    engine = make_engine()
+    _write(engine, NOW - timedelta(days=30), NOW)
+    compact_all(now=NOW, bind=engine)
+    build_matrices(now=NOW, bind=engine, cache_dir=tmp_path / "inc")
+
+    later = NOW + timedelta(hours=5)
+    _write(engine, NOW, later)
+    # A late row for an older day arrives too (e.g. a repair)
+    with engine.begin() as conn:
+        insert_prices(conn, [(1, "USD", 5.0, NOW - timedelta(days=10, minutes=-1))])
+    inc = build_matrices(now=later, bind=engine, cache_dir=tmp_path / "inc")
+    build_matrices(now=later, full=True, bind=engine, cache_dir=tmp_path / "ref")
+    assert inc["prices_hour"]["mode"] == "incremental"
+    assert inc["prices_hour"]["fetched_buckets"] == 6
+    assert inc["prices_day"]["fetched_buckets"] == 11
+    for name in inc:
+        a, b = load_matrix(name, tmp_path / "inc"), load_matrix(name, tmp_path / "ref")
+        assert np.array_equal(a.values, b.values, equal_nan=True), name
+        assert np.array_equal(a.times, b.times)
+
+
+def test_cached_closes_match_the_db(make_engine, tmp_path):
+    from balancer.buckets import bucket_key
+    from balancer.matrix_cache import bucket_closes, cached_closes
+
+    engine = make_engine()
+    _write(engine, NOW - timedelta(days=400), NOW)
+    compact_all(now=NOW, bind=engine)
+    build_matrices(now=NOW, bind=engine, cache_dir=tmp_path / "m")
+    # Rows after the build: a late point in an old day and a new asset
+    with engine.begin() as conn:
+        insert_prices(conn, [(1, "USD", 5.0, NOW - timedelta(days=20, minutes=-1)), (3, "USD", 7.0, NOW - timedelta(days=2))])
+
+    hi = bucket_key("day", NOW)
+    keys = np.array([2, 1, 3], dtype=np.int64)
+    with engine.connect() as conn:
+        for lo in (hi - 100, hi - 399):  # inside, and reaching past, the cached year
+            got = cached_closes(conn, "prices", "day", keys, lo, hi, cache_dir=tmp_path / "m")
+            assert np.array_equal(got, bucket_closes(conn, "prices", "day", keys, lo, hi), equal_nan=True)
+        fx = cached_closes(conn, "fx_rates", "day", np.array(["GBP"]), hi - 30, hi, cache_dir=tmp_path / "m")
+        assert np.array_equal(fx, bucket_closes(conn, "fx_rates", "day", np.array(["GBP"]), hi - 30, hi), equal_nan=True)
+
+    # A matrix built from another DB is never used
+    other = make_engine("other.db")
+    with other.connect() as conn:
+        assert np.isnan(cached_closes(conn, "prices", "day", keys, hi - 10, hi, cache_dir=tmp_path / "m")).all()
+
+
+def test_rebuild_swaps_one_pointer(make_engine, tmp_path):
+    engine = make_engine()
+    _write(engine, NOW - timedelta(days=3), NOW)
+    build_matrices(now=NOW, bind=engine, cache_dir=tmp_path / "m", names=["prices_hour"])
+    first = load_matrix("prices_hour", tmp_path / "m")
+    _write(engine, NOW, NOW + timedelta(hours=2))
+    build_matrices(now=NOW + timedelta(hours=2), bind=engine, cache_dir=tmp_path / "m", names=["prices_hour"])
+    build_matrices(now=NOW + timedelta(hours=3), bind=engine, cache_dir=tmp_path / "m", names=["prices_hour"])
+
+    # Each build writes its own files; only the current and previous versions are kept
+    files = sorted(p.name for p in (tmp_path / "m").glob("prices_hour.*.npy"))
+    assert files == ["prices_hour.2.npy", "prices_hour.2.rows.npy", "prices_hour.2.times.npy",
+                     "prices_hour.3.npy", "prices_hour.3.rows.npy", "prices_hour.3.times.npy"]
+    # A matrix opened before the rebuilds still reads its own consistent snapshot
+    assert first.values.shape == (2, 24) and first.times[-1] == np.datetime64(NOW)
+    latest = load_matrix("prices_hour", tmp_path / "m")
+    assert latest.times[-1] == np.datetime64(NOW + timedelta(hours=3))
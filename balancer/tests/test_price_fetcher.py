@@ -7,6 +7,8 @@ from balancer.price_fetcher import (
     store_prices,
     derive_and_store_btc_prices,
     run_price_fetch,
+    plan_price_fetch,
+    fetch_quotes,
 )
 from balancer.models import Asset, Price, FxRate
 
@@ -208,17 +210,19 @@ def test_derive_and_store_btc_prices(test_db, sample_assets, monkeypatch):
     assert fx.rate == 60000.0
 
 
-@patch("balancer.price_fetcher.fetch_markets")
+@patch("balancer.price_fetcher.compact_all")
+@patch("balancer.price_fetcher.CoingeckoClient")
 @patch("balancer.price_fetcher.ids_from_positions")
 @patch("balancer.price_fetcher.read_mapping_ids")
-def test_run_price_fetch(mock_read_mapping, mock_ids_from_positions, mock_fetch_markets, test_db, sample_assets, sample_positions, monkeypatch):
+def test_run_price_fetch(mock_read_mapping, mock_ids_from_positions, mock_client_cls, mock_compact, test_db, sample_assets, sample_positions, monkeypatch):
     """Test the full price fetch pipeline."""
-    mock_ids_from_positions.return_value = ["bitcoin", "ethereum"]
-    mock_fetch_markets.return_value = [
-        {"id": "bitcoin", "symbol": "btc", "name": "Bitcoin", "current_price": 48000.0},
-        {"id": "ethereum", "symbol": "eth", "name": "Ethereum", "current_price": 2400.0},
-        {"id": "usd-coin", "symbol": "usdc", "name": "USD Coin", "current_price": 0.79},
-    ]
+    mock_ids_from_positions.return_value = ["bitcoin", "ethereum", "usd-coin"]
+    client = mock_client_cls.return_value
+    client.simple_price.return_value = {
+        "bitcoin": {"usd": 60000.0, "gbp": 48000.0, "btc": 1.0},
+        "ethereum": {"usd": 3000.0, "gbp": 2400.0, "btc": 0.05},
+        "usd-coin": {"usd": 1.0, "gbp": 0.79, "btc": 0.0000166},
+    }
     
     from contextlib import contextmanager
     @contextmanager
@@ -233,11 +237,39 @@ def test_run_price_fetch(mock_read_mapping, mock_ids_from_positions, mock_fetch_
     btc = next(a for a in sample_assets if a.symbol == "BTC")
     prices = test_db.query(Price).filter(Price.asset_id == btc.id).all()
     assert len(prices) > 0
+    assert prices[0].price == 60000.0
     
-    # Called twice: once for USD and once for GBP (USDC FX)
-    assert mock_fetch_markets.call_count == 2
-    calls = [args for args, _ in mock_fetch_markets.call_args_list]
-    # First call: USD, Second call: GBP (order may vary but both must exist)
-    vs_list = sorted([c[1] for c in calls])
-    assert vs_list == ["gbp", "usd"]
+    # A single multi-currency request replaces the separate USD and GBP markets calls
+    client.simple_price.assert_called_once()
+    assert client.simple_price.call_args[0][1] == ("usd", "gbp", "btc")
+    client.markets.assert_not_called()
+    fx = test_db.query(FxRate).filter(FxRate.base_ccy == "GBP", FxRate.quote_ccy == "USD").first()
+    assert fx is not None and abs(fx.rate - 1.0 / 0.79) < 1e-9
+
 
+def test_fetch_quotes_fetches_metadata_for_unknown_ids(test_db, sample_assets, monkeypatch):
+    """Ids without an asset row cost one extra markets call for symbol/name."""
+    from contextlib import contextmanager
+    @contextmanager
+    def mock_session_local():
+        yield test_db
+    
+    monkeypatch.setattr("balancer.price_fetcher.SessionLocal", mock_session_local)
+    
+    plan = plan_price_fetch(["bitcoin", "solana"])
+    assert plan.unknown_ids == ["solana"]
+    assert plan.request_count == 2
+    
+    client = Mock()
+    client.simple_price.return_value = {
+        "bitcoin": {"usd": 60000.0, "gbp": 48000.0, "btc": 1.0},
+        "solana": {"usd": 150.0, "gbp": 120.0},
+    }
+    client.markets.return_value = [{"id": "solana", "symbol": "sol", "name": "Solana", "current_price": 150.0}]
+    
+    quotes = fetch_quotes(["bitcoin", "solana"], client=client)
+    client.markets.assert_called_once_with(["solana"], "usd")
+    assert [r["id"] for r in quotes["usd"]] == ["bitcoin", "solana"]
+    assert [r["id"] for r in quotes["btc"]] == ["bitcoin"]
+    sol = next(r for r in quotes["gbp"] if r["id"] == "solana")
+    assert sol == {"id": "solana", "symbol": "sol", "name": "Solana", "current_price": 120.0}
@@ -0,0 +1,110 @@
+"""Tests for rate_limit module."""
+import multiprocessing
+import time
+from email.utils import formatdate
+
+from balancer.rate_limit import RateLimiter, retry_after_seconds
+
+
+class FakeResp:
+    def __init__(self, headers=None):
+        self.headers = headers or {}
+
+
+def _burst(state_dir, n):
+    limiter = RateLimiter("shared", interval=0.05, burst=1, state_dir=state_dir)
+    for _ in range(n):
+        limiter.acquire()
+
+
+def test_acquire_spaces_requests(tmp_path):
+    limiter = RateLimiter("t", interval=0.05, burst=1, state_dir=tmp_path)
+    start = time.monotonic()
+    for _ in range(4):
+        limiter.acquire()
+    # First token is immediate, the next three wait one interval each
+    assert time.monotonic() - start >= 0.14
+
+
+def test_burst_allows_immediate_tokens(tmp_path):
+    limiter = RateLimiter("b", interval=10.0, burst=3, state_dir=tmp_path)
+    assert [limiter.try_acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert limiter.try_acquire() > 0
+
+
+def test_disabled_when_interval_zero(tmp_path):
+    limiter = RateLimiter("off", interval=0, state_dir=tmp_path)
+    assert limiter.acquire() == 0.0
+    assert not (tmp_path / "ratelimit-off.json").exists()
+
+
+def test_penalty_holds_callers_when_interval_zero(tmp_path):
+    limiter = RateLimiter("off", interval=0, state_dir=tmp_path)
+    limiter.penalize(0.1)
+    assert limiter.try_acquire() > 0
+    start = time.monotonic()
+    limiter.acquire()
+    assert time.monotonic() - start >= 0.05
+    assert limiter.try_acquire() == 0.0
+
+
+def test_penalize_blocks_other_instances(tmp_path):
+    a = RateLimiter("p", interval=0.01, state_dir=tmp_path)
+    b = RateLimiter("p", interval=0.01, state_dir=tmp_path)
+    a.penalize(5.0)
+    assert b.try_acquire() > 4.0
+
+
+def test_shared_across_processes(tmp_path):
+    ctx = multiprocessing.get_context("fork")
+    procs = [ctx.Process(target=_burst, args=(str(tmp_path), 3)) for _ in range(2)]
+    start = time.monotonic()
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(10)
+    # Six tokens at one per 50ms across both processes => at least five waits
+    assert time.monotonic() - start >= 0.24
+    assert all(p.exitcode == 0 for p in procs)
+
+
+def test_retry_after_seconds():
+    assert retry_after_seconds(FakeResp({"Retry-After": "7"})) == 7.0
+    assert retry_after_seconds(FakeResp({})) is None
+    assert retry_after_seconds(None) is None
+    future = formatdate(time.time() + 30, usegmt=True)
+    assert 25 <= retry_after_seconds(FakeResp({"Retry-After": future})) <= 31
+
+
+def test_coingecko_429_penalizes_shared_limiter(tmp_path):
+    from requests import HTTPError
+    from balancer.clients import CoingeckoClient
+
+    class Resp429:
+        status_code = 429
+        headers = {"Retry-After": "3"}
+
+    class OkResp:
+        def json(self):
+            return []
+
+    class FakeLimiter:
+        def __init__(self):
+            self.penalties = []
+        def penalize(self, seconds):
+            self.penalties.append(seconds)
+
+    class FlakyHttp:
+        def __init__(self):
+            self.limiter = FakeLimiter()
+            self.calls = 0
+        def get(self, url, params=None, headers=None):
+            self.calls += 1
+            if self.calls == 1:
+                raise HTTPError(response=Resp429())
+            return OkResp()
+
+    http = FlakyHttp()
+    assert CoingeckoClient(http=http).markets(["bitcoin"], "usd") == []
+    assert http.limiter.penalties == [3.0]
+    assert http.calls == 2
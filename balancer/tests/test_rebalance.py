@@ -0,0 +1,90 @@
+"""Tests for the portfolio-level rebalance plan."""
+import time
+
+import numpy as np
+import pytest
+
+from balancer.rebalance import plan_rebalance
+
+
+def _random(rng, rows, n):
+    mv = rng.lognormal(6, 1.5, (rows, n))
+    tw = rng.dirichlet(np.ones(n), rows)
+    band = rng.uniform(0.2, 0.5, (rows, n)) * tw + 0.002
+    return mv, tw, band
+
+
+def test_plan_is_cash_neutral_and_fixes_every_band():
+    rng = np.random.default_rng(3)
+    mv, tw, band = _random(rng, 200, 25)
+    min_trade = np.full_like(mv, 1.0)
+    plan = plan_rebalance(mv, tw, band, min_trade, band_fraction=0.5)
+
+    total = mv.sum(axis=1, keepdims=True)
+    was_out = np.abs(mv / total - tw) >= band
+    assert was_out.any()
+    np.testing.assert_allclose(plan.trades_usd.sum(axis=1), 0.0, atol=1e-6)
+    np.testing.assert_allclose(plan.residual_usd, 0.0, atol=1e-6)
+    assert not plan.unresolved.any()
+    assert (np.abs(plan.weights_after - tw) < band).all()
+    traded = plan.trades_usd != 0
+    assert (np.abs(plan.trades_usd[traded]) >= 1.0 - 1e-9).all()
+    # Nothing to do means no trades
+    assert not traded[~was_out.any(axis=1)].any()
+
+    # Each batch row is planned on its own
+    for i in (0, 7, 199):
+        one = plan_rebalance(mv[i], tw[i], band[i], min_trade[i], band_fraction=0.5)
+        np.testing.assert_array_equal(one.trades_usd, plan.trades_usd[i])
+
+
+def test_min_trade_sizes_keep_the_set_cash_neutral():
+    # A needs a $35 sale to reach its inner band but trades at least $100. B has
+    # only $25 of room, so C takes the whole other side
+    mv = np.array([560.0, 200.0, 240.0])
+    tw = np.array([0.5, 0.2, 0.3])
+    band = np.array([0.05, 0.05, 0.2])
+    plan = plan_rebalance(mv, tw, band, np.array([100.0, 100.0, 100.0]), band_fraction=0.5)
+    assert plan.trades_usd == pytest.approx([-100.0, 0.0, 100.0])
+    assert plan.residual_usd == pytest.approx(0.0) and not plan.unresolved.any()
+
+    # Without the minimum it is just the $35
+    plan = plan_rebalance(mv, tw, band, np.zeros(3), band_fraction=0.5)
+    assert plan.trades_usd == pytest.approx([-35.0, 0.0, 35.0])
+
+    # A band narrower than the minimum trade can't be met: no trade, reported unresolved
+    plan = plan_rebalance(mv, tw, [0.05, 0.05, 0.2], [600.0, 100.0, 100.0], band_fraction=0.5)
+    assert plan.count == 0 and plan.unresolved.tolist() == [True, False, False]
+
+
+def test_offsets_use_fewest_new_trades():
+    # D is out of band; of the in-band assets E alone has room for the whole offset
+    mv = np.array([100.0, 300.0, 300.0, 300.0, 0.0])
+    tw = np.array([0.25, 0.25, 0.25, 0.05, 0.2])
+    band = np.array([0.3, 0.3, 0.3, 0.3, 0.1])
+    plan = plan_rebalance(mv, tw, band, np.full(5, 10.0), band_fraction=0.0)
+    assert plan.count == 2
+    assert plan.trades_usd[4] == pytest.approx(200.0)
+    assert plan.trades_usd.sum() == pytest.approx(0.0)
+
+
+def test_untargeted_and_unpriced_assets_are_left_alone():
+    mv = np.array([900.0, 100.0, np.nan, 5000.0])
+    plan = plan_rebalance(mv, [0.5, 0.5, 0.1, 0.0], [0.1, 0.1, 0.1, 0.1], [1.0] * 4,
+                          has_target=[True, True, True, False], band_fraction=0.0)
+    assert plan.trades_usd[2] == 0.0 and plan.trades_usd[3] == 0.0
+    # Both targets want 50% but the untargeted holding is 5/6 of the value: the buys
+    # bringing them into band have nothing to fund them
+    assert plan.trades_usd[:2] == pytest.approx([0.5 * 6000 - 900, 0.5 * 6000 - 100])
+    assert plan.residual_usd == pytest.approx(plan.trades_usd.sum())
+
+
+def test_hundreds_of_assets_in_milliseconds():
+    rng = np.random.default_rng(5)
+    mv, tw, band = _random(rng, 1, 500)
+    plan_rebalance(mv[0], tw[0], band[0], np.full(500, 5.0))
+    t0 = time.perf_counter()
+    for _ in range(20):
+        plan = plan_rebalance(mv[0], tw[0], band[0], np.full(500, 5.0))
+    assert (time.perf_counter() - t0) / 20 < 0.05
+    assert abs(plan.residual_usd) < 1e-6
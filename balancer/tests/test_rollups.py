@@ -0,0 +1,110 @@
+"""Tests for OHLC rollups written by compaction and the tiered history query."""
+import random
+from datetime import datetime, timedelta
+
+from sqlalchemy.orm import sessionmaker
+
+from balancer.buckets import bucket_key
+from balancer.bulk import insert_prices, insert_fx
+from balancer.compaction import compact_all
+from balancer.rollups import pick_tier, price_ohlc, fx_ohlc
+
+
+NOW = datetime(2025, 6, 1)
+
+
+def _series(start, end, step, seed):
+    rng = random.Random(seed)
+    out, t = [], start
+    while t < end:
+        out.append((t, rng.uniform(1, 100)))
+        t += step
+    return out
+
+
+def _expected(points, tier):
+    out = {}
+    for t, p in sorted(points):
+        c = out.setdefault(bucket_key(tier, t), {"open": p, "high": p, "low": p, "close": p, "count": 0})
+        c["high"], c["low"], c["close"] = max(c["high"], p), min(c["low"], p), p
+        c["count"] += 1
+    return out
+
+
+def _candles(engine, tier, start, end):
+    with sessionmaker(bind=engine)() as db:
+        rows = price_ohlc(db, 1, "USD", start, end, tier=tier)
+    return {bucket_key(tier, r["at"]): {k: r[k] for k in ("open", "high", "low", "close", "count")} for r in rows}
+
+
+def test_rollups_keep_ohlc_of_pruned_rows(make_engine):
+    engine = make_engine()
+    # Two passes over out-of-order batches: the second merges into existing buckets
+    points = _series(NOW - timedelta(days=60), NOW, timedelta(minutes=20), seed=1)
+    first, second = points[::2], points[1::2]
+    with engine.begin() as conn:
+        insert_prices(conn, [(1, "USD", p, t) for t, p in first])
+    compact_all(now=NOW - timedelta(days=1), bind=engine)
+    with engine.begin() as conn:
+        insert_prices(conn, [(1, "USD", p, t) for t, p in second])
+    report = compact_all(now=NOW, bind=engine)
+    assert report["prices"]["rollup"]["day"] > 0
+
+    with engine.connect() as conn:
+        raw = conn.exec_driver_sql("SELECT COUNT(*) FROM prices").scalar()
+    assert raw < len(points) / 10  # pruned to one row per bucket
+
+    start = NOW - timedelta(days=60)
+    for tier in ("day", "month"):
+        assert _candles(engine, tier, start, NOW - timedelta(seconds=1)) == _expected(points, tier)
+    # Hourly rollups are kept for the last ROLLUP_HOURLY_DAYS only
+    recent = [(t, p) for t, p in points if t >= NOW - timedelta(days=1)]
+    assert _candles(engine, "hour", NOW - timedelta(days=1), NOW - timedelta(seconds=1)) == _expected(recent, "hour")
+
+
+def test_query_merges_rows_not_yet_compacted(make_engine):
+    engine = make_engine()
+    points = _series(NOW - timedelta(days=3), NOW, timedelta(minutes=30), seed=2)
+    with engine.begin() as conn:
+        insert_prices(conn, [(1, "USD", p, t) for t, p in points[:100]])
+        insert_fx(conn, [("GBP", "USD", p, t) for t, p in points])
+    compact_all(now=NOW, bind=engine)
+    with engine.begin() as conn:
+        insert_prices(conn, [(1, "USD", p, t) for t, p in points[100:]])
+
+    assert _candles(engine, "day", NOW - timedelta(days=3), NOW) == _expected(points, "day")
+    with sessionmaker(bind=engine)() as db:
+        fx = fx_ohlc(db, "GBP", "USD", NOW - timedelta(days=3), NOW)
+    assert sum(c["count"] for c in fx) == len(points)
+
+
+def test_pick_tier_uses_coarsest_needed():
+    assert pick_tier(NOW - timedelta(days=7), NOW) == "hour"
+    assert pick_tier(NOW - timedelta(days=365 * 3), NOW) == "day"
+    assert pick_tier(NOW - timedelta(days=365 * 30), NOW) == "month"
+    assert pick_tier(NOW - timedelta(days=7), NOW, max_points=24) == "day"
+
+
+def test_compaction_drops_old_hourly_and_daily_rollups(make_engine):
+    engine = make_engine()
+    points = _series(NOW - timedelta(days=400), NOW, timedelta(hours=6), seed=3)
+    with engine.begin() as conn:
+        insert_prices(conn, [(1, "USD", p, t) for t, p in points])
+        insert_fx(conn, [("GBP", "USD", p, t) for t, p in points])
+    report = compact_all(now=NOW, bind=engine)
+    assert report["prices"]["rollup"]["pruned"]["hour"]["deleted"] > 0
+
+    hour_edge, day_edge = bucket_key("hour", NOW - timedelta(days=1)), bucket_key("day", NOW - timedelta(days=365))
+    with engine.connect() as conn:
+        for table in ("prices", "fx"):
+            assert conn.exec_driver_sql(f"SELECT MIN(bucket) FROM {table}_hourly").scalar() == hour_edge
+            assert conn.exec_driver_sql(f"SELECT MIN(bucket) FROM {table}_daily").scalar() == day_edge
+            assert conn.exec_driver_sql(f"SELECT MIN(bucket) FROM {table}_monthly").scalar() == bucket_key("month", points[0][0])
+
+    # A week of history falls back from the dropped hourly tier to daily candles
+    with sessionmaker(bind=engine)() as db:
+        week = price_ohlc(db, 1, "USD", NOW - timedelta(days=7), NOW - timedelta(seconds=1))
+    assert len(week) == 7
+    assert _candles(engine, "day", NOW - timedelta(days=7), NOW - timedelta(seconds=1)) == {
+        bucket_key("day", r["at"]): {k: r[k] for k in ("open", "high", "low", "close", "count")} for r in week
+    }
@@ -0,0 +1,184 @@
+"""Parity tests: the vectorised rules engine against the per-position rule functions."""
+import math
+import random
+from datetime import datetime, timedelta, UTC
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from balancer.alerts import AlertSink
+from balancer.db import Base
+from balancer.models import Alert, Asset, FxRate, Portfolio, Position, Price, RuleState, Target
+from balancer.rules import (
+    emit_alerts,
+    run_rules,
+    evaluate_drift,
+    evaluate_take_profit,
+    position_cost_basis_usd,
+    position_market_value_usd,
+)
+from balancer.rules_engine import evaluate, load_state
+
+
+def _seed(db, fx: str):
+    now = datetime.now(UTC)
+    pf = Portfolio(name="P")
+    db.add(pf)
+    specs = [
+        # symbol, coins, cost ccy, avg cost, USD price, GBP price, target (weight, band, min trade)
+        ("BTC", 1.0, "GBP", 20000.0, 90000.0, 70000.0, (0.2, 0.1, 50.0)),
+        ("ETH", 10.0, "USD", 500.0, None, 2400.0, (0.3, None, None)),
+        ("SOL", 50.0, "GBP", 20.0, None, None, (0.1, 0.05, 10.0)),
+        ("DOGE", 0.0, "GBP", 0.1, 0.2, 0.15, None),
+        ("ADA", 1000.0, "GBP", None, 0.5, 0.4, (0.05, 0.01, 1.0)),
+        ("XRP", 3000.0, "EUR", 0.2, 0.6, 0.47, (0.0, 0.01, 5.0)),
+        ("USDC", 5000.0, "GBP", 0.8, 1.0, 0.79, (0.2, 0.02, 50.0)),
+        ("OLD", 10.0, "USD", 1.0, 50.0, 40.0, (0.5, 0.01, 1.0)),
+    ]
+    assets = {}
+    for sym, *_ in specs:
+        assets[sym] = Asset(symbol=sym, name=sym, coingecko_id="usd-coin" if sym == "USDC" else None, active=sym != "OLD")
+        db.add(assets[sym])
+    db.flush()
+    for sym, coins, ccy, cost, usd, gbp, tgt in specs:
+        a = assets[sym]
+        db.add(Position(portfolio_id=pf.id, asset_id=a.id, coins=coins, avg_cost_ccy=ccy, avg_cost_per_unit=cost))
+        if usd is not None:
+            db.add(Price(asset_id=a.id, ccy="USD", price=usd, at=now))
+        if gbp is not None and not (fx == "none" and sym == "USDC"):
+            db.add(Price(asset_id=a.id, ccy="GBP", price=gbp, at=now))
+        if tgt is not None:
+            db.add(Target(portfolio_id=pf.id, asset_id=a.id, target_weight=tgt[0], drift_band=tgt[1], min_trade_usd=tgt[2]))
+    if fx == "fx":
+        db.add(FxRate(base_ccy="GBP", quote_ccy="USD", rate=1.27, at=now))
+    # BTC's 2x rung is cooling off; an old 3x alert is outside the window
+    db.add(Alert(portfolio_id=pf.id, asset_id=assets["BTC"].id, type="take_profit_2x_value", message="m", at=now - timedelta(hours=1)))
+    db.add(Alert(portfolio_id=pf.id, asset_id=assets["BTC"].id, type="take_profit_3x_value", message="m", at=now - timedelta(days=3)))
+    db.commit()
+    return pf
+
+
+def _positions(db, pid):
+    return (
+        db.query(Position).join(Asset, Asset.id == Position.asset_id)
+        .filter(Position.portfolio_id == pid, Asset.active).order_by(Position.id).all()
+    )
+
+
+def _same(a, b):
+    return (a is None and math.isnan(b)) or (a is not None and a == b)
+
+
+@pytest.mark.parametrize("fx", ["fx", "usdc", "none"])
+def test_engine_matches_scalar_rules(test_db, monkeypatch, tmp_path, fx):
+    pf = _seed(test_db, fx)
+    calls = []
+    monkeypatch.setattr("balancer.rules.log_alert", lambda kind, message, payload=None, severity="info": calls.append((kind, message, payload)))
+
+    state = load_state(test_db, pf.id)
+    ev = evaluate(state)
+    positions = _positions(test_db, pf.id)
+    assert [p.asset_id for p in positions] == state.asset_ids.tolist()
+    for i, pos in enumerate(positions):
+        assert _same(position_market_value_usd(test_db, pos), ev.mv_usd[i])
+        assert _same(position_cost_basis_usd(test_db, pos), ev.cb_usd[i])
+
+    sink = AlertSink(log_path=tmp_path / "alerts.jsonl")
+    emit_alerts(sink, state, ev)
+    new_calls = [(e["type"], e["message"], e["payload"]) for e in sink.entries]
+    seen = test_db.query(Alert).count()
+
+    positions = _positions(test_db, pf.id)
+    for pos in positions:
+        evaluate_take_profit(test_db, pf.id, pos)
+    evaluate_drift(test_db, pf.id, positions)
+    assert new_calls == calls
+    old_rows = test_db.query(Alert).order_by(Alert.id).offset(seen).all()
+    assert [(r.asset_id, r.type) for r in old_rows] == [(r["asset_id"], r["type"]) for r in sink.rows]
+    assert any(c[0] == "take_profit" for c in calls) and any(c[0] == "rebalance" for c in calls)
+
+
+def test_engine_cooloff_uses_last_alert_time(test_db):
+    pf = _seed(test_db, "fx")
+    state = load_state(test_db, pf.id)
+    btc = state.asset_ids.tolist().index(test_db.query(Asset).filter_by(symbol="BTC").one().id)
+    assert evaluate(state).ladder[btc].tolist() == [False, True, False]
+    # Two hours later with a one-hour cool-off the 2x rung fires again
+    later = load_state(test_db, pf.id, now=datetime.now(UTC) + timedelta(hours=2), cooloff=timedelta(hours=1))
+    assert evaluate(later).ladder[btc].tolist() == [True, True, False]
+
+
+def _skip_db(tmp_path, name):
+    engine = create_engine(f"sqlite:///{tmp_path / name}")
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        pf = Portfolio(name="P")
+        db.add(pf)
+        db.flush()
+        for k in range(6):
+            a = Asset(symbol=f"A{k}", name=f"A{k}")
+            db.add(a)
+            db.flush()
+            db.add(Position(portfolio_id=pf.id, asset_id=a.id, coins=10.0, avg_cost_ccy="USD", avg_cost_per_unit=10.0))
+            db.add(Target(portfolio_id=pf.id, asset_id=a.id, target_weight=1 / 6, drift_band=0.05, min_trade_usd=1.0))
+            db.add(Price(asset_id=a.id, ccy="USD", price=10.0, at=datetime.now(UTC)))
+        db.commit()
+    return Session
+
+
+def _run(Session, monkeypatch, tmp_path, eps):
+    monkeypatch.setattr("balancer.rules.SessionLocal", Session)
+    monkeypatch.setattr("balancer.alerts.LOG_PATH", str(tmp_path / "alerts.jsonl"))
+    return run_rules("P", eps=eps)
+
+
+def _move(Session, step, rng):
+    with Session() as db:
+        at = datetime.now(UTC) + timedelta(minutes=step)
+        for a in db.query(Asset).order_by(Asset.id):
+            last = db.query(Price).filter_by(asset_id=a.id).order_by(Price.id.desc()).first().price
+            # Mostly small moves, now and then a jump past a rung or band
+            move = rng.choice([1.0, 1.001, 0.999, 1.002, 1.3, 0.8])
+            db.add(Price(asset_id=a.id, ccy="USD", price=last * move, at=at))
+        db.commit()
+
+
+def test_skip_prepass_raises_the_same_alerts(tmp_path, monkeypatch):
+    fast, full = _skip_db(tmp_path, "fast.db"), _skip_db(tmp_path, "full.db")
+    rng_fast, rng_full = random.Random(7), random.Random(7)
+    skipped = 0
+    for step in range(40):
+        r_fast = _run(fast, monkeypatch, tmp_path, eps=0.01)
+        r_full = _run(full, monkeypatch, tmp_path, eps=0)
+        assert r_fast["alerts"] == r_full["alerts"]
+        assert r_full["skipped"] == 0
+        skipped += r_fast["skipped"]
+        _move(fast, step, rng_fast)
+        _move(full, step, rng_full)
+    assert skipped > 0
+    rows = []
+    for Session in (fast, full):
+        with Session() as db:
+            rows.append([(a.asset_id, a.type, a.message) for a in db.query(Alert).order_by(Alert.id)])
+    assert rows[0] == rows[1] and rows[0]
+
+
+def test_skip_prepass_counts_and_full_rerun(tmp_path, monkeypatch):
+    Session = _skip_db(tmp_path, "p.db")
+    assert _run(Session, monkeypatch, tmp_path, eps=0.01) == {"alerts": 0, "evaluated": 6, "skipped": 0}
+    assert _run(Session, monkeypatch, tmp_path, eps=0.01) == {"alerts": 0, "evaluated": 0, "skipped": 6}
+    with Session() as db:
+        assert db.query(RuleState).count() == 6
+        # A target change re-evaluates the whole portfolio
+        db.query(Target).first().drift_band = 0.1
+        db.commit()
+    assert _run(Session, monkeypatch, tmp_path, eps=0.01) == {"alerts": 0, "evaluated": 6, "skipped": 0}
+    with Session() as db:
+        a = db.query(Asset).first()
+        db.add(Price(asset_id=a.id, ccy="USD", price=10.5, at=datetime.now(UTC) + timedelta(minutes=1)))
+        db.commit()
+    # One price moved 5%, which also moves the total by about 1%
+    assert _run(Session, monkeypatch, tmp_path, eps=0.01) == {"alerts": 0, "evaluated": 1, "skipped": 5}
+    assert _run(Session, monkeypatch, tmp_path, eps=0.02) == {"alerts": 0, "evaluated": 0, "skipped": 6}
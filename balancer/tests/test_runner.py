@@ -0,0 +1,115 @@
+"""Tests for the all-portfolios run sharing one price snapshot."""
+import json
+from datetime import datetime, UTC
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+from balancer import runner
+from balancer.db import Base
+from balancer.models import Alert, Asset, FxRate, Portfolio, Position, Price
+
+
+@pytest.fixture
+def env(tmp_path, monkeypatch):
+    # NullPool so forked pool workers never inherit an open SQLite connection
+    engine = create_engine(f"sqlite:///{tmp_path / 'runner.db'}", poolclass=NullPool)
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    now = datetime.now(UTC)
+    with Session() as db:
+        btc = Asset(symbol="BTC", name="Bitcoin", coingecko_id="bitcoin")
+        eth = Asset(symbol="ETH", name="Ethereum", coingecko_id="ethereum")
+        db.add_all([btc, eth])
+        db.flush()
+        for name, coins in (("Default", 1.0), ("Kid's fund", 0.5), ("Strategy/B", 2.0)):
+            pf = Portfolio(name=name)
+            db.add(pf)
+            db.flush()
+            db.add(Position(portfolio_id=pf.id, asset_id=btc.id, coins=coins, avg_cost_ccy="USD", avg_cost_per_unit=20000.0))
+            db.add(Position(portfolio_id=pf.id, asset_id=eth.id, coins=coins * 10, avg_cost_ccy="USD", avg_cost_per_unit=3000.0))
+        db.add_all([
+            Price(asset_id=btc.id, ccy="USD", price=60000.0, at=now),
+            Price(asset_id=eth.id, ccy="USD", price=3000.0, at=now),
+            FxRate(base_ccy="GBP", quote_ccy="USD", rate=1.25, at=now),
+        ])
+        db.commit()
+    for mod in ("balancer.db", "balancer.rules", "balancer.exporter", "balancer.risk"):
+        monkeypatch.setattr(f"{mod}.SessionLocal", Session)
+    monkeypatch.setattr("balancer.runner.BASE_DIR", tmp_path)
+    monkeypatch.setattr("balancer.exporter.BASE_DIR", tmp_path)
+    monkeypatch.setattr("balancer.alerts.LOG_PATH", str(tmp_path / "alerts.jsonl"))
+    return Session, tmp_path
+
+
+def _payloads(base):
+    out = {}
+    for p in sorted(base.glob("portfolio*.json")):
+        data = json.loads(p.read_text())
+        data.pop("as_of")
+        out[p.name] = data
+    return out
+
+
+def test_all_portfolios_share_one_snapshot(env, monkeypatch):
+    Session, base = env
+    calls = []
+    real = runner.load_snapshot
+    monkeypatch.setattr("balancer.runner.load_snapshot", lambda db: calls.append(1) or real(db))
+
+    def _no_reload(db):
+        raise AssertionError("snapshot reloaded per portfolio")
+    monkeypatch.setattr("balancer.rules_engine.load_snapshot", _no_reload)
+
+    report = runner.run_all_portfolios(workers=0)
+    assert len(calls) == 1
+    assert list(report) == ["Default", "Kid's fund", "Strategy/B"]
+    # BTC at 3x cost crosses the 2x and 3x rungs in each portfolio
+    assert all(r["alerts"] == 2 for r in report.values())
+
+    files = _payloads(base)
+    assert set(files) == {"portfolio.json", "portfolio-Default.json", "portfolio-Kid-s-fund.json", "portfolio-Strategy-B.json"}
+    assert files["portfolio.json"] == files["portfolio-Default.json"]
+    assert files["portfolio-Strategy-B.json"]["total_mv_usd"] == 2 * 60000.0 + 20 * 3000.0
+    with Session() as db:
+        assert db.query(Alert).count() == 6
+
+
+def test_process_pool_matches_in_process(env):
+    Session, base = env
+    runner.run_all_portfolios(workers=0)
+    serial = _payloads(base)
+    for p in base.glob("portfolio*.json"):
+        p.unlink()
+    with Session() as db:
+        db.query(Alert).delete()
+        db.commit()
+
+    report = runner.run_all_portfolios(workers=2)
+    assert _payloads(base) == serial
+    assert sum(r["alerts"] for r in report.values()) == 6
+
+
+def test_default_exported_once_and_colliding_names_kept_apart(env, monkeypatch):
+    Session, base = env
+    with Session() as db:
+        db.add_all([Portfolio(name="Strategy-B"), Portfolio(name="strategy B")])
+        db.commit()
+        ids = {p.name: p.id for p in db.query(Portfolio)}
+    exported = []
+    real = runner.export_portfolio_json
+    monkeypatch.setattr("balancer.runner.export_portfolio_json",
+                        lambda name, **kw: exported.append(name) or real(name, **kw))
+
+    runner.run_all_portfolios(workers=0)
+    assert exported.count("Default") == 1
+
+    files = _payloads(base)
+    assert files["portfolio.json"] == files["portfolio-Default.json"]
+    # "Strategy/B", "Strategy-B" and "strategy B" share a slug, so each file carries the id
+    assert {f"portfolio-Strategy-B-{ids['Strategy/B']}.json", f"portfolio-Strategy-B-{ids['Strategy-B']}.json",
+            f"portfolio-strategy-B-{ids['strategy B']}.json"} <= set(files)
+    assert "portfolio-Strategy-B.json" not in files
+    assert files[f"portfolio-Strategy-B-{ids['Strategy/B']}.json"]["total_mv_usd"] == 2 * 60000.0 + 20 * 3000.0
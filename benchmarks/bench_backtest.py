@@ -0,0 +1,61 @@
+"""Backtest time for a parameter grid over synthetic day and hour histories.
+
+Usage: python -m benchmarks.bench_backtest [--assets 30] [--days 365]
+Runs backtest.simulate for the 360-config grid (3 ladders x 4 cool-offs x 5 drift
+bands x 3 minimum trades x 2 band fractions) over a random-walk history of
+``--assets`` equally targeted assets: ``--days`` daily closes, then the same span
+hourly. No database is involved; this times the replay loop only.
+"""
+from __future__ import annotations
+import argparse
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from balancer.backtest import History, config_grid, simulate
+from balancer.rules_engine import PortfolioState
+
+
+def _grid():
+    return config_grid(multiples=[(2, 3, 5), (1.5, 2), (3, 5, 10)], cooloff_days=[1, 3, 7, 14],
+                       drift_band=[0.005, 0.01, 0.02, 0.05, 0.1], min_trade_usd=[10, 100, 1000],
+                       band_fraction=[0, 0.5])
+
+
+def _history(n: int, steps: int, tier: str, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    vol = 0.01 if tier == "hour" else 0.04
+    px = 100.0 * np.exp(np.cumsum(rng.normal(0.0, vol, (steps, n)), axis=0))
+    step = np.timedelta64(1 if tier == "hour" else 24, "h")
+    times = np.datetime64("2024-01-01T00:00", "us") + np.arange(steps) * step
+    hist = History(tier=tier, times=times, px_usd=px, gbp_usd=np.full(steps, 1.25))
+    state = PortfolioState(
+        portfolio_id=1, asset_ids=np.arange(1, n + 1), symbols=[f"A{i}" for i in range(1, n + 1)],
+        coins=np.full(n, 10.0), avg_cost=np.full(n, 90.0), cost_is_gbp=np.zeros(n, dtype=bool),
+        px_usd=px[0], px_gbp=px[0] / 1.25, gbp_usd=1.25, has_target=np.ones(n, dtype=bool),
+        target_weight=np.full(n, 1.0 / n), drift_band=np.full(n, 0.01), min_trade_usd=np.full(n, 10.0),
+        multiples=[2.0, 3.0, 5.0], last_alert_at=np.full((n, 3), np.nan), now=datetime(2025, 1, 1),
+        cooloff=timedelta(days=7),
+    )
+    return state, hist
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--assets", type=int, default=30)
+    ap.add_argument("--days", type=int, default=365)
+    args = ap.parse_args()
+    grid = _grid()
+    for tier, steps in (("day", args.days), ("hour", args.days * 24)):
+        state, hist = _history(args.assets, steps, tier)
+        t0 = time.perf_counter()
+        res = simulate(state, hist, grid)
+        took = time.perf_counter() - t0
+        trades = sum(r["trades"] for r in res)
+        print(f"{tier:4s}: {len(grid)} configs x {args.assets} assets x {steps} steps  "
+              f"{took:7.2f}s  ({took / steps * 1e3:.2f} ms/step, {trades} trades)")
+
+
+if __name__ == "__main__":
+    main()
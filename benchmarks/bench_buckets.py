@@ -0,0 +1,162 @@
+"""Health and compaction query time: strftime()/date() grouping vs stored bucket columns.
+
+Usage: python -m benchmarks.bench_buckets [--assets 50] [--points 43800]
+Builds one synthetic prices table (default ~2.2M rows: 50 assets x 5y hourly)
+in a throwaway SQLite file, never the configured DB_PATH, and times the same
+questions asked both ways, grouped over all assets and as the original health
+check asked them (one query per asset). Compaction is timed on copies of that file; the
+old NOT IN pass grows super-linearly, so use --skip-compaction at full size.
+"""
+from __future__ import annotations
+import argparse
+import shutil
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from balancer.db import Base
+from balancer.models import Asset
+from balancer.bulk import insert_prices
+from balancer.buckets import day_bucket, hour_bucket
+from balancer.compaction import compact_prices
+
+NOW = datetime(2025, 6, 1)
+
+
+def _build(path: Path, assets: int, points: int) -> int:
+    engine = create_engine(f"sqlite:///{path}", future=True)
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine, future=True)()
+    db.add_all(Asset(symbol=f"A{i}", name=f"a{i}") for i in range(1, assets + 1))
+    db.commit()
+    start = NOW - timedelta(hours=points)
+    rows = (
+        (aid, "USD", 100.0 + i * 0.01, start + timedelta(hours=i, minutes=(i * 7) % 60))
+        for aid in range(1, assets + 1) for i in range(points)
+    )
+    n = insert_prices(db, rows)
+    db.commit()
+    db.close()
+    engine.dispose()
+    return n
+
+
+def _ts(dt: datetime) -> str:
+    return dt.strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+def _time(conn: sqlite3.Connection, sql: str, params: tuple) -> float:
+    t0 = time.perf_counter()
+    conn.execute(sql, params).fetchall()
+    return time.perf_counter() - t0
+
+
+def bench_health(path: Path) -> None:
+    since_24h, since_1y = NOW - timedelta(hours=24), NOW - timedelta(days=365)
+    queries = {
+        "hourly 24h": (
+            "SELECT asset_id, COUNT(DISTINCT strftime('%Y-%m-%d %H', at)) FROM prices "
+            "WHERE ccy = 'USD' AND at >= ? GROUP BY asset_id",
+            (_ts(since_24h),),
+            "SELECT asset_id, COUNT(DISTINCT hour_bucket) FROM prices "
+            "WHERE ccy = 'USD' AND hour_bucket >= ? AND at >= ? GROUP BY asset_id",
+            (hour_bucket(since_24h), _ts(since_24h)),
+        ),
+        "daily 365d": (
+            "SELECT asset_id, COUNT(DISTINCT date(at)) FROM prices "
+            "WHERE ccy = 'USD' AND at >= ? GROUP BY asset_id",
+            (_ts(since_1y),),
+            "SELECT asset_id, COUNT(DISTINCT day_bucket) FROM prices "
+            "WHERE ccy = 'USD' AND day_bucket >= ? AND at >= ? GROUP BY asset_id",
+            (day_bucket(since_1y), _ts(since_1y)),
+        ),
+    }
+    conn = sqlite3.connect(path)
+    try:
+        for name, (old_sql, old_p, new_sql, new_p) in queries.items():
+            old, new = _time(conn, old_sql, old_p), _time(conn, new_sql, new_p)
+            print(f"health {name:11s} strftime: {old:8.3f}s  bucket: {new:8.3f}s  ({old / max(new, 1e-9):.1f}x)")
+        for name, (old_sql, old_p, new_sql, new_p) in queries.items():
+            # The pre-bucket health check: one query per asset
+            old, new = (_per_asset(conn, sql.replace("GROUP BY asset_id", ""), p) for sql, p in
+                        ((old_sql, old_p), (new_sql, new_p)))
+            print(f"health {name:11s} per-asset strftime: {old:8.3f}s  per-asset bucket: {new:8.3f}s")
+    finally:
+        conn.close()
+
+
+def _per_asset(conn: sqlite3.Connection, sql: str, params: tuple) -> float:
+    ids = [r[0] for r in conn.execute("SELECT id FROM assets")]
+    sql = sql.replace("WHERE ", "WHERE asset_id = ? AND ", 1)
+    t0 = time.perf_counter()
+    for aid in ids:
+        conn.execute(sql, (aid, *params)).fetchall()
+    return time.perf_counter() - t0
+
+
+def _compact_strftime(path: Path) -> float:
+    # The pre-bucket full pass: grouped MAX(at) over strftime()/date() per tier
+    tiers = [
+        ("strftime('%Y-%m-%d %H:00:00', at)", NOW - timedelta(hours=24), None),
+        ("date(at)", NOW - timedelta(days=365), NOW - timedelta(hours=24)),
+        ("strftime('%Y-%m-01', at)", None, NOW - timedelta(days=365)),
+    ]
+    conn = sqlite3.connect(path)
+    t0 = time.perf_counter()
+    try:
+        for expr, lo, hi in tiers:
+            lo_s, hi_s = _ts(lo) if lo else "", _ts(hi) if hi else "9999-12-31 23:59:59.999999"
+            conn.execute(
+                f"""
+                DELETE FROM prices WHERE at >= ? AND at < ?
+                  AND (asset_id, ccy, at) NOT IN (
+                    SELECT asset_id, ccy, MAX(at) FROM prices WHERE at >= ? AND at < ?
+                    GROUP BY asset_id, ccy, {expr}
+                  )
+                """,
+                (lo_s, hi_s, lo_s, hi_s),
+            )
+        conn.commit()
+    finally:
+        conn.close()
+    return time.perf_counter() - t0
+
+
+def _compact_buckets(path: Path) -> float:
+    engine = create_engine(f"sqlite:///{path}", future=True)
+    try:
+        t0 = time.perf_counter()
+        compact_prices(now=NOW, full=True, bind=engine)
+        return time.perf_counter() - t0
+    finally:
+        engine.dispose()
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--assets", type=int, default=50)
+    ap.add_argument("--points", type=int, default=24 * 365 * 5, help="hourly points per asset (default: 5y)")
+    ap.add_argument("--skip-compaction", action="store_true")
+    args = ap.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        base = Path(tmp) / "base.db"
+        t0 = time.perf_counter()
+        rows = _build(base, args.assets, args.points)
+        print(f"rows: {rows}  (built in {time.perf_counter() - t0:.1f}s)")
+        bench_health(base)
+        if args.skip_compaction:
+            return
+        shutil.copy(base, Path(tmp) / "old.db")
+        shutil.copy(base, Path(tmp) / "new.db")
+        old = _compact_strftime(Path(tmp) / "old.db")
+        new = _compact_buckets(Path(tmp) / "new.db")
+        print(f"compaction full     strftime: {old:8.3f}s  bucket: {new:8.3f}s  ({old / max(new, 1e-9):.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
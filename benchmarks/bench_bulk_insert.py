@@ -0,0 +1,79 @@
+"""Rows/sec for writing price series: per-object ORM adds vs the bulk writer.
+
+Usage: python -m benchmarks.bench_bulk_insert [--assets 20] [--points 8760]
+Runs against throwaway SQLite files, never the configured DB_PATH.
+"""
+from __future__ import annotations
+import argparse
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from balancer.db import Base
+from balancer.models import Asset, Price
+from balancer.bulk import insert_prices
+
+
+def _session(path: Path):
+    engine = create_engine(f"sqlite:///{path}", future=True)
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine, future=True)()
+
+
+def _rows(assets: int, points: int):
+    start = datetime(2024, 1, 1)
+    for aid in range(1, assets + 1):
+        for i in range(points):
+            yield aid, "USD", 100.0 + i * 0.01, start + timedelta(hours=i)
+
+
+def _seed_assets(db, assets: int) -> None:
+    if db.query(Asset).count():
+        return
+    db.add_all(Asset(symbol=f"A{i}", name=f"a{i}") for i in range(1, assets + 1))
+    db.commit()
+
+
+def bench_orm(path: Path, assets: int, points: int) -> float:
+    db = _session(path)
+    _seed_assets(db, assets)
+    t0 = time.perf_counter()
+    for aid, ccy, price, at in _rows(assets, points):
+        db.add(Price(asset_id=aid, ccy=ccy, price=price, at=at))
+    db.commit()
+    return time.perf_counter() - t0
+
+
+def bench_bulk(path: Path, assets: int, points: int, batch_size: int | None) -> float:
+    db = _session(path)
+    _seed_assets(db, assets)
+    t0 = time.perf_counter()
+    insert_prices(db, _rows(assets, points), batch_size=batch_size)
+    db.commit()
+    return time.perf_counter() - t0
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--assets", type=int, default=20)
+    ap.add_argument("--points", type=int, default=24 * 365, help="points per asset (default: 1y hourly)")
+    ap.add_argument("--batch-size", type=int, default=None)
+    args = ap.parse_args()
+    total = args.assets * args.points
+    with tempfile.TemporaryDirectory() as tmp:
+        orm = bench_orm(Path(tmp) / "orm.db", args.assets, args.points)
+        bulk = bench_bulk(Path(tmp) / "bulk.db", args.assets, args.points, args.batch_size)
+        # Re-running the same rows exercises the ON CONFLICT DO NOTHING path
+        again = bench_bulk(Path(tmp) / "bulk.db", args.assets, args.points, args.batch_size)
+    print(f"rows: {total}")
+    print(f"orm add():         {orm:8.2f}s  {total / orm:12,.0f} rows/s")
+    print(f"bulk insert:       {bulk:8.2f}s  {total / bulk:12,.0f} rows/s  ({orm / bulk:.1f}x)")
+    print(f"bulk (duplicates): {again:8.2f}s  {total / again:12,.0f} rows/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Health check time: per-asset COUNT(DISTINCT bucket) scans vs the coverage bitmaps.
+
+Usage: python -m benchmarks.bench_coverage [--assets 500] [--days 365]
+Builds a synthetic, compacted-shape DB (hourly rows for the last 72h, one row
+per day before that) for ``--assets`` held assets in a throwaway SQLite file,
+never the configured DB_PATH, then times the same 24h / 365d coverage answers
+three ways: one COUNT(DISTINCT) query per asset (the web health route), the
+grouped bucket-column queries verify_health used before, and verify_health
+reading price_coverage / fx_coverage.
+"""
+from __future__ import annotations
+import argparse
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta, UTC
+from pathlib import Path
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from balancer import health
+from balancer.buckets import day_bucket, hour_bucket
+from balancer.bulk import insert_fx, insert_prices
+from balancer.db import Base
+from balancer.models import Asset, Portfolio, Position
+
+NOW = datetime.now(UTC).replace(tzinfo=None)
+
+
+def _build(path: Path, assets: int, days: int) -> int:
+    engine = create_engine(f"sqlite:///{path}", future=True)
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine, future=True)
+    with Session() as db:
+        pf = Portfolio(name="Default")
+        db.add(pf)
+        db.add_all(Asset(symbol=f"A{i}", name=f"a{i}") for i in range(1, assets + 1))
+        db.flush()
+        db.add_all(Position(portfolio_id=pf.id, asset_id=i, coins=1.0) for i in range(1, assets + 1))
+        db.commit()
+    ats = [NOW - timedelta(hours=h) for h in range(72)]
+    ats += [NOW - timedelta(days=d, hours=1) for d in range(3, days + 1)]
+    n = 0
+    with engine.begin() as conn:
+        for aid in range(1, assets + 1):
+            n += insert_prices(conn, [(aid, "USD", 100.0 + i, at) for i, at in enumerate(ats)])
+        insert_fx(conn, [(b, "USD", 1.0, at) for b in ("GBP", "BTC") for at in ats])
+    engine.dispose()
+    return n
+
+
+def _per_asset(conn: sqlite3.Connection) -> None:
+    ids = [r[0] for r in conn.execute("SELECT asset_id FROM positions WHERE coins > 0")]
+    h, d = hour_bucket(NOW), day_bucket(NOW)
+    for aid in ids:
+        conn.execute("SELECT COUNT(DISTINCT hour_bucket) FROM prices WHERE asset_id = ? AND ccy = 'USD' "
+                     "AND hour_bucket BETWEEN ? AND ?", (aid, h - 23, h)).fetchone()
+        conn.execute("SELECT COUNT(DISTINCT day_bucket) FROM prices WHERE asset_id = ? AND ccy = 'USD' "
+                     "AND day_bucket BETWEEN ? AND ?", (aid, d - 364, d)).fetchone()
+
+
+def _grouped(conn: sqlite3.Connection) -> None:
+    h, d = hour_bucket(NOW), day_bucket(NOW)
+    for col, lo, hi in (("hour_bucket", h - 23, h), ("day_bucket", d - 364, d)):
+        conn.execute(f"SELECT asset_id, COUNT(DISTINCT {col}) FROM prices WHERE ccy = 'USD' "
+                     f"AND {col} BETWEEN ? AND ? GROUP BY asset_id", (lo, hi)).fetchall()
+        conn.execute(f"SELECT base_ccy, COUNT(DISTINCT {col}) FROM fx_rates WHERE quote_ccy = 'USD' "
+                     f"AND {col} BETWEEN ? AND ? GROUP BY base_ccy", (lo, hi)).fetchall()
+
+
+def _best(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--assets", type=int, default=500)
+    ap.add_argument("--days", type=int, default=365)
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "cov.db"
+        t0 = time.perf_counter()
+        rows = _build(path, args.assets, args.days)
+        print(f"rows: {rows}  (built in {time.perf_counter() - t0:.1f}s)")
+        conn = sqlite3.connect(path)
+        engine = create_engine(f"sqlite:///{path}", future=True)
+        health.SessionLocal = sessionmaker(bind=engine, future=True)
+        try:
+            per_asset = _best(lambda: _per_asset(conn), args.repeat)
+            grouped = _best(lambda: _grouped(conn), args.repeat)
+            bitmap = _best(health.verify_health, args.repeat)
+        finally:
+            conn.close()
+            engine.dispose()
+        print(f"per-asset COUNT DISTINCT: {per_asset:8.4f}s")
+        print(f"grouped COUNT DISTINCT:   {grouped:8.4f}s")
+        print(f"verify_health (coverage): {bitmap:8.4f}s  "
+              f"({per_asset / max(bitmap, 1e-9):.1f}x / {grouped / max(bitmap, 1e-9):.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,12 @@
 import { NextResponse } from 'next/server'
 import path from 'path'
-import Database from 'better-sqlite3'
+import { openReadonlyDb } from '@/lib/sqlite'
 import { getProjectRoot, getDbPath } from '@/lib/db-config'
 
 export async function GET() {
   const projectRoot = getProjectRoot()
   const dbPath = getDbPath()
-  const db = new Database(dbPath)
+  const db = openReadonlyDb(dbPath)
   try {
     const asOfRow = db.prepare("SELECT at AS as_of FROM prices ORDER BY at DESC LIMIT 1").get() as { as_of?: string } | undefined
     const posRows = db.prepare(`
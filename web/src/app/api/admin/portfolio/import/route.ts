@@ -1,6 +1,6 @@
 import { NextResponse } from 'next/server'
 import path from 'path'
-import Database from 'better-sqlite3'
+import { openWritableDb } from '@/lib/sqlite'
 import { getProjectRoot, getDbPath } from '@/lib/db-config'
 
 export async function POST(req: Request) {
@@ -10,7 +10,7 @@ export async function POST(req: Request) {
   }
   const projectRoot = getProjectRoot()
   const dbPath = getDbPath()
-  const db = new Database(dbPath)
+  const db = openWritableDb(dbPath)
   try {
     const portfolioName = (payload.portfolio as string) || process.env.PORTFOLIO_NAME || 'Default'
     const getPf = db.prepare("SELECT id FROM portfolios WHERE name = ?")
@@ -1,11 +1,61 @@
 import { NextResponse } from 'next/server'
 import path from 'path'
 import fs from 'fs/promises'
-import Database from 'better-sqlite3'
+import { openReadonlyDb } from '@/lib/sqlite'
 import { ONE_HOUR_MS, ONE_DAY_MS, days } from '@/lib/time-utils'
 import { pctChange } from '@/lib/math-utils'
 import { getProjectRoot, getDbPath, getCacheDir } from '@/lib/db-config'
 
+// Precomputed changes older than this (or than the newest stored price) are stale:
+// the live path below answers instead, as it did with its 10-minute cache
+const MAX_AGE_MS = Number(process.env.CHANGES_MAX_AGE_MINUTES || 10) * 60 * 1000
+
+// SQLite DateTime text is naive UTC ("YYYY-MM-DD HH:MM:SS.ffffff")
+function utcMs(value: string): number {
+  return Date.parse(value.replace(' ', 'T') + 'Z')
+}
+
+// Changes precomputed by the backend runner (balancer/changes.py) for the held assets;
+// null when the table is missing (older DB), is stale or has nothing for this currency yet
+function readPrecomputed(dbPath: string, ccy: string): Record<string, any> | null {
+  const db = openReadonlyDb(dbPath)
+  try {
+    const hasTable = !!db.prepare("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'price_changes'").get()
+    if (!hasTable) return null
+    const fresh = db.prepare(`
+      SELECT MAX(computed_at) AS computed_at,
+             MAX(computed_at) >= (SELECT COALESCE(MAX(at), '') FROM latest_prices) AS current
+      FROM price_changes WHERE ccy = ?
+    `).get(ccy) as { computed_at: string | null, current: number | null } | undefined
+    if (!fresh?.computed_at || !fresh.current) return null
+    const age = Date.now() - utcMs(fresh.computed_at)
+    if (!(age < MAX_AGE_MS)) return null
+    const rows = db.prepare(`
+      SELECT a.symbol, c.latest, c.h1, c.d1, c.d7, c.d30, c.d60, c.d90, c.d365, c.since_first
+      FROM positions p
+      JOIN assets a ON a.id = p.asset_id
+      JOIN portfolios pf ON pf.id = p.portfolio_id
+      JOIN price_changes c ON c.asset_id = a.id AND c.ccy = ?
+      WHERE a.active = 1 AND (pf.name = COALESCE(?, pf.name))
+    `).all(ccy, process.env.PORTFOLIO_NAME || null) as Array<{
+      symbol: string, latest: number, h1: number | null, d1: number | null, d7: number | null, d30: number | null,
+      d60: number | null, d90: number | null, d365: number | null, since_first: number | null
+    }>
+    if (rows.length === 0) return null
+    const changes: Record<string, any> = {}
+    for (const r of rows) {
+      changes[r.symbol] = {
+        ccy,
+        latest: r.latest,
+        pcts: { h1: r.h1, d1: r.d1, d7: r.d7, d30: r.d30, d60: r.d60, d90: r.d90, d365: r.d365, max: r.since_first },
+      }
+    }
+    return { ok: true, ccy, changes }
+  } finally {
+    db.close()
+  }
+}
+
 export async function GET(req: Request) {
   try {
     const { searchParams } = new URL(req.url)
@@ -15,6 +65,11 @@ export async function GET(req: Request) {
     const cacheDir = getCacheDir()
     const cacheFile = path.join(cacheDir, `changes-${ccy}.json`)
 
+    const precomputed = readPrecomputed(dbPath, ccy)
+    if (precomputed) return NextResponse.json(precomputed)
+
+    // Fallback: compute per request from the raw history
+
     // Attempt to serve from cache (10 minutes TTL)
     try {
       const stat = await fs.stat(cacheFile)
@@ -24,7 +79,7 @@ export async function GET(req: Request) {
         return NextResponse.json(cached)
       }
     } catch {}
-    const db = new Database(dbPath)
+    const db = openReadonlyDb(dbPath)
     try {
       // Collect latest price per asset for the requested currency
       const posRows = db.prepare(`
@@ -35,11 +90,25 @@ export async function GET(req: Request) {
         WHERE a.active = 1 AND (pf.name = COALESCE(?, pf.name))
       `).all(process.env.PORTFOLIO_NAME || null) as Array<{ asset_id: number, symbol: string }>
 
-      const qLatestUsd = db.prepare("SELECT price, at FROM prices WHERE asset_id = ? AND ccy = 'USD' ORDER BY at DESC LIMIT 1")
+      // latest_prices is maintained by the backend on every write; fall back to scanning prices on older DBs
+      const hasLatest = !!db.prepare("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'latest_prices'").get()
+      const qLatestUsd = hasLatest
+        ? db.prepare("SELECT price, at FROM latest_prices WHERE asset_id = ? AND ccy = 'USD'")
+        : db.prepare("SELECT price, at FROM prices WHERE asset_id = ? AND ccy = 'USD' ORDER BY at DESC LIMIT 1")
       const qAtOrBeforeUsd = db.prepare("SELECT price, at FROM prices WHERE asset_id = ? AND ccy = 'USD' AND at <= ? ORDER BY at DESC LIMIT 1")
       const qFxAtOrBefore = db.prepare("SELECT rate FROM fx_rates WHERE base_ccy = ? AND quote_ccy = 'USD' AND at <= ? ORDER BY at DESC LIMIT 1")
+      // Months older than the archive cutoff leave prices for Parquet files, but only after
+      // compaction folds them into the monthly rollups, whose opens keep the earliest price
+      const hasMonthly = !!db.prepare("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'prices_monthly'").get()
+      const qFirstUsd = db.prepare("SELECT price, at FROM prices WHERE asset_id = ? AND ccy = 'USD' ORDER BY at ASC LIMIT 1")
+      const qFirstMonthlyUsd = hasMonthly
+        ? db.prepare("SELECT open AS price, open_at AS at FROM prices_monthly WHERE asset_id = ? AND ccy = 'USD' ORDER BY bucket ASC LIMIT 1")
+        : null
+      const qFxMonthlyAtOrBefore = hasMonthly
+        ? db.prepare("SELECT open AS rate FROM fx_monthly WHERE base_ccy = ? AND quote_ccy = 'USD' AND open_at <= ? ORDER BY bucket DESC LIMIT 1")
+        : null
 
-      const nowRow = db.prepare('SELECT COALESCE(MAX(at), CURRENT_TIMESTAMP) AS now FROM prices').get() as { now?: string }
+      const nowRow = db.prepare(`SELECT COALESCE(MAX(at), CURRENT_TIMESTAMP) AS now FROM ${hasLatest ? 'latest_prices' : 'prices'}`).get() as { now?: string }
       const nowISO = nowRow?.now || new Date().toISOString()
       const now = new Date(nowISO).getTime()
 
@@ -81,12 +150,17 @@ export async function GET(req: Request) {
         const p90d = convertedAtOrBefore(at90d)
         const p365d = convertedAtOrBefore(at365d)
 
-        const firstUsdRow = db.prepare("SELECT price, at FROM prices WHERE asset_id = ? AND ccy = 'USD' ORDER BY at ASC LIMIT 1").get(r.asset_id) as { price?: number, at?: string } | undefined
+        const rawFirst = qFirstUsd.get(r.asset_id) as { price?: number, at?: string } | undefined
+        const monthlyFirst = qFirstMonthlyUsd?.get(r.asset_id) as { price?: number, at?: string } | undefined
+        const firstUsdRow = monthlyFirst?.at && (!rawFirst?.at || monthlyFirst.at < rawFirst.at) ? monthlyFirst : rawFirst
         const pMax = (() => {
           const usd = firstUsdRow?.price ?? null
           if (usd === null) return null
           if (ccy === 'USD') return usd
-          const fx = (qFxAtOrBefore.get(ccy, firstUsdRow?.at || new Date(0).toISOString()) as { rate?: number } | undefined)?.rate ?? null
+          const firstAt = firstUsdRow?.at || new Date(0).toISOString()
+          // Compaction prunes early FX rows too; fall back to the monthly open
+          const fx = (qFxAtOrBefore.get(ccy, firstAt) as { rate?: number } | undefined)?.rate
+            ?? (qFxMonthlyAtOrBefore?.get(ccy, firstAt) as { rate?: number } | undefined)?.rate ?? null
           if (!fx || fx <= 0) return null
           return usd / fx
         })()
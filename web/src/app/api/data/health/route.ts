@@ -1,47 +1,77 @@
 import { NextResponse } from 'next/server'
 import path from 'path'
-import Database from 'better-sqlite3'
+import { openReadonlyDb } from '@/lib/sqlite'
 import { getProjectRoot, getDbPath } from '@/lib/db-config'
 
+type Coverage = { base: number; bits: Buffer }
+
+// Buckets in [lo, hi] with data in a coverage bitmap (little-endian bytes, bit i = bucket base + i),
+// same as balancer.coverage.count_present
+function countPresent(cov: Coverage | undefined, lo: number, hi: number): number {
+  if (!cov) return 0
+  let n = 0
+  for (let b = Math.max(lo, cov.base); b <= hi; b++) {
+    const i = b - cov.base
+    const byte = i >> 3
+    if (byte >= cov.bits.length) break
+    if ((cov.bits[byte] >> (i & 7)) & 1) n += 1
+  }
+  return n
+}
+
 export async function GET() {
   try {
     const projectRoot = getProjectRoot()
     const dbPath = getDbPath()
-    const db = new Database(dbPath)
+    const db = openReadonlyDb(dbPath)
     try {
       const nowRow = db.prepare("SELECT COALESCE(MAX(at), CURRENT_TIMESTAMP) AS now FROM prices").get() as { now?: string }
       const nowISO = nowRow?.now || new Date().toISOString()
       const now = new Date(nowISO)
-      const since24hISO = new Date(now.getTime() - 24 * 60 * 60 * 1000).toISOString()
-      const since1yISO = new Date(now.getTime() - 365 * 24 * 60 * 60 * 1000).toISOString()
 
-      const assetIds = db.prepare("SELECT id FROM assets WHERE active = 1").all() as Array<{ id: number }>
+      // The last 24 hour buckets and 365 day buckets (epoch hours / days), each ending with the
+      // current one, as balancer.health._windows
+      const h = Math.floor(now.getTime() / 3600000)
+      const d = Math.floor(now.getTime() / 86400000)
+      const win = { hour: [h - 23, h], day: [d - 364, d] } as const
 
-      const qPriceHourly = db.prepare("SELECT COUNT(DISTINCT strftime('%Y-%m-%d %H', at)) AS c FROM prices WHERE asset_id = ? AND ccy = 'USD' AND at >= ?")
-      const qPriceDaily = db.prepare("SELECT COUNT(DISTINCT date(at)) AS c FROM prices WHERE asset_id = ? AND ccy = 'USD' AND at >= ?")
+      // One query per coverage table: the bitmaps the backend keeps current on every price / FX
+      // write (balancer.coverage), instead of a COUNT(DISTINCT bucket) scan of prices per asset
+      const priceRows = db.prepare(
+        `SELECT a.id AS id, c.tier AS tier, c.base AS base, c.bits AS bits
+           FROM assets a
+           LEFT JOIN price_coverage c ON c.asset_id = a.id AND c.ccy = 'USD'
+          WHERE a.active = 1`
+      ).all() as Array<{ id: number; tier: string | null; base: number | null; bits: Buffer | null }>
+      const fxRows = db.prepare(
+        "SELECT base_ccy, tier, base, bits FROM fx_coverage WHERE quote_ccy = 'USD' AND base_ccy IN ('GBP', 'BTC')"
+      ).all() as Array<{ base_ccy: string; tier: string; base: number; bits: Buffer }>
 
-      const qFxHourly = db.prepare("SELECT COUNT(DISTINCT strftime('%Y-%m-%d %H', at)) AS c FROM fx_rates WHERE base_ccy = ? AND quote_ccy = 'USD' AND at >= ?")
-      const qFxDaily = db.prepare("SELECT COUNT(DISTINCT date(at)) AS c FROM fx_rates WHERE base_ccy = ? AND quote_ccy = 'USD' AND at >= ?")
+      const assets = new Map<number, Record<string, Coverage>>()
+      for (const r of priceRows) {
+        const entry = assets.get(r.id) ?? {}
+        if (r.tier && r.base !== null && r.bits) entry[r.tier] = { base: r.base, bits: r.bits }
+        assets.set(r.id, entry)
+      }
+      const fx: Record<string, Record<string, Coverage>> = { GBP: {}, BTC: {} }
+      for (const r of fxRows) fx[r.base_ccy][r.tier] = { base: r.base, bits: r.bits }
 
       let prices_hourly_missing = 0
       let prices_daily_missing = 0
-
-      for (const a of assetIds) {
-        const h = (qPriceHourly.get(a.id, since24hISO) as { c?: number } | undefined)?.c ?? 0
-        if ((h || 0) < 20) prices_hourly_missing += 1
-        const d = (qPriceDaily.get(a.id, since1yISO) as { c?: number } | undefined)?.c ?? 0
-        if ((d || 0) < 300) prices_daily_missing += 1
+      for (const cov of assets.values()) {
+        if (countPresent(cov.hour, ...win.hour) < 20) prices_hourly_missing += 1
+        if (countPresent(cov.day, ...win.day) < 300) prices_daily_missing += 1
       }
 
-      const gbp_h = (qFxHourly.get('GBP', since24hISO) as { c?: number } | undefined)?.c ?? 0
-      const gbp_d = (qFxDaily.get('GBP', since1yISO) as { c?: number } | undefined)?.c ?? 0
-      const btc_h = (qFxHourly.get('BTC', since24hISO) as { c?: number } | undefined)?.c ?? 0
-      const btc_d = (qFxDaily.get('BTC', since1yISO) as { c?: number } | undefined)?.c ?? 0
+      const gbp_h = countPresent(fx.GBP.hour, ...win.hour)
+      const gbp_d = countPresent(fx.GBP.day, ...win.day)
+      const btc_h = countPresent(fx.BTC.hour, ...win.hour)
+      const btc_d = countPresent(fx.BTC.day, ...win.day)
 
       const payload = {
         ok: true,
         now: nowISO,
-        assets_total: assetIds.length,
+        assets_total: assets.size,
         prices: { hourly_24h_missing: prices_hourly_missing, daily_1y_missing: prices_daily_missing },
         fx: {
           GBPUSD: { hourly_24h_missing: gbp_h < 20 ? 1 : 0, daily_1y_missing: gbp_d < 300 ? 1 : 0 },
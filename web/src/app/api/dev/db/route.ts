@@ -1,6 +1,6 @@
 import { NextResponse } from 'next/server'
 import path from 'path'
-import Database from 'better-sqlite3'
+import { openReadonlyDb } from '@/lib/sqlite'
 import fs from 'fs'
 import { getProjectRoot, getDbPath } from '@/lib/db-config'
 
@@ -24,7 +24,7 @@ export async function GET(request: Request) {
       return NextResponse.json({ error: 'Database file not found' }, { status: 404 })
     }
     
-    const db = new Database(dbPath)
+    const db = openReadonlyDb(dbPath)
     
     try {
       // Get all table names
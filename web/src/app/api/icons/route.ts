@@ -1,7 +1,7 @@
 import { NextResponse } from 'next/server'
 import path from 'path'
 import fs from 'fs/promises'
-import Database from 'better-sqlite3'
+import { openReadonlyDb } from '@/lib/sqlite'
 import { getProjectRoot, getDbPath, getCacheDir } from '@/lib/db-config'
 
 type CacheFile = { updatedAt: number, images: Record<string, string>, caps: Record<string, number> }
@@ -30,7 +30,7 @@ export async function GET() {
 
     // compute ids from DB active positions
     const dbPath = getDbPath()
-    const db = new Database(dbPath)
+    const db = openReadonlyDb(dbPath)
     let ids: string[] = []
     try {
       const rows = db.prepare(`
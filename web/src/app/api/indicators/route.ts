@@ -1,13 +1,13 @@
 import { NextResponse } from 'next/server'
 import path from 'path'
-import Database from 'better-sqlite3'
+import { openReadonlyDb } from '@/lib/sqlite'
 import { getProjectRoot, getDbPath } from '@/lib/db-config'
 
 export async function GET() {
   try {
     const projectRoot = getProjectRoot()
     const dbPath = getDbPath()
-    const db = new Database(dbPath)
+    const db = openReadonlyDb(dbPath)
     try {
       const since = new Date(Date.now() - 30 * 24 * 60 * 60 * 1000).toISOString()
       const all = db.prepare('SELECT name, value, at FROM indicators WHERE at >= ? ORDER BY at ASC').all(since) as { name: string, value: number, at: string }[]
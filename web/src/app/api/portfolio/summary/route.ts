@@ -1,6 +1,6 @@
 import { NextResponse } from 'next/server'
 import path from 'path'
-import Database from 'better-sqlite3'
+import { openReadonlyDb } from '@/lib/sqlite'
 import { ONE_DAY_MS } from '@/lib/time-utils'
 import { getProjectRoot, getDbPath } from '@/lib/db-config'
 
@@ -8,7 +8,7 @@ export async function GET() {
   try {
     const projectRoot = getProjectRoot()
     const dbPath = getDbPath()
-    const db = new Database(dbPath)
+    const db = openReadonlyDb(dbPath)
     try {
       const now = new Date()
       const t1d = new Date(now.getTime() - ONE_DAY_MS).toISOString()
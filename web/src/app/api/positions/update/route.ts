@@ -1,6 +1,6 @@
 import { NextRequest, NextResponse } from 'next/server'
 import path from 'path'
-import Database from 'better-sqlite3'
+import { openWritableDb } from '@/lib/sqlite'
 import { getProjectRoot, getDbPath } from '@/lib/db-config'
 
 export async function POST(req: NextRequest) {
@@ -25,7 +25,7 @@ export async function POST(req: NextRequest) {
     const dbPath = body.db_path || getDbPath()
     const portfolioName = body.portfolio_name || process.env.PORTFOLIO_NAME || 'Default'
 
-    const db = new Database(dbPath)
+    const db = openWritableDb(dbPath)
     try {
       const tx = db.transaction(() => {
         const pf = db.prepare('SELECT id FROM portfolios WHERE name = ?').get(portfolioName) as { id: number } | undefined
@@ -0,0 +1,31 @@
+/**
+ * Shared better-sqlite3 connection helpers.
+ * The Python backend keeps balancer.db in WAL mode, so read-only connections
+ * never block (or get blocked by) the hourly writers; the busy timeout covers
+ * the brief checkpoint/write windows for the few routes that write.
+ */
+
+import Database from 'better-sqlite3'
+import { getDbPath } from './db-config'
+
+/**
+ * Busy timeout in milliseconds (mirrors SQLITE_BUSY_TIMEOUT_MS used by the backend).
+ */
+export function getBusyTimeoutMs(): number {
+  const v = Number(process.env.SQLITE_BUSY_TIMEOUT_MS)
+  return Number.isFinite(v) && v >= 0 ? v : 5000
+}
+
+/**
+ * Open the database read-only for API routes that only query.
+ */
+export function openReadonlyDb(dbPath: string = getDbPath()): Database.Database {
+  return new Database(dbPath, { readonly: true, fileMustExist: true, timeout: getBusyTimeoutMs() })
+}
+
+/**
+ * Open the database for routes that write (admin import, position updates).
+ */
+export function openWritableDb(dbPath: string = getDbPath()): Database.Database {
+  return new Database(dbPath, { timeout: getBusyTimeoutMs() })
+}